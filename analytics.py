@@ -0,0 +1,92 @@
+"""
+向量化的統計分析（NumPy / pandas），不使用逐列的 Python 迴圈。
+
+所有函式都接受含 date 欄位的 DataFrame（或日期 Series），
+同一天有多筆資料時（例如多位使用者）以平均值合併。
+"""
+import numpy as np
+import pandas as pd
+
+ROLLING_WINDOWS = (7, 28)
+DEFAULT_STEP_GOAL = 8000
+
+
+def week_start(dates):
+    """回傳每個日期所屬週（週一起算）的起始日，與 to_period("W").start_time 相同。"""
+    dates = pd.to_datetime(dates).dt.normalize()
+    return dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+
+
+def month_start(dates):
+    """回傳每個日期所屬月份的第一天。"""
+    values = pd.to_datetime(dates).to_numpy(dtype="datetime64[ns]")
+    return pd.Series(values.astype("datetime64[M]").astype("datetime64[ns]"), index=dates.index, name=dates.name)
+
+
+def bucket(dates, period):
+    """period 為 "W"（週）或 "M"（月）。"""
+    return week_start(dates) if period == "W" else month_start(dates)
+
+
+def daily_series(df, column):
+    """
+    將欄位整理成以日曆日為索引、連續不中斷的 Series；沒有紀錄的日子為 NaN。
+    """
+    if df.empty or column not in df.columns:
+        return pd.Series(dtype=float)
+    # 可為空的整數欄位（Int32）先轉成 float，缺值成為 NaN
+    values = pd.to_numeric(df[column], errors="coerce").astype(float)
+    daily = values.groupby(pd.to_datetime(df["date"]).dt.normalize()).mean()
+    full_range = pd.date_range(daily.index.min(), daily.index.max(), freq="D")
+    return daily.reindex(full_range)
+
+
+def rolling_means(df, column, windows=ROLLING_WINDOWS):
+    """
+    計算以日曆日為單位的移動平均（缺資料的日子不計入分母），
+    回傳 DataFrame：date、原始值與各視窗的平均（欄名 <欄位>_<天數>d）。
+    """
+    daily = daily_series(df, column)
+    result = pd.DataFrame({"date": daily.index, column: daily.to_numpy()})
+    for window in windows:
+        result[f"{column}_{window}d"] = daily.rolling(f"{window}D", min_periods=1).mean().to_numpy()
+    return result
+
+
+def correlation(df, x="sleep_hours", y="screen_time"):
+    """兩個欄位的皮爾森相關係數；有效樣本少於 3 筆或變異為 0 時回傳 NaN。"""
+    if df.empty or x not in df.columns or y not in df.columns:
+        return float("nan")
+    a = pd.to_numeric(df[x], errors="coerce").to_numpy(dtype=float)
+    b = pd.to_numeric(df[y], errors="coerce").to_numpy(dtype=float)
+    valid = ~(np.isnan(a) | np.isnan(b))
+    a, b = a[valid], b[valid]
+    if a.size < 3 or a.std() == 0 or b.std() == 0:
+        return float("nan")
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+def streaks(df, column="steps", threshold=DEFAULT_STEP_GOAL):
+    """
+    計算欄位值 >= threshold 的連續天數（沒有紀錄的日子視為中斷）。
+    回傳 {"current": 目前連續天數, "longest": 最長連續天數,
+          "longest_start": 最長區間起日, "longest_end": 最長區間迄日}。
+    """
+    result = {"current": 0, "longest": 0, "longest_start": None, "longest_end": None}
+    daily = daily_series(df, column)
+    if daily.empty:
+        return result
+    hit = (daily >= threshold).to_numpy()
+    if not hit.any():
+        return result
+    # 以差分找出每段連續達標區間的起點與終點（終點不含）
+    edges = np.diff(np.concatenate(([0], hit.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+    best = int(lengths.argmax())
+    result["longest"] = int(lengths[best])
+    result["longest_start"] = daily.index[starts[best]].date()
+    result["longest_end"] = daily.index[ends[best] - 1].date()
+    result["current"] = int(lengths[-1]) if ends[-1] == len(hit) else 0
+    return result
@@ -1,34 +1,10 @@
 import streamlit as st
-import requests
-import base64
+from assets import apply_background
 
 st.set_page_config(page_title="網路使用與健康促進紀錄", layout="wide")
 
-def get_base64_from_url(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return base64.b64encode(response.content).decode()
-    else:
-        return None
-
-# 背景圖片
-bg_url = "https://storage.googleapis.com/internet_health/upload_bg3.jpg"
-bg_image_base64 = get_base64_from_url(bg_url)
-
-if bg_image_base64:
-    st.markdown(
-        f"""
-        <style>
-        .stApp {{
-            background: url("data:image/jpg;base64,{bg_image_base64}") no-repeat center center fixed;
-            background-size: cover;
-        }}
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-else:
-    st.error("背景圖片載入失敗。")
+# 背景圖片（每個行程只下載一次）
+apply_background()
 
 # 標題的位置
 st.markdown(
@@ -0,0 +1,128 @@
+"""
+靜態資源（背景圖片）服務。
+
+每個行程只下載一次背景圖，並存到本機磁碟快取；之後以 ETag / Last-Modified
+做條件式 GET 重新驗證。編碼後的 CSS 字串會被記住，網路失敗或逾時時退回快取。
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+
+import requests
+import streamlit as st
+
+BG_URL = "https://storage.googleapis.com/internet_health/upload_bg3.jpg"
+ASSET_CACHE_DIR = os.environ.get(
+    "INTERNET_HEALTH_ASSET_CACHE", os.path.join(tempfile.gettempdir(), "internet_health_assets")
+)
+FETCH_TIMEOUT = 5  # 秒
+REVALIDATE_SECONDS = 3600  # 記憶體中的 CSS 超過此時間才向伺服器重新驗證
+
+_lock = threading.Lock()
+_css_cache = {}  # url -> (驗證時間, CSS 字串, 圖片內容雜湊)
+
+
+def _cache_paths(url):
+    key = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(ASSET_CACHE_DIR, key + ".bin"), os.path.join(ASSET_CACHE_DIR, key + ".json")
+
+
+def _read_disk_cache(url):
+    data_path, meta_path = _cache_paths(url)
+    try:
+        with open(data_path, "rb") as f:
+            data = f.read()
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        return data, meta
+    except (OSError, ValueError):
+        return None, {}
+
+
+def _write_disk_cache(url, data, meta):
+    data_path, meta_path = _cache_paths(url)
+    try:
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        # 先寫暫存檔再改名，避免其他行程讀到寫一半的檔案
+        tmp_path = data_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, data_path)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+    except OSError as e:
+        print("Error writing asset cache:", e)
+
+
+def fetch_asset(url):
+    """
+    取得資源內容：有磁碟快取時以條件式 GET 重新驗證，
+    304 或請求失敗時使用快取。完全取不到時回傳 None。
+    """
+    cached, meta = _read_disk_cache(url)
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    except requests.RequestException as e:
+        print("Error fetching asset:", e)
+        return cached
+    if response.status_code == 304 and cached is not None:
+        return cached
+    if response.status_code == 200:
+        meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        _write_disk_cache(url, response.content, meta)
+        return response.content
+    return cached
+
+
+def get_background_css(url=BG_URL):
+    """
+    回傳以 base64 內嵌背景圖的 CSS；同一行程內重複呼叫直接使用記住的字串。
+    取不到圖片時回傳 None。
+    """
+    now = time.monotonic()
+    with _lock:
+        hit = _css_cache.get(url)
+    if hit is not None and now - hit[0] < REVALIDATE_SECONDS:
+        return hit[1]
+    data = fetch_asset(url)
+    if data is None:
+        return hit[1] if hit is not None else None
+    # 內容未變時沿用原字串，不重新編碼
+    digest = hashlib.sha1(data).hexdigest()
+    if hit is not None and hit[2] == digest:
+        css = hit[1]
+    else:
+        encoded = base64.b64encode(data).decode()
+        css = f"""
+        <style>
+        .stApp {{
+            background: url("data:image/jpg;base64,{encoded}") no-repeat center center fixed;
+            background-size: cover;
+        }}
+        </style>
+        """
+    with _lock:
+        _css_cache[url] = (now, css, digest)
+    return css
+
+
+def apply_background(url=BG_URL):
+    """在目前頁面套用背景圖片，失敗時顯示錯誤訊息。"""
+    css = get_background_css(url)
+    if css:
+        st.markdown(css, unsafe_allow_html=True)
+    else:
+        st.error("背景圖片載入失敗。")
@@ -0,0 +1,253 @@
+"""
+儲存層基準測試：在本機的 LocalBucket 上寫入合成資料，量測各操作的延遲、
+尖峰記憶體（tracemalloc）與傳輸量（請求數、下載／上傳位元組），並可存成基準值比較。
+
+用法：
+    python bench.py                              # 預設 1k、10k、100k 筆
+    python bench.py --sizes 1000 1000000         # 指定總筆數（超過一位使用者的天數上限時分給多位使用者）
+    python bench.py --save-baseline              # 將結果存為基準值
+    python bench.py --compare                    # 與基準值比較，退步超過容許範圍時回傳 1
+    python bench.py --root /tmp/bench_bucket     # 以目錄保存物件（預設只在記憶體中）
+    python bench.py --memory --days-per-user 100000 --sizes 10000 100000
+                                                 # 比較 list of dicts 與 RecordTable 常駐的記憶體
+"""
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+from PIL import Image
+
+import common
+import synthetic
+from local_bucket import LocalBucket
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_REPEATS = 5
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")
+TOLERANCE = 0.25  # 比基準值多出 25% 以上視為退步
+COMPARED_METRICS = ["latency_ms", "peak_mb", "bytes_downloaded", "bytes_uploaded", "requests"]
+
+
+def _sample_photo(variant=0):
+    """
+    模擬手機照片：1600x1200 的 JPEG。variant 不為 0 時左上角畫上不同顏色的色塊：
+    上傳前會重新編碼，只在檔尾附加位元組會被丟掉，必須改變像素才能得到不同的內容雜湊。
+    """
+    img = Image.effect_noise((1600, 1200), 64).convert("RGB")
+    if variant:
+        img.paste((variant % 256, variant // 256 % 256, 255), (0, 0, 64, 64))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class _Upload(BytesIO):
+    """模擬 st.file_uploader 回傳的檔案物件。"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _operations(user_id, days):
+    """回傳 [(操作名稱, 準備函式, 量測函式, 是否先清除快取)]；準備函式的結果會傳給量測函式。"""
+    today = datetime.date.today()
+    photo = _sample_photo()
+    removed = iter(today - datetime.timedelta(days=i) for i in range(days))
+    # 照片以內容命名；每次上傳前（不計時）產生像素不同的照片，確保量測到的是實際上傳而非重複略過
+    variants = itertools.count(1)
+
+    def load_all(_):
+        common.load_records(user_id=user_id)
+
+    def load_window(_):
+        common.load_records(start=today - datetime.timedelta(weeks=common.DEFAULT_WEEKS), end=today,
+                            columns=common.NUMERIC_COLUMNS, user_id=user_id)
+
+    def load_records_list(_):
+        return common.load_records(user_id=user_id)
+
+    def save(records):
+        common.save_records(records, user_id=user_id)
+
+    def remove(records):
+        common.remove_record_by_date(next(removed), records, user_id=user_id)
+
+    def reflections(_):
+        common.load_reflections(user_id=user_id)
+
+    def new_photo(_):
+        return _sample_photo(next(variants))
+
+    def upload(data):
+        common.upload_file_to_gcs(_Upload(data, "photo.jpg"), today, "breakfast", user_id=user_id)
+
+    def upload_duplicate(_):
+        common.upload_file_to_gcs(_Upload(photo, "photo.jpg"), today, "breakfast", user_id=user_id)
+
+    return [
+        ("load_records", None, load_all, True),
+        ("load_records (cached)", None, load_all, False),
+        ("load_records (4 weeks)", None, load_window, True),
+        ("save_records", load_records_list, save, True),
+        ("remove_record_by_date", load_records_list, remove, True),
+        ("load_reflections", None, reflections, True),
+        ("upload_file_to_gcs", new_photo, upload, True),
+        ("upload_file_to_gcs (duplicate)", upload_duplicate, upload_duplicate, True),
+    ]
+
+
+def _measure(bucket, prepare, run, cold, repeats):
+    latencies = []
+    for _ in range(repeats):
+        state = prepare(None) if prepare else None
+        if cold:
+            common.invalidate_cache(parsed=True)
+        bucket.reset_stats()
+        start = time.perf_counter()
+        run(state)
+        latencies.append((time.perf_counter() - start) * 1000)
+    transfer = dict(bucket.stats)
+    # 記憶體另外量一次，避免 tracemalloc 的額外負擔影響延遲
+    state = prepare(None) if prepare else None
+    if cold:
+        common.invalidate_cache(parsed=True)
+    tracemalloc.start()
+    try:
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "latency_ms": round(statistics.median(latencies), 2),
+        "latency_ms_min": round(min(latencies), 2),
+        "peak_mb": round(peak / 2**20, 2),
+        **transfer,
+    }
+
+
+def run_benchmarks(sizes, repeats=DEFAULT_REPEATS, days_per_user=synthetic.DAYS_PER_USER, root=None):
+    """對每個總筆數建立新的 LocalBucket、寫入合成資料並量測，回傳結果 list of dicts。"""
+    results = []
+    for size in sizes:
+        bucket = LocalBucket(common.BUCKET_NAME, None if root is None else os.path.join(root, str(size)))
+        common.set_bucket(bucket)
+        print(f"寫入 {size} 筆合成紀錄...", file=sys.stderr)
+        users = synthetic.seed_bucket(size, days_per_user)
+        user_id, days = users[0]
+        for name, prepare, run, cold in _operations(user_id, days):
+            result = _measure(bucket, prepare, run, cold, repeats)
+            results.append({"operation": name, "records": size, "user_records": days, "users": len(users), **result})
+            print(f"  {name}: {result['latency_ms']} ms", file=sys.stderr)
+    return results
+
+
+def _retained_bytes(load):
+    """
+    load() 的回傳值在清除所有快取後仍佔用的記憶體（一個 session 保存它的成本）：
+    Python 物件以 tracemalloc 計算，Arrow 緩衝區以 pyarrow 的配置量計算。
+    """
+    common.invalidate_cache(parsed=True)
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        value = load()
+        common.invalidate_cache(parsed=True)
+        gc.collect()
+        python_bytes = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    size = python_bytes + pa.total_allocated_bytes() - arrow_before
+    del value
+    return size
+
+
+def memory_report(sizes, days_per_user=synthetic.DAYS_PER_USER):
+    """每個總筆數各建立合成資料，比較第一位使用者的全部紀錄以兩種形式保存時的記憶體。"""
+    results = []
+    for size in sizes:
+        common.set_bucket(LocalBucket(common.BUCKET_NAME))
+        print(f"寫入 {size} 筆合成紀錄...", file=sys.stderr)
+        user_id, days = synthetic.seed_bucket(size, days_per_user)[0]
+        as_list = _retained_bytes(lambda: common.load_records(user_id=user_id))
+        as_table = _retained_bytes(lambda: common.current_snapshot(user_id).records)
+        results.append({"user_records": days, "list_of_dicts_mb": round(as_list / 2**20, 2),
+                        "record_table_mb": round(as_table / 2**20, 2), "ratio": round(as_list / max(as_table, 1), 1)})
+    return results
+
+
+def _result_key(result):
+    return f"{result['operation']}@{result['records']}"
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {_result_key(r): {m: r[m] for m in COMPARED_METRICS} for r in results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+
+def compare_baseline(results, path=BASELINE_FILE, tolerance=TOLERANCE):
+    """回傳退步項目 [(操作@筆數, 指標, 基準值, 本次)]；基準中沒有的項目略過。"""
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for result in results:
+        expected = baseline.get(_result_key(result))
+        if expected is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, now = expected.get(metric), result[metric]
+            if before is not None and now > before * (1 + tolerance) and now - before > 1:
+                regressions.append((_result_key(result), metric, before, now))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="internet_health 儲存層基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成紀錄的總筆數")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="每個操作重複的次數")
+    parser.add_argument("--days-per-user", type=int, default=synthetic.DAYS_PER_USER, help="每位使用者的天數上限")
+    parser.add_argument("--root", help="以此目錄保存物件（預設只在記憶體中）")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基準值檔案")
+    parser.add_argument("--save-baseline", action="store_true", help="將結果存為基準值")
+    parser.add_argument("--compare", action="store_true", help="與基準值比較")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="容許的退步比例")
+    parser.add_argument("--memory", action="store_true", help="只比較 list of dicts 與 RecordTable 的記憶體")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        print(pd.DataFrame(memory_report(args.sizes, args.days_per_user)).to_string(index=False))
+        return 0
+
+    results = run_benchmarks(args.sizes, args.repeats, args.days_per_user, args.root)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    status = 0
+    if args.compare:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        for key, metric, before, now in regressions:
+            print(f"退步：{key} {metric} {before} -> {now}")
+        if regressions:
+            status = 1
+        else:
+            print("與基準值相比沒有退步。")
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"基準值已存至 {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
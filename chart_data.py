@@ -0,0 +1,147 @@
+"""
+echarts 圖表資料層。
+
+依選取區間長度自動決定解析度（日／週／月），點數超過預算時以 LTTB
+（Largest-Triangle-Three-Buckets）降採樣，並把所有指標放在同一份 dataset 中，
+多個子圖共用同一條 x 軸資料，不必每張圖各送一次日期陣列。
+"""
+import numpy as np
+import pandas as pd
+
+from analytics import bucket
+
+POINT_BUDGET = 400  # 每次送到瀏覽器的最多資料點（列）數
+RESOLUTION_LABELS = {"D": "每日", "W": "每週平均", "M": "每月平均"}
+
+
+def choose_resolution(start, end):
+    """區間在 120 天內用每日，兩年內用每週，否則用每月。"""
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    if days <= 120:
+        return "D"
+    if days <= 730:
+        return "W"
+    return "M"
+
+
+def aggregate(df, columns, resolution):
+    """依解析度將各欄位取平均，回傳以 date 排序的 DataFrame。"""
+    dates = pd.to_datetime(df["date"]).dt.normalize()
+    keys = dates if resolution == "D" else bucket(dates, resolution)
+    values = df.reindex(columns=columns).apply(pd.to_numeric, errors="coerce").astype(float)
+    return values.groupby(keys.rename("date")).mean().reset_index()
+
+
+def lttb_indices(x, y, n_out):
+    """
+    LTTB 降採樣：回傳保留點的索引（含首尾），保留視覺上的峰谷。
+    y 中的 NaN 須事先排除。
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(n_out - 2):
+        # 下一個桶的平均點
+        next_start = int(np.floor((i + 1) * every)) + 1
+        next_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # 目前的桶中，與前一個選取點、下一桶平均點構成最大三角形的點
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample(df, columns, budget=POINT_BUDGET):
+    """
+    各欄位分別做 LTTB（每欄分到 budget / 欄位數 個點），
+    取所有欄位選中索引的聯集，讓所有序列共用同一組日期。
+    """
+    if len(df) <= budget:
+        return df
+    per_series = max(3, budget // max(1, len(columns)))
+    x = df["date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    keep = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        y = df[column].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(y))
+        if valid.size:
+            keep[valid[lttb_indices(x[valid], y[valid], per_series)]] = True
+    return df[keep].reset_index(drop=True)
+
+
+def build_chart_data(df, columns, start=None, end=None, budget=POINT_BUDGET):
+    """
+    取出 [start, end] 區間的資料，決定解析度、彙總並降採樣，
+    回傳 {"resolution": 解析度, "dimensions": 欄名, "source": 列資料}，可直接作為 echarts dataset。
+    """
+    dates = pd.to_datetime(df["date"])
+    start = pd.Timestamp(start) if start is not None else dates.min()
+    end = pd.Timestamp(end) if end is not None else dates.max()
+    window = df[(dates >= start) & (dates <= end)]
+    resolution = choose_resolution(start, end)
+    data = downsample(aggregate(window, columns, resolution), columns, budget)
+    rounded = data[columns].round(2).astype(object)
+    rounded = rounded.where(rounded.notna(), None)
+    source = [[d] + values for d, values in zip(data["date"].dt.strftime("%Y-%m-%d"), rounded.values.tolist())]
+    return {"resolution": resolution, "dimensions": ["date"] + list(columns), "source": source}
+
+
+def stacked_chart_option(chart_data, specs, grid_height=220):
+    """
+    將多個指標畫成上下排列的子圖，共用同一份 dataset 與縮放控制。
+    specs 為 [(欄位, 名稱, "line" 或 "bar"), ...]。
+    """
+    grids, x_axes, y_axes, series, titles = [], [], [], [], []
+    for i, (column, name, chart_type) in enumerate(specs):
+        top = 40 + i * (grid_height + 60)
+        titles.append({"text": name, "top": top - 30, "left": "center", "textStyle": {"fontSize": 14}})
+        grids.append({"top": top, "height": grid_height, "left": 60, "right": 30})
+        x_axes.append({"type": "category", "gridIndex": i, "axisLabel": {"show": i == len(specs) - 1}})
+        y_axes.append({"type": "value", "gridIndex": i})
+        series.append({
+            "type": chart_type, "name": name, "xAxisIndex": i, "yAxisIndex": i,
+            "encode": {"x": "date", "y": column}, "showSymbol": False,
+        })
+    axis_indexes = list(range(len(specs)))
+    return {
+        "title": titles,
+        "tooltip": {"trigger": "axis"},
+        "axisPointer": {"link": [{"xAxisIndex": "all"}]},
+        "dataset": {"dimensions": chart_data["dimensions"], "source": chart_data["source"]},
+        "grid": grids,
+        "xAxis": x_axes,
+        "yAxis": y_axes,
+        "series": series,
+        "dataZoom": [{"type": "inside", "xAxisIndex": axis_indexes}],
+    }
+
+
+def overlay_chart_option(chart_data, specs):
+    """將多個序列疊在同一張圖上（共用 dataset）。specs 同 stacked_chart_option。"""
+    return {
+        "tooltip": {"trigger": "axis"},
+        "legend": {},
+        "dataset": {"dimensions": chart_data["dimensions"], "source": chart_data["source"]},
+        "xAxis": {"type": "category"},
+        "yAxis": {"type": "value"},
+        "series": [
+            {"type": chart_type, "name": name, "encode": {"x": "date", "y": column}, "showSymbol": False}
+            for column, name, chart_type in specs
+        ],
+        "dataZoom": [{"type": "inside"}],
+    }
+
+
+def chart_height(specs, grid_height=220):
+    return f"{40 + len(specs) * (grid_height + 60)}px"
@@ -1,117 +1,1873 @@
 import os
-import uuid
+import random
+import re
+import hashlib
+import json
+import time
 import datetime
+import itertools
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-from google.cloud import storage
-from io import StringIO
-
-# 嘗試從 st.secrets 中讀取憑證內容（僅在 Streamlit Cloud 環境中有效）
-try:
-    import streamlit as st
-    if "GCP_CREDENTIALS" in st.secrets:
-        with open("/tmp/credentials.json", "w") as f:
-            f.write(st.secrets["GCP_CREDENTIALS"])
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/tmp/credentials.json"
-    else:
-        print("GCP_CREDENTIALS 不存在於 st.secrets 中。")
-except Exception as e:
-    print("Error reading st.secrets:", e)
+import pyarrow.parquet as pq
+from images import make_thumbnail, preprocess_image
+from local_bucket import BlobList, LocalBucket
+from metrics import timed
+from records import RecordTable
+import resumable
+from search import SEARCH_FIELDS, SearchIndex, doc_key, index_rows, search
+from snapshot import Snapshot
+import write_queue
+from google.api_core.exceptions import PreconditionFailed
+from io import StringIO, BytesIO
+import streamlit as st
 
 
-DATA_FILE = "daily_records.csv"
+DATA_FILE = "daily_records.csv"  # 舊版 CSV 快照（遷移後移至 legacy/）
+RECORDS_PREFIX = "daily_records/"  # Parquet 快照，依月份分割：daily_records/YYYY-MM.parquet
+LEGACY_PREFIX = "legacy/"
 BUCKET_NAME = "internet_health"  # 請替換成你的 Bucket 名稱
+# 設為 "memory" 或某個目錄時改用本機的 LocalBucket，不連線 GCS（離線開發、基準測試）
+LOCAL_BUCKET_ENV = "INTERNET_HEALTH_LOCAL_BUCKET"
+
+# --------------- 延遲建立、整個行程共用的 storage client ------------------
+
+HTTP_POOL_SIZE = 32        # 每個行程對 GCS 的連線數上限（上傳執行緒與各 session 的讀取共用）
+STORAGE_TIMEOUT = (5, 60)  # (連線, 讀取) 逾時秒數
+# 暫時性錯誤（429、5xx、連線中斷）以指數退避重試：0.2 秒起、間隔最長 5 秒、總共最多 30 秒
+RETRY_INITIAL_DELAY = 0.2
+RETRY_MAX_DELAY = 5.0
+RETRY_TIMEOUT = 30.0
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+def _load_credentials():
+    """
+    由 st.secrets["GCP_CREDENTIALS"]（JSON 字串或 TOML 表格）直接在記憶體中建立服務帳戶憑證，
+    不寫入暫存檔。未設定時回傳 None，改用執行環境的預設憑證。
+    """
+    from google.oauth2 import service_account
+    from google.cloud.storage import Client
+    try:
+        info = st.secrets.get("GCP_CREDENTIALS")
+    except Exception as e:
+        print("Error reading st.secrets:", e)
+        return None
+    if not info:
+        print("GCP_CREDENTIALS 不存在於 st.secrets 中。")
+        return None
+    info = json.loads(info) if isinstance(info, str) else dict(info)
+    return service_account.Credentials.from_service_account_info(info, scopes=Client.SCOPE)
+
+def _make_gcs_bucket():
+    """建立 storage client：共用一個連線池較大的 HTTP session，所有執行緒一起使用。"""
+    # google-cloud-storage 載入較慢，只在第一次真正存取 GCS 時才 import
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from google.cloud.storage.retry import DEFAULT_RETRY
+    from requests.adapters import HTTPAdapter
+
+    credentials = _load_credentials()
+    if credentials is not None:
+        project = credentials.project_id
+    else:
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    # 重試交給 google 的 Retry（含退避），HTTPAdapter 本身不重試
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session.mount("https://", adapter)
+    client = storage.Client(project=project or None, credentials=credentials, _http=session)
+    retry = DEFAULT_RETRY.with_delay(initial=RETRY_INITIAL_DELAY, maximum=RETRY_MAX_DELAY).with_timeout(RETRY_TIMEOUT)
+    return client.bucket(BUCKET_NAME), {"retry": retry, "timeout": STORAGE_TIMEOUT}
+
+def get_bucket():
+    """
+    取得目前的儲存後端；第一次使用時才建立（執行緒安全），import 本模組不會載入憑證或連線。
+    憑證有誤時只有存取資料的呼叫會失敗，頁面本身仍可載入。
+    """
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                local = os.environ.get(LOCAL_BUCKET_ENV)
+                if local:
+                    _bucket = _InstrumentedBucket(LocalBucket(BUCKET_NAME, None if local == "memory" else local))
+                else:
+                    _bucket = _InstrumentedBucket(*_make_gcs_bucket())
+    return _bucket
+
+def set_bucket(new_bucket):
+    """替換儲存後端（例如 LocalBucket），並丟棄所有快取。"""
+    global _bucket
+    with _bucket_lock:
+        _bucket = _InstrumentedBucket(new_bucket)
+    invalidate_cache(parsed=True)
+
+# --------------- 儲存呼叫的計時 ------------------
+
+class _InstrumentedBlob:
+    """
+    包住 Blob，每次 GCS 請求都記錄耗時與位元組數（metrics 中的 gcs.*），
+    並套上預設的重試與逾時設定；其餘屬性直接轉給原物件。
+    """
+
+    def __init__(self, blob, call_defaults):
+        self._blob = blob
+        self._defaults = call_defaults
+
+    def __getattr__(self, name):
+        return getattr(self._blob, name)
+
+    def _kwargs(self, kwargs):
+        return {**self._defaults, **kwargs}
+
+    def download_as_bytes(self, **kwargs):
+        with timed("gcs.download") as t:
+            data = self._blob.download_as_bytes(**self._kwargs(kwargs))
+            t.bytes = len(data)
+        return data
+
+    def download_as_text(self, **kwargs):
+        with timed("gcs.download") as t:
+            text = self._blob.download_as_text(**self._kwargs(kwargs))
+            t.bytes = len(text.encode("utf-8"))
+        return text
+
+    def upload_from_string(self, data, *args, **kwargs):
+        with timed("gcs.upload") as t:
+            t.bytes = len(data.encode("utf-8") if isinstance(data, str) else data)
+            return self._blob.upload_from_string(data, *args, **self._kwargs(kwargs))
+
+    def upload_from_file(self, file_obj, *args, **kwargs):
+        with timed("gcs.upload") as t:
+            start = file_obj.tell()
+            result = self._blob.upload_from_file(file_obj, *args, **self._kwargs(kwargs))
+            t.bytes = file_obj.tell() - start
+            return result
+
+    def upload_resumable(self, data, content_type=None, if_generation_match=None):
+        """
+        以可續傳 session 分段上傳 bytes（見 resumable.py），中斷時從伺服器已收到的位置續傳。
+        LocalBucket 等沒有 HTTP client 的後端直接整份寫入。
+        """
+        client = getattr(self._blob, "client", None)
+        if client is None:
+            return self.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        from google.api_core.exceptions import from_http_response
+        from google.resumable_media import InvalidResponse
+        url = resumable.upload_url(client.api_endpoint, self._blob.bucket.name, if_generation_match)
+        with timed("gcs.upload_resumable") as t:
+            t.bytes = len(data)
+            try:
+                resumable.upload(client._http, url, BytesIO(data), self._blob.name,
+                                 content_type or "application/octet-stream", timeout=STORAGE_TIMEOUT)
+            except InvalidResponse as e:
+                # 轉成與一般上傳相同的例外（例如 412 → PreconditionFailed）
+                raise from_http_response(e.response) from e
+
+    def delete(self, **kwargs):
+        with timed("gcs.delete"):
+            return self._blob.delete(**self._kwargs(kwargs))
+
+    def exists(self, **kwargs):
+        with timed("gcs.exists"):
+            return self._blob.exists(**self._kwargs(kwargs))
+
+class _InstrumentedBucket:
+    def __init__(self, bucket, call_defaults=None):
+        self._bucket = bucket
+        self._defaults = call_defaults or {}
+
+    def __getattr__(self, name):
+        return getattr(self._bucket, name)
+
+    def blob(self, name, **kwargs):
+        return _InstrumentedBlob(self._bucket.blob(name, **kwargs), self._defaults)
+
+    def get_blob(self, name, **kwargs):
+        with timed("gcs.get_blob"):
+            blob = self._bucket.get_blob(name, **{**self._defaults, **kwargs})
+        return None if blob is None else _InstrumentedBlob(blob, self._defaults)
+
+    def list_blobs(self, *args, **kwargs):
+        # GCS 的 iterator 在迭代時才發出請求，這裡一次讀完以便計時
+        with timed("gcs.list_blobs"):
+            iterator = self._bucket.list_blobs(*args, **{**self._defaults, **kwargs})
+            blobs = [_InstrumentedBlob(b, self._defaults) for page in iterator.pages for b in page]
+        return BlobList(blobs, set(iterator.prefixes))
+
+# 各頁面只需要的欄位，讀取 Parquet 時只解碼這些欄位
+NUMERIC_COLUMNS = ["sleep_hours", "steps", "sugary_drinks", "screen_time"]
+MEAL_COLUMNS = [
+    "breakfast", "breakfast_thumb", "breakfast_desc",
+    "lunch", "lunch_thumb", "lunch_desc",
+    "dinner", "dinner_thumb", "dinner_desc",
+    "late_night", "late_night_thumb", "late_night_desc",
+]
+# 照片欄位；每個欄位另以 <欄位>_thumb 記錄縮圖網址
+IMAGE_FIELDS = ["sleep_evidence", "breakfast", "lunch", "dinner", "late_night", "steps_evidence", "screen_evidence"]
+
+# --------------- 依使用者分割的儲存空間 ------------------
+
+DEFAULT_USER = "default"  # 未指定使用者時沿用 bucket 根目錄下的既有資料
+USER_PREFIX = "users/"    # 其他使用者的物件一律放在 users/<使用者代號>/ 底下
+USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def current_user():
+    """目前 session 選擇的使用者代號；不在 Streamlit 中執行或尚未選擇時為 DEFAULT_USER。"""
+    try:
+        return st.session_state.get("user_id") or DEFAULT_USER
+    except Exception:
+        return DEFAULT_USER
+
+def resolve_user(user_id=None):
+    """回傳要讀寫的使用者代號：user_id 省略時為目前 session 的使用者；格式不符時拋出 ValueError。"""
+    user_id = user_id or current_user()
+    if not USER_ID_PATTERN.fullmatch(user_id):
+        raise ValueError(f"invalid user id: {user_id!r}")
+    return user_id
+
+def _user_path(name, user_id):
+    """物件名稱加上使用者前綴；預設使用者維持原本的位置，不需搬移舊資料。"""
+    return name if user_id == DEFAULT_USER else f"{USER_PREFIX}{user_id}/{name}"
+
+def select_user():
+    """
+    在側邊欄輸入使用者代號（學號），存入 st.session_state["user_id"]。
+    之後所有讀寫只會碰到該使用者的分割。回傳目前的使用者代號。
+    """
+    current = st.session_state.get("user_id", "")
+    value = st.sidebar.text_input("使用者代號（學號）", value=current,
+                                  help="英數字、底線或連字號；留空則使用共用資料").strip()
+    if value and not USER_ID_PATTERN.fullmatch(value):
+        st.sidebar.error("使用者代號只能包含英數字、底線或連字號（最多 64 字）。")
+        value = current
+    st.session_state["user_id"] = value
+    return current_user()
+
+# --------------- 跨 session 共用的快取 ------------------
+
+CACHE_TTL_SECONDS = 30  # TTL 內直接回傳結果，不發出任何 GCS 請求
+# 長時間執行的伺服器中，快取依最近使用（LRU）保留固定數量，其餘丟棄，記憶體不會隨使用者數與查詢區間無限成長
+BLOB_CACHE_ENTRIES = 512    # 已解析的物件（月份分割、日誌異動、索引分割…）
+RESULT_CACHE_ENTRIES = 256  # 查詢結果（每個使用者／日期區間／欄位組合一項）
+SNAPSHOT_CACHE_USERS = 16   # 共用快照（每位使用者一份）
+
+_cache_lock = threading.Lock()
+_blob_cache = OrderedDict()    # (物件名稱, 附加鍵) -> (generation, 解析結果)
+_result_cache = OrderedDict()  # 查詢鍵 -> (取得時間, 結果 DataFrame)
+
+def _lru_put(cache, key, value, limit):
+    """放入 LRU 快取（OrderedDict），超過 limit 時丟棄最久未使用的項目。呼叫端須持有對應的鎖。"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+def _cached_blob(blob, parse, extra_key=None):
+    """
+    依物件的 generation 快取解析結果：generation 未變就不重新下載。
+    blob 須帶有 metadata（來自 list_blobs 或 get_blob）。
+    """
+    key = (blob.name, extra_key)
+    with _cache_lock:
+        hit = _blob_cache.get(key)
+        if hit is not None:
+            _blob_cache.move_to_end(key)
+    if hit is not None and blob.generation is not None and hit[0] == blob.generation:
+        return hit[1]
+    value = parse(blob)
+    with _cache_lock:
+        _lru_put(_blob_cache, key, (blob.generation, value), BLOB_CACHE_ENTRIES)
+    return value
+
+def _cached_result(key, loader):
+    """
+    TTL 內重複的查詢直接回傳上次結果；逾時後重新列出物件並只下載有變動者。
+    逾時的結果在存取時一併丟棄，不會一直佔用記憶體。
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        for expired in [k for k, (at, _) in _result_cache.items() if now - at >= CACHE_TTL_SECONDS]:
+            del _result_cache[expired]
+        hit = _result_cache.get(key)
+        if hit is not None:
+            _result_cache.move_to_end(key)
+            return hit[1]
+    value = loader()
+    with _cache_lock:
+        _lru_put(_result_cache, key, (now, value), RESULT_CACHE_ENTRIES)
+    return value
 
-client = storage.Client()
-bucket = client.bucket(BUCKET_NAME)
+def invalidate_cache(parsed=False, user_id=None):
+    """
+    讓下一次讀取重新檢查 GCS 上的 generation。
+    寫入後與頁面上的「刷新資料」按鈕都走這個路徑。
+    user_id 指定時只丟棄該使用者的查詢結果（與跨使用者摘要），其他使用者的快取不受影響。
+    parsed 為 True 時連已解析的物件也一併丟棄，下一次讀取會重新下載。
+    """
+    with _cache_lock:
+        if user_id is None or parsed:
+            _result_cache.clear()
+        else:
+            # 查詢鍵的第二個元素為使用者代號；("summary",) 等跨使用者的鍵一併丟棄
+            for key in [k for k in _result_cache if len(k) < 2 or k[1] == user_id]:
+                del _result_cache[key]
+        if parsed:
+            _blob_cache.clear()
+    if parsed:
+        with _snapshot_lock:
+            _snapshots.clear()
+
+# --------------- 跨 session 共用的資料快照 ------------------
+
+SNAPSHOT_TTL_SECONDS = CACHE_TTL_SECONDS  # 超過此時間才重新列出物件，確認其他行程是否寫入過
+
+_snapshot_lock = threading.Lock()
+_snapshots = OrderedDict()  # 使用者 -> (確認時間, 物件與佇列的簽章, Snapshot)，最多 SNAPSHOT_CACHE_USERS 位
+_snapshot_versions = itertools.count(1)
+
+def _snapshot_signature(user_id):
+    """快照所依據的物件 generation 與佇列內容；任何一項改變表示有新的寫入。"""
+    blobs = _list_partitions(_user_path(RECORDS_PREFIX, user_id))
+    blobs += _list_partitions(_user_path(REFLECTION_PREFIX, user_id))
+    blobs += _list_journal(user_id)
+    if user_id == DEFAULT_USER:
+        blobs += [b for b in map(get_bucket().get_blob, (DATA_FILE, REFLECTION_FILE)) if b is not None]
+    queued = tuple(tuple(sorted(write_queue.pending(kind, user_id).items())) for kind in ("record", "reflection"))
+    return frozenset((b.name, b.generation) for b in blobs), queued
+
+def _build_snapshot(user_id):
+    records = _fold_journal(_load_records_frame(user_id), _queued_records(user_id))
+    reflections = _build_reflection_index(user_id)
+    reflections.update(_queued_reflections(user_id))
+    return Snapshot(RecordTable(records), reflections)
+
+def current_snapshot(user_id=None):
+    """
+    使用者（預設為目前 session 的使用者）紀錄與反思的共用快照（見 snapshot.py）。
+    所有 session 拿到的是同一個物件，不需放進 session_state；每次 rerun 呼叫一次即可看到最新版本。
+    超過 SNAPSHOT_TTL_SECONDS 才重新列出物件，沒有變動就沿用原快照，
+    有變動時只下載 generation 改變的物件。失敗時回傳空快照。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        now = time.monotonic()
+        with _snapshot_lock:
+            entry = _snapshots.get(user_id)
+            if entry is not None:
+                _snapshots.move_to_end(user_id)
+        if entry is not None and now - entry[0] < SNAPSHOT_TTL_SECONDS:
+            return entry[2]
+        with timed("snapshot.check"):
+            signature = _snapshot_signature(user_id)
+        if entry is not None and entry[1] == signature:
+            snapshot = entry[2]
+        else:
+            with timed("snapshot.build"):
+                snapshot = _build_snapshot(user_id)
+        with _snapshot_lock:
+            latest = _snapshots.get(user_id)
+            if latest is not entry:
+                # 建立期間有人存檔替換或丟棄了快照：不覆蓋較新的狀態，下次 rerun 再確認
+                return latest[2] if latest is not None else snapshot
+            if entry is None or snapshot is not entry[2]:
+                snapshot = snapshot.with_changes(version=next(_snapshot_versions))
+            _lru_put(_snapshots, user_id, (now, signature, snapshot), SNAPSHOT_CACHE_USERS)
+        return snapshot
+    except Exception as e:
+        print("Error loading snapshot:", e)
+        return Snapshot(RecordTable(pd.DataFrame()), {})
 
-def upload_file_to_gcs(uploaded_file, record_date, category):
+def _apply_to_snapshot(user_id, records=None, reflections=None, journal=None):
     """
-    將上傳的檔案上傳到 GCS，並以格式：YYYYMMDD_category_UUID.ext 重新命名，
-    回傳該檔案的公眾 URL。
+    存檔成功後以寫入時複製產生新版本並整個替換：各 session 下次 rerun 就看到新資料，
+    不需重新下載。journal 為這次寫入的 {日誌物件名稱: 新 generation}，一併記進快照的簽章，
+    之後的編輯以它為基準（見 record_generation）。快照尚未建立時不做任何事（第一次讀取時才建立）。
+    """
+    with _snapshot_lock:
+        entry = _snapshots.get(user_id)
+        if entry is not None:
+            snapshot = entry[2].with_changes(records, reflections, version=next(_snapshot_versions))
+            names, queued = entry[1]
+            if journal:
+                generations = dict(names)
+                generations.update(journal)
+                names = frozenset(generations.items())
+            _snapshots[user_id] = (entry[0], (names, queued), snapshot)
+
+def _drop_snapshot(user_id):
+    """整份改寫後丟棄快照，下一次讀取時重建。"""
+    with _snapshot_lock:
+        _snapshots.pop(user_id, None)
+
+def refresh_snapshot(user_id=None):
+    """頁面上的「刷新資料」按鈕：清除該使用者的快取並丟棄快照，下一次讀取時重新檢查 GCS。"""
+    try:
+        user_id = resolve_user(user_id)
+    except ValueError as e:
+        print("Error refreshing data:", e)
+        return
+    invalidate_cache(user_id=user_id)
+    _drop_snapshot(user_id)
+
+EVIDENCE_PREFIX = "evidence/"  # 證明照片以內容命名：[users/<使用者>/]evidence/<SHA-256><副檔名>
+# 舊版以 YYYYMMDD_category_UUID.ext 命名、直接放在使用者前綴下的照片
+LEGACY_EVIDENCE_PATTERN = re.compile(r"\d{8}_[a-z_]+_[0-9a-f]{32}(\.[^/]*)?")
+
+def _evidence_blob_name(data, file_name, user_id):
+    ext = os.path.splitext(file_name)[1].lower()
+    return _user_path(f"{EVIDENCE_PREFIX}{hashlib.sha256(data).hexdigest()}{ext}", user_id)
+
+def _upload_to_gcs(file_obj, file_name, content_type=None, user_id=DEFAULT_USER, category=None):
+    """
+    先壓縮照片（轉正、去除 EXIF、縮小、重新編碼，見 images.preprocess_image），
+    再以內容的 SHA-256 命名上傳並產生縮圖。
+    回傳 (原圖 URL, {縮圖寬度: 縮圖 URL}, 壓縮前位元組數, 壓縮後位元組數)。
+    相同內容已在 bucket 中時不重新上傳，重新送出同一天的紀錄不會產生重複的照片。
+    壓縮後仍大於 resumable.RESUMABLE_THRESHOLD 的檔案以可續傳 session 分段上傳，斷線時從中斷處續傳。
+    """
+    original = file_obj.read()
+    with timed("image.preprocess") as t:
+        data, file_name, new_type = preprocess_image(original, file_name, category)
+        t.bytes = len(original) - len(data)  # 節省的位元組數
+    content_type = new_type or content_type
+    sizes = (len(original), len(data))
+    name = _evidence_blob_name(data, file_name, user_id)
+    bucket = get_bucket()
+    blob = bucket.blob(name)
+    if bucket.get_blob(name) is None:
+        try:
+            if len(data) > resumable.RESUMABLE_THRESHOLD:
+                blob.upload_resumable(data, content_type=content_type, if_generation_match=0)
+            else:
+                blob.upload_from_file(BytesIO(data), content_type=content_type, if_generation_match=0)
+        except PreconditionFailed:
+            pass  # 另一個請求剛上傳了相同內容
+        return (blob.public_url, _upload_thumbnails(data, name)) + sizes
+    thumbs = {width: bucket.get_blob(_thumbnail_blob_name(name, width)) for width in THUMB_WIDTHS}
+    if any(thumb is None for thumb in thumbs.values()):
+        return (blob.public_url, _upload_thumbnails(data, name)) + sizes
+    return (blob.public_url, {width: thumb.public_url for width, thumb in thumbs.items()}) + sizes
+
+def upload_file_to_gcs(uploaded_file, record_date, category, user_id=None):
+    """
+    將上傳的檔案壓縮後以內容雜湊命名上傳到 GCS（放在使用者的前綴下），同時產生縮圖，回傳原檔的公眾 URL。
+    category 決定壓縮設定（截圖類別保留較高解析度）；物件名稱只取決於內容，record_date 不再影響命名。
     """
     if uploaded_file is not None:
-        ext = os.path.splitext(uploaded_file.name)[1]
-        new_filename = f"{record_date.strftime('%Y%m%d')}_{category}_{uuid.uuid4().hex}{ext}"
-        blob = bucket.blob(new_filename)
-        blob.upload_from_file(uploaded_file)
-        return blob.public_url
+        return _upload_to_gcs(uploaded_file, uploaded_file.name, user_id=resolve_user(user_id), category=category)[0]
     return ""
 
-def load_records():
+# --------------- 縮圖 ------------------
+
+THUMB_PREFIX = "thumbs/"  # 縮圖物件：thumbs/<寬度>/<原檔名>.webp
+THUMB_WIDTHS = (240, 480)
+THUMB_GALLERY_WIDTH = 480  # 記錄在 <欄位>_thumb 中、相簿頁使用的寬度
+
+def thumb_field(field):
+    return f"{field}_thumb"
+
+def _thumbnail_blob_name(blob_name, width):
+    stem = os.path.splitext(blob_name)[0]
+    return f"{THUMB_PREFIX}{width}/{stem}.webp"
+
+def blob_name_from_url(url):
+    """由本 bucket 的公開網址取回物件名稱；不是本 bucket 的網址（或不是字串）時回傳 None。"""
+    prefix = f"https://storage.googleapis.com/{BUCKET_NAME}/"
+    return url[len(prefix):] if isinstance(url, str) and url.startswith(prefix) else None
+
+def _upload_thumbnails(data, blob_name):
+    """產生各寬度的縮圖並上傳，回傳 {寬度: URL}；無法解碼或上傳失敗時不影響原圖。"""
+    thumbs = {}
+    try:
+        for width in THUMB_WIDTHS:
+            thumb = get_bucket().blob(_thumbnail_blob_name(blob_name, width))
+            thumb.upload_from_string(make_thumbnail(data, width), content_type="image/webp")
+            thumbs[width] = thumb.public_url
+    except Exception as e:
+        print("Error creating thumbnail:", e)
+    return thumbs
+
+def _backfill_one(blob_name):
+    data = get_bucket().blob(blob_name).download_as_bytes()
+    return _upload_thumbnails(data, blob_name)
+
+def backfill_thumbnails(dry_run=False, user_id=None):
     """
-    從 Google Cloud Storage 讀取 daily_records.csv，並返回 list of dicts。
-    如果檔案不存在，回傳空列表。
+    為使用者已在 bucket 中但尚無縮圖的照片補產生縮圖，並將縮圖網址寫回紀錄：
+    只把各日期的 <欄位>_thumb 以 bulk_upsert_records 合併寫回（整批一次、以 generation 為條件），
+    不改寫其他欄位，補縮圖期間其他人送出的紀錄不會被蓋掉。
+    dry_run 時只計算需要補的數量。回傳補上（或需要補）的張數；儲存失敗時回傳 None。
     """
-    blob = bucket.blob(DATA_FILE)
-    if blob.exists():
+    user_id = resolve_user(user_id)
+    records = load_records(user_id=user_id)
+    jobs = []
+    for rec in records:
+        for field in IMAGE_FIELDS:
+            thumb = rec.get(thumb_field(field))
+            if isinstance(thumb, str) and thumb.strip():
+                continue
+            blob_name = blob_name_from_url(rec.get(field))
+            if blob_name is not None:
+                jobs.append((rec["date"], field, blob_name))
+    if dry_run or not jobs:
+        return len(jobs)
+    updates = {}  # 日期 -> {"date", <欄位>_thumb: 網址}
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        futures = {pool.submit(_backfill_one, blob_name): (date, field) for date, field, blob_name in jobs}
+        for future in as_completed(futures):
+            date, field = futures[future]
+            try:
+                thumbs = future.result()
+            except Exception as e:
+                print("Error backfilling thumbnail:", e)
+                continue
+            if THUMB_GALLERY_WIDTH in thumbs:
+                updates.setdefault(date, {"date": date})[thumb_field(field)] = thumbs[THUMB_GALLERY_WIDTH]
+    done = sum(len(update) - 1 for update in updates.values())
+    if done and bulk_upsert_records(list(updates.values()), user_id=user_id) is None:
+        return None
+    return done
+
+# --------------- 延後、並行的證明照片上傳 ------------------
+
+UPLOAD_WORKERS = 4  # 同時上傳的檔案數上限
+
+def stage_upload(uploaded_file):
+    """
+    將 file_uploader 回傳的檔案讀入記憶體暫存，待密碼確認後才上傳。
+    沒有檔案時回傳 None。
+    """
+    if uploaded_file is None:
+        return None
+    return {"name": uploaded_file.name, "data": uploaded_file.getvalue(), "type": uploaded_file.type}
+
+def upload_staged_files(staged, on_progress=None, user_id=None):
+    """
+    以有上限的執行緒池同時上傳暫存檔案，所有執行緒共用同一個 storage client，
+    總耗時約為最慢的單一檔案，而非所有檔案相加。
+    staged 為 {欄位: (category, 暫存檔)}；回傳 (成功的 {欄位: URL, <欄位>_thumb: 縮圖 URL},
+    失敗的 {欄位: 錯誤訊息}, 成功檔案壓縮前後的總位元組數 {"original", "uploaded"})。
+    每完成一個檔案會在呼叫端執行緒呼叫 on_progress(欄位, 已完成數, 總數, 錯誤訊息或 None)。
+    """
+    urls, errors = {}, {}
+    sizes = {"original": 0, "uploaded": 0}
+    jobs = {field: item for field, item in staged.items() if item[1] is not None}
+    if not jobs:
+        return urls, errors, sizes
+    # 工作執行緒讀不到 session_state，使用者在此先行解析
+    user_id = resolve_user(user_id)
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(jobs))) as pool:
+        futures = {
+            pool.submit(_upload_to_gcs, BytesIO(f["data"]), f["name"], f["type"], user_id, category): field
+            for field, (category, f) in jobs.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            field = futures[future]
+            try:
+                urls[field], thumbs, original, uploaded = future.result()
+                urls[thumb_field(field)] = thumbs.get(THUMB_GALLERY_WIDTH, "")
+                sizes["original"] += original
+                sizes["uploaded"] += uploaded
+                error = None
+            except Exception as e:
+                print("Error uploading file:", e)
+                error = errors[field] = str(e)
+            if on_progress is not None:
+                on_progress(field, done, len(jobs), error)
+    return urls, errors, sizes
+
+# --------------- 不再被引用的證明照片 ------------------
+
+GC_MIN_AGE = datetime.timedelta(days=1)  # 最近上傳的物件可能屬於尚未確認送出的紀錄，一律保留
+
+def _evidence_objects(user_id):
+    """列出使用者的證明照片原圖（含舊版檔名）與縮圖。"""
+    bucket = get_bucket()
+    root = _user_path("", user_id)
+    originals = list(bucket.list_blobs(prefix=root + EVIDENCE_PREFIX))
+    originals += [b for b in bucket.list_blobs(prefix=root, delimiter="/")
+                  if LEGACY_EVIDENCE_PATTERN.fullmatch(b.name[len(root):])]
+    thumbs = []
+    for width in THUMB_WIDTHS:
+        prefix = f"{THUMB_PREFIX}{width}/{root}"
+        # 預設使用者的前綴是根目錄，要排除其他使用者（users/）的縮圖
+        thumbs += [b for b in bucket.list_blobs(prefix=prefix)
+                   if user_id != DEFAULT_USER or not b.name[len(prefix):].startswith(USER_PREFIX)]
+    return originals, thumbs
+
+def _referenced_evidence(user_id):
+    """使用者所有紀錄（含日誌與本機佇列中尚未寫出的）引用的照片物件名稱。讀取失敗時拋出例外。"""
+    df = _fold_journal(_load_records_frame(user_id), _queued_records(user_id))
+    fields = [c for f in IMAGE_FIELDS for c in (f, thumb_field(f)) if c in df.columns]
+    names = {blob_name_from_url(url) for field in fields for url in df[field]}
+    names.discard(None)
+    return names
+
+def collect_unreferenced_evidence(user_id=None, delete=False, min_age=GC_MIN_AGE):
+    """
+    找出使用者不再被任何紀錄引用的證明照片與其縮圖（例如被覆蓋或刪除的紀錄留下的照片）；
+    delete 為 True 時一併刪除。上傳不到 min_age 的物件不列入。
+    回傳 {"objects": [物件名稱], "bytes": 總大小, "deleted": 刪除數}；讀取紀錄失敗時回傳 None。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        referenced = _referenced_evidence(user_id)
+        originals, thumbs = _evidence_objects(user_id)
+    except Exception as e:
+        print("Error collecting evidence:", e)
+        return None
+    # 縮圖名稱由原圖名稱決定；原圖仍被引用時縮圖也保留
+    referenced_stems = {os.path.splitext(name)[0] for name in referenced}
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - min_age
+    garbage = [b for b in originals if b.name not in referenced]
+    for width in THUMB_WIDTHS:
+        prefix = f"{THUMB_PREFIX}{width}/"
+        garbage += [b for b in thumbs if b.name.startswith(prefix) and b.name not in referenced
+                    and os.path.splitext(b.name[len(prefix):])[0] not in referenced_stems]
+    garbage = [b for b in garbage if b.updated is None or b.updated < cutoff]
+    result = {"objects": [b.name for b in garbage], "bytes": sum(b.size or 0 for b in garbage), "deleted": 0}
+    if delete:
+        for blob in garbage:
+            try:
+                # 以 generation 為條件，不會刪到剛好被重新上傳的物件
+                blob.delete(if_generation_match=blob.generation)
+                result["deleted"] += 1
+            except Exception as e:
+                print("Error deleting evidence:", e)
+    return result
+
+# --------------- 月份分割的 Parquet 快照 ------------------
+
+def _partition_blob_name(prefix, month):
+    """month 為 'YYYY-MM'，對應物件名稱 prefix + YYYY-MM.parquet"""
+    return f"{prefix}{month}.parquet"
+
+def _partition_month(blob_name, prefix):
+    stem = blob_name[len(prefix):]
+    return stem[:-len(".parquet")] if stem.endswith(".parquet") else None
+
+def _to_timestamp(value):
+    return None if value is None else pd.Timestamp(value)
+
+def _list_partitions(prefix, start=None, end=None, months=None):
+    """
+    列出快照分割檔；依檔名中的月份先行過濾日期範圍，不在範圍內的月份不會被下載。
+    """
+    start_month = _to_timestamp(start).to_period("M") if start is not None else None
+    end_month = _to_timestamp(end).to_period("M") if end is not None else None
+    selected = []
+    for blob in get_bucket().list_blobs(prefix=prefix):
+        month = _partition_month(blob.name, prefix)
+        if month is None:
+            continue
+        period = pd.Period(month, "M")
+        if start_month is not None and period < start_month:
+            continue
+        if end_month is not None and period > end_month:
+            continue
+        if months is not None and month not in months:
+            continue
+        selected.append(blob)
+    return sorted(selected, key=lambda b: b.name)
+
+def _filter_range(df, start=None, end=None):
+    if df.empty or "date" not in df.columns:
+        return df
+    if start is not None:
+        df = df[df["date"] >= _to_timestamp(start)]
+    if end is not None:
+        df = df[df["date"] <= _to_timestamp(end)]
+    return df
+
+def _select_columns(df, columns):
+    if columns is None or df.empty:
+        return df
+    wanted = ["date"] + [c for c in columns if c != "date"]
+    return df[[c for c in wanted if c in df.columns]]
+
+def _parse_parquet(blob, read_columns):
+    data = blob.download_as_bytes()
+    with timed("parse.parquet") as t:
+        t.bytes = len(data)
+        parquet_file = pq.ParquetFile(BytesIO(data))
+        names = parquet_file.schema_arrow.names
+        cols = None if read_columns is None else [c for c in read_columns if c in names]
+        return parquet_file.read(columns=cols).to_pandas()
+
+def _parse_csv(blob):
+    text = blob.download_as_text()
+    with timed("parse.csv") as t:
+        t.bytes = len(text)
+        return pd.read_csv(StringIO(text), parse_dates=["date"])
+
+def _parse_json(blob):
+    text = blob.download_as_text()
+    with timed("parse.json") as t:
+        t.bytes = len(text)
+        return json.loads(text)
+
+def _parse_table(blob):
+    """彙總表、摘要等整份讀取的小型 Parquet。"""
+    return _parse_parquet(blob, None)
+
+def _parse_partitions(blobs, read_columns=None):
+    frames = []
+    for blob in blobs:
+        frames.append(_cached_blob(blob, lambda b: _parse_parquet(b, read_columns), read_columns and tuple(read_columns)))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    with timed("build.concat"):
+        df = pd.concat(frames, ignore_index=True)
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+def _read_partitions(prefix, start=None, end=None, columns=None, months=None):
+    """
+    下載指定範圍的 Parquet 分割檔並合併，只讀取 columns 指定的欄位（date 一定包含）。
+    """
+    read_columns = None if columns is None else ["date"] + [c for c in columns if c != "date"]
+    return _filter_range(_parse_partitions(_list_partitions(prefix, start, end, months), read_columns), start, end)
+
+def _read_for_update(prefix, months):
+    """
+    讀取 months 的完整分割檔，回傳 (DataFrame, {月份: 讀取時的 generation})，不存在的月份為 0。
+    改寫後以這些 generation 為條件寫回（_write_partitions 的 generations），期間有人改寫就會失敗。
+    """
+    blobs = _list_partitions(prefix, months=months)
+    generations = dict.fromkeys(months, 0)
+    generations.update({_partition_month(b.name, prefix): b.generation for b in blobs})
+    return _parse_partitions(blobs), generations
+
+def _write_partitions(prefix, df, months=None, generations=None):
+    """
+    依月份將 DataFrame 寫成 Parquet 分割檔。
+    months 為 None 時視為完整覆寫：不再有資料的舊分割會被刪除；
+    否則只改寫 months 中列出的月份，該月已無資料則刪除該分割。
+    generations（來自 _read_for_update）不為 None 時，每個月份的寫入與刪除都以讀取時的
+    generation 為條件，被他人搶先改寫時拋出 PreconditionFailed（已寫出的月份不會復原，由呼叫端重讀後重試）。
+    """
+    def expected(month):
+        return None if generations is None else generations.get(month, 0)
+
+    written = set()
+    parts = []
+    if not df.empty:
+        df = df.copy()
+        df["date"] = pd.to_datetime(df["date"])
+        parts = df.groupby(df["date"].dt.strftime("%Y-%m"))
+    for month, part in parts:
+        buf = BytesIO()
+        with timed("serialize.parquet"):
+            part.sort_values("date").to_parquet(buf, index=False)
+        blob = get_bucket().blob(_partition_blob_name(prefix, month))
+        blob.upload_from_string(buf.getvalue(), content_type="application/vnd.apache.parquet",
+                                if_generation_match=expected(month))
+        written.add(month)
+    if months is None:
+        stale = [b for b in _list_partitions(prefix) if _partition_month(b.name, prefix) not in written]
+    else:
+        # 讀取時就不存在的月份不需刪除
+        stale = [get_bucket().blob(_partition_blob_name(prefix, m)) for m in set(months) - written if expected(m) != 0]
+    for blob in stale:
         try:
-            csv_data = blob.download_as_text()
-            df = pd.read_csv(StringIO(csv_data), parse_dates=["date"])
-            return df.to_dict(orient="records")
+            blob.delete(if_generation_match=expected(_partition_month(blob.name, prefix)))
+        except PreconditionFailed:
+            raise
         except Exception as e:
-            print("Error loading records:", e)
-            return []
-    else:
+            print("Error deleting partition:", e)
+
+def _read_legacy_csv(file_name, user_id=DEFAULT_USER):
+    # 舊版 CSV 只存在於預設使用者（分割前的共用資料）
+    if user_id != DEFAULT_USER:
+        return None
+    # get_blob 一次取得 metadata，不存在時回傳 None，取代 exists() + 下載
+    blob = get_bucket().get_blob(file_name)
+    if blob is not None:
+        return _cached_blob(blob, _parse_csv)
+    return None
+
+def _retire_legacy_csv(file_name):
+    """遷移完成後將舊 CSV 移到 legacy/ 保存，原位置刪除。"""
+    blob = get_bucket().blob(file_name)
+    if blob.exists():
+        get_bucket().blob(LEGACY_PREFIX + file_name).upload_from_string(blob.download_as_bytes(), content_type="text/csv")
+        blob.delete()
+
+def _load_snapshot_records(user_id, start=None, end=None, columns=None):
+    """
+    讀取使用者的每日紀錄快照，回傳 DataFrame。尚未遷移時讀舊版 daily_records.csv。
+    """
+    legacy = _read_legacy_csv(DATA_FILE, user_id)
+    if legacy is not None:
+        return _select_columns(_filter_range(legacy, start, end), columns)
+    return _read_partitions(_user_path(RECORDS_PREFIX, user_id), start, end, columns)
+
+def load_records(start=None, end=None, columns=None, user_id=None, include_pending=True):
+    """
+    從 Google Cloud Storage 讀取使用者（預設為目前 session 的使用者）的每日紀錄快照，
+    再依序套用日誌中尚未合併的異動與本機佇列中尚未寫出的紀錄，返回 list of dicts（依日期排序）。
+    start / end（含）限定日期範圍，只下載涵蓋的月份；columns 限定欄位。
+    include_pending 為 False 時不套用佇列，只回傳已寫到 GCS 的內容（彙總表、搜尋索引等要寫回儲存空間的衍生資料用）。
+    如果檔案不存在，回傳空列表。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        key = ("records", user_id, start, end, columns and tuple(columns))
+        df = _cached_result(key, lambda: _load_records_frame(user_id, start, end, columns))
+        queued = _queued_records(user_id, start, end) if include_pending else []
+        if queued:
+            # 使用者剛送出、尚未寫到 GCS 的紀錄也要看得到
+            df = _select_columns(_fold_journal(df, queued), columns)
+        with timed("build.to_dict"):
+            return df.to_dict(orient="records")
+    except Exception as e:
+        print("Error loading records:", e)
         return []
 
-def save_records(records):
+def _load_records_frame(user_id, start=None, end=None, columns=None):
+    df = _load_snapshot_records(user_id, start, end, columns)
+    deltas = _load_journal(_list_journal(user_id, start, end))
+    with timed("build.fold_journal"):
+        return _select_columns(_fold_journal(df, deltas), columns)
+
+def save_records(records, user_id=None, journal=None):
     """
-    將紀錄 list 儲存為 CSV，然後上傳到 Google Cloud Storage。
-    成功則返回 True，否則返回 False。
+    將使用者的紀錄 list 依月份存成 Parquet 快照，然後上傳到 Google Cloud Storage。
+    快照寫入後只清除 records 已包含的日誌異動（以其 generation 為條件），讀取 records 之後
+    其他人才寫入的異動留在日誌中，讀取時套用在新快照上、下次合併時再併入。
+    journal 為讀取 records 之前列出的日誌物件（_list_journal）；省略時在寫入前列出，
+    並只清除內容與 records 一致的異動。成功則返回 True，否則返回 False。
     """
     try:
+        user_id = resolve_user(user_id)
         df = pd.DataFrame(records)
-        csv_data = df.to_csv(index=False)
-        blob = bucket.blob(DATA_FILE)
-        blob.upload_from_string(csv_data, content_type="text/csv")
+        if journal is None:
+            blobs = sorted(_list_journal(user_id), key=lambda b: b.name)
+            journal = [b for b, delta in zip(blobs, _load_journal(blobs)) if _reflects(df, delta)]
+        _write_partitions(_user_path(RECORDS_PREFIX, user_id), df)
+        if user_id == DEFAULT_USER:
+            _retire_legacy_csv(DATA_FILE)
+        _clear_journal(journal)
+        _drop_snapshot(user_id)
+        rebuild_rollups(user_id)
+        rebuild_search_index(user_id)
         return True
     except Exception as e:
         print("Error saving records:", e)
         return False
+    finally:
+        invalidate_cache(user_id=user_id)
 
-def remove_record_by_date(target_date, records):
-    updated_records = []
-    for rec in records:
-        rec_date = rec["date"].date() if isinstance(rec["date"], datetime.datetime) else pd.to_datetime(rec["date"]).date()
-        if rec_date != target_date:
-            updated_records.append(rec)
-    if save_records(updated_records):
+def _same_value(a, b):
+    if _is_blank(a) or _is_blank(b):
+        return _is_blank(a) and _is_blank(b)
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)):
+        return math.isclose(float(a), float(b), rel_tol=1e-6)
+    return a == b
+
+def _reflects(df, delta):
+    """df（完整的紀錄）是否已包含日誌異動 delta：刪除異動為該日不存在，其餘為每個欄位都相同。"""
+    day = pd.Timestamp(delta["date"]).normalize()
+    rows = df[df["date"].dt.normalize() == day] if "date" in df.columns and not df.empty else df.iloc[0:0]
+    if delta.get("_deleted"):
+        return rows.empty
+    if rows.empty:
+        return False
+    row = rows.iloc[-1]
+    return all(_same_value(row.get(k), v) for k, v in delta.items() if k != "date")
+
+def _record_date(rec):
+    return rec["date"].date() if isinstance(rec["date"], datetime.datetime) else pd.to_datetime(rec["date"]).date()
+
+def compute_sleep_hours(record_date, bed_time, wake_time):
+    """
+    由上床、起床時間計算睡眠時數（小時，取到小數一位）。
+    起床時間不晚於上床時間時視為隔天起床。上傳表單與批次匯入共用。
+    """
+    bed_datetime = datetime.datetime.combine(record_date, bed_time)
+    wake_datetime = datetime.datetime.combine(record_date, wake_time)
+    if wake_datetime <= bed_datetime:
+        wake_datetime += datetime.timedelta(days=1)
+    return round((wake_datetime - bed_datetime).total_seconds() / 3600.0, 1)
+
+def remove_record_by_date(target_date, records, user_id=None):
+    """
+    刪除指定日期的紀錄：只寫入一筆刪除異動到日誌，不再重寫整份快照。
+    成功則回傳移除後的 list，否則回傳 None。
+    """
+    updated_records = [rec for rec in records if _record_date(rec) != target_date]
+    if delete_record(target_date, user_id=user_id):
         return updated_records
     else:
         return None
 
-# --------------- 反思紀錄相關函式 ------------------
+# --------------- 日誌式儲存（每次提交只寫一個小物件） ------------------
+
+JOURNAL_PREFIX = "daily_records_journal/"
+COMPACT_THRESHOLD = 30  # 日誌異動累積到此數量時合併回快照
+
+def _journal_blob_name(record_date, user_id):
+    """每個日期對應一個異動物件：[users/<使用者>/]daily_records_journal/YYYYMMDD.json"""
+    return f"{_user_path(JOURNAL_PREFIX, user_id)}{record_date.strftime('%Y%m%d')}.json"
 
-REFLECTION_FILE = "reflection_records.csv"
+def _journal_date(blob_name):
+    return datetime.datetime.strptime(blob_name.rsplit("/", 1)[-1][:8], "%Y%m%d")
 
-def load_reflections():
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, "item"):  # numpy 純量
+        return value.item()
+    return str(value)
+
+def _record_to_json(record):
+    cleaned = {k: (None if isinstance(v, float) and pd.isna(v) else v) for k, v in record.items()}
+    return json.dumps(cleaned, default=_json_default, ensure_ascii=False)
+
+def _list_journal(user_id, start=None, end=None):
+    """列出使用者的日誌異動；日期由物件名稱判斷，範圍外的異動不會被下載。"""
+    blobs = list(get_bucket().list_blobs(prefix=_user_path(JOURNAL_PREFIX, user_id)))
+    if start is not None:
+        blobs = [b for b in blobs if _journal_date(b.name) >= _to_timestamp(start)]
+    if end is not None:
+        blobs = [b for b in blobs if _journal_date(b.name) <= _to_timestamp(end)]
+    return blobs
+
+def _load_journal(blobs):
     """
-    從 Google Cloud Storage 讀取 reflection_records.csv，並返回 list of dicts。
-    如果檔案不存在，回傳空列表。
+    下載列出的日誌異動，回傳 list of dicts（依物件名稱，即日期排序）。
+    刪除異動的格式為 {"date": ..., "_deleted": true}。
     """
-    blob = bucket.blob(REFLECTION_FILE)
-    if blob.exists():
+    deltas = []
+    for blob in sorted(blobs, key=lambda b: b.name):
+        deltas.append(_cached_blob(blob, _parse_json))
+    return deltas
+
+def _fold_journal(df, deltas):
+    """
+    將日誌異動套用到快照 DataFrame：同日期以異動為準，刪除異動則移除該日期。
+    """
+    if not deltas:
+        return df.sort_values("date").reset_index(drop=True) if "date" in df.columns else df
+    touched = pd.to_datetime([d["date"] for d in deltas]).normalize()
+    if "date" in df.columns and not df.empty:
+        df = df[~df["date"].dt.normalize().isin(touched)]
+    upserts = [d for d in deltas if not d.get("_deleted")]
+    delta_df = pd.DataFrame(upserts)
+    if not delta_df.empty:
+        delta_df["date"] = pd.to_datetime(delta_df["date"])
+    frames = [f for f in (df, delta_df) if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).sort_values("date").reset_index(drop=True)
+
+def _clear_journal(blobs):
+    """刪除已合併的異動；以 generation 為條件，避免誤刪合併期間新寫入的異動。"""
+    for blob in blobs:
         try:
-            csv_data = blob.download_as_text()
-            df = pd.read_csv(StringIO(csv_data), parse_dates=["date"])
-            return df.to_dict(orient="records")
+            blob.delete(if_generation_match=blob.generation)
         except Exception as e:
-            print("Error loading reflections:", e)
-            return []
+            print("Error deleting journal entry:", e)
+
+UPSERT_RETRIES = 3
+
+def _conflict_backoff(attempt):
+    """generation 衝突後、重試前的等待：指數成長並加上隨機抖動，同時衝突的寫入者不會再同時重試。"""
+    time.sleep(random.uniform(0, min(RETRY_INITIAL_DELAY * 2 ** attempt, RETRY_MAX_DELAY)))
+
+def _is_blank(value):
+    return value is None or (isinstance(value, float) and pd.isna(value)) or (isinstance(value, str) and not value.strip())
+
+def _merge_records(theirs, ours):
+    """以我方為準，但我方空白的欄位（例如沒有重新上傳的照片）保留對方的內容。"""
+    merged = dict(theirs)
+    merged.update({k: v for k, v in ours.items() if not _is_blank(v)})
+    return merged
+
+def record_generation(record_date, user_id=None):
+    """
+    使用者該日期日誌異動物件的 generation（沒有異動物件時為 0），即目前共用快照所依據的版本。
+    頁面在使用者看到資料、開始編輯時記下，寫入時傳給 queue_record／upsert_record／delete_record，
+    期間有其他人寫入同一天就會偵測到並合併，而不是靜默覆蓋。
+    """
+    user_id = resolve_user(user_id)
+    current_snapshot(user_id)
+    return _known_generation(record_date, user_id)
+
+def _known_generation(record_date, user_id):
+    """
+    呼叫端沒有提供 base_generation 時的基準：行程中已有共用快照就用它所依據的版本；
+    沒有快照（呼叫端不是依快照編輯）時取目前 GCS 上的 generation。
+    """
+    name = _journal_blob_name(record_date, user_id)
+    with _snapshot_lock:
+        entry = _snapshots.get(user_id)
+    if entry is not None:
+        return dict(entry[1][0]).get(name, 0)
+    blob = get_bucket().get_blob(name)
+    return blob.generation if blob is not None else 0
+
+def _put_journal(record_date, record, user_id, expected, max_retries=UPSERT_RETRIES):
+    """
+    寫入使用者該日期的異動物件，並以 if_generation_match=expected（寫入者讀取時的 generation，
+    0 表示當時物件尚不存在）確認期間沒有其他人寫入同一天；發生衝突時重新讀取對方的版本，
+    合併後再重試。刪除異動不與對方合併，直接以刪除為準。
+    回傳 (實際寫入的紀錄, 是否與他人的寫入合併, 新的 generation)；失敗時拋出例外。
+    """
+    name = _journal_blob_name(record_date, user_id)
+    pending = dict(record)
+    merged = False
+    try:
+        for attempt in range(max_retries + 1):
+            blob = get_bucket().blob(name)
+            try:
+                blob.upload_from_string(_record_to_json(pending), content_type="application/json",
+                                        if_generation_match=expected)
+            except PreconditionFailed:
+                current = get_bucket().get_blob(name)
+                if current is None:
+                    # 對方的異動已被合併進快照，物件不存在即可直接寫入
+                    expected = 0
+                    continue
+                theirs = json.loads(current.download_as_text())
+                expected = current.generation
+                if not theirs.get("_deleted") and not record.get("_deleted"):
+                    pending = _merge_records(theirs, record)
+                    merged = True
+                _conflict_backoff(attempt)
+                continue
+            return pending, merged, blob.generation
+    finally:
+        invalidate_cache(user_id=user_id)
+    raise RuntimeError("too many concurrent updates")
+
+def upsert_record(record_date, record, max_retries=UPSERT_RETRIES, user_id=None, base_generation=None):
+    """
+    以日期為鍵新增或覆蓋使用者的一筆紀錄，只寫入一次該日期的異動物件，
+    並以 if_generation_match 確認自讀取後沒有其他人寫入同一天。base_generation 為表單所依據的
+    generation（record_generation），省略時見 _known_generation。
+    發生衝突時重新讀取對方的版本，合併後再重試。
+    回傳 (是否成功, 是否與他人的寫入合併)。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        if base_generation is None:
+            base_generation = _known_generation(record_date, user_id)
+        pending, merged, generation = _put_journal(record_date, record, user_id, base_generation, max_retries)
+    except Exception as e:
+        print("Error saving record:", e)
+        return False, False
+    _apply_to_snapshot(user_id, records={record_date: pending},
+                       journal={_journal_blob_name(record_date, user_id): generation})
+    _update_rollups([record_date], user_id)
+    _update_search_index(user_id, dates=[record_date])
+    maybe_compact_records(user_id)
+    return True, merged
+
+def get_record(record_date, user_id=None):
+    """以日期取得使用者的單日紀錄（查詢共用快照，含佇列中尚未寫出的紀錄），沒有則回傳 None。"""
+    try:
+        return current_snapshot(user_id).get_record(record_date)
+    except Exception as e:
+        print("Error loading records:", e)
+        return None
+
+def delete_record(target_date, user_id=None, base_generation=None):
+    """
+    寫入一筆刪除異動，使使用者該日期的紀錄在讀取時被移除。與 upsert_record 相同，
+    以 base_generation（省略時見 _known_generation）為條件寫入，並記下新的 generation。
+    成功則返回 True，否則返回 False。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        if base_generation is None:
+            base_generation = _known_generation(target_date, user_id)
+        deletion = {"date": datetime.datetime.combine(target_date, datetime.time(0, 0)), "_deleted": True}
+        _, _, generation = _put_journal(target_date, deletion, user_id, base_generation)
+    except Exception as e:
+        print("Error deleting record:", e)
+        return False
+    _apply_to_snapshot(user_id, records={target_date: None},
+                       journal={_journal_blob_name(target_date, user_id): generation})
+    _update_rollups([target_date], user_id)
+    _update_search_index(user_id, dates=[target_date])
+    maybe_compact_records(user_id)
+    return True
+
+def compact_records(user_id=None):
+    """
+    將使用者日誌中的異動合併進 Parquet 快照，只改寫異動涉及的月份，
+    並刪除已合併的異動物件。尚未遷移時會先完成 CSV 遷移。
+    成功則返回 True，否則返回 False。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        if user_id == DEFAULT_USER and get_bucket().get_blob(DATA_FILE) is not None:
+            return migrate_csv_to_parquet()["records"] is not None
+        _compact(user_id)
+        return True
+    except Exception as e:
+        print("Error compacting records:", e)
+        return False
+
+def _compact(user_id):
+    """
+    將日誌異動合併進涉及月份的快照，再刪除已合併的日誌物件。每個月份以讀取時的 generation 為條件寫回；
+    期間有其他行程改寫同一個月份（例如同時進行的合併）時，重新列出日誌並重新讀取後再試。
+    失敗時拋出例外。
+    """
+    prefix = _user_path(RECORDS_PREFIX, user_id)
+    for attempt in range(UPSERT_RETRIES + 1):
+        blobs = _list_journal(user_id)
+        deltas = _load_journal(blobs)
+        if not deltas:
+            return
+        months = {pd.Timestamp(d["date"]).strftime("%Y-%m") for d in deltas}
+        df, generations = _read_for_update(prefix, months)
+        try:
+            _write_partitions(prefix, _fold_journal(df, deltas), months=months, generations=generations)
+        except PreconditionFailed:
+            _conflict_backoff(attempt)
+            continue
+        _clear_journal(blobs)
+        return
+    raise RuntimeError("快照同時被多個合併改寫，請稍後再試")
+
+def maybe_compact_records(user_id=None, threshold=COMPACT_THRESHOLD):
+    """使用者的日誌異動數量達到門檻時才執行合併。"""
+    try:
+        user_id = resolve_user(user_id)
+        if len(_list_journal(user_id)) >= threshold:
+            compact_records(user_id)
+    except Exception as e:
+        print("Error checking journal:", e)
+
+INTEGER_COLUMNS = ["steps", "sugary_drinks"]
+
+def _merge_import(incoming, existing):
+    """以匯入的非空白欄位覆蓋既有紀錄，回傳 (合併後的 DataFrame, 新增天數)。"""
+    known = set(existing["date"].dt.normalize()) if not existing.empty else set()
+    added = int((~incoming["date"].isin(known)).sum())
+    if existing.empty:
+        merged = incoming
     else:
+        existing = existing.assign(date=existing["date"].dt.normalize()).set_index("date")
+        merged = incoming.set_index("date").combine_first(existing).reset_index()
+    for column in INTEGER_COLUMNS:
+        if column in merged.columns and merged[column].notna().all():
+            merged[column] = merged[column].astype("int64")
+    return merged, added
+
+def bulk_upsert_records(records, user_id=None):
+    """
+    以日期為鍵一次合併多筆紀錄（批次匯入用）：匯入的非空白欄位覆蓋既有內容，
+    空白欄位保留原值。只改寫涉及的月份，並把日誌一併合併清除，整批只寫一次。
+    涉及的月份以讀取時的 generation 為條件寫回，期間有人改寫時重新讀取、合併後再試。
+    回傳 {"added": 新增天數, "updated": 更新天數}；失敗時回傳 None。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        incoming = pd.DataFrame(records)
+        if incoming.empty:
+            return {"added": 0, "updated": 0}
+        incoming["date"] = pd.to_datetime(incoming["date"]).dt.normalize()
+        incoming = incoming.groupby("date").last().reset_index()
+        if user_id == DEFAULT_USER and get_bucket().get_blob(DATA_FILE) is not None:
+            # 尚未遷移：與舊版 CSV 合併後整份寫成 Parquet（順便完成遷移）
+            journal = _list_journal(user_id)
+            merged, added = _merge_import(incoming, _load_records_frame(user_id))
+            if not save_records(merged.to_dict(orient="records"), user_id=user_id, journal=journal):
+                return None
+            return {"added": added, "updated": len(incoming) - added}
+        prefix = _user_path(RECORDS_PREFIX, user_id)
+        for attempt in range(UPSERT_RETRIES + 1):
+            blobs = _list_journal(user_id)
+            deltas = _load_journal(blobs)
+            months = set(incoming["date"].dt.strftime("%Y-%m"))
+            months |= {pd.Timestamp(d["date"]).strftime("%Y-%m") for d in deltas}
+            df, generations = _read_for_update(prefix, months)
+            merged, added = _merge_import(incoming, _fold_journal(df, deltas))
+            try:
+                _write_partitions(prefix, merged, months=months, generations=generations)
+                break
+            except PreconditionFailed:
+                _conflict_backoff(attempt)
+        else:
+            print("Error importing records: too many concurrent updates")
+            return None
+        _clear_journal(blobs)
+        invalidate_cache(user_id=user_id)
+        _drop_snapshot(user_id)
+        _update_rollups(incoming["date"].dt.date.tolist(), user_id)
+        _update_search_index(user_id, dates=incoming["date"].dt.date.tolist())
+        return {"added": added, "updated": len(incoming) - added}
+    except Exception as e:
+        print("Error importing records:", e)
+        return None
+    finally:
+        invalidate_cache(user_id=user_id)
+
+# --------------- 延後寫入：送出後先排入本機佇列，由背景執行緒寫到 GCS ------------------
+
+def _in_range(value, start=None, end=None):
+    value = pd.Timestamp(value)
+    return (start is None or value >= _to_timestamp(start)) and (end is None or value <= _to_timestamp(end))
+
+BASE_GENERATION_KEY = "_base_generation"  # 佇列項目中記錄表單所依據 generation 的欄位，寫出時取出
+
+def _queued_records(user_id, start=None, end=None):
+    """佇列中尚未寫出的每日紀錄（格式同日誌異動），依日期排序。"""
+    deltas = [json.loads(payload) for _, payload in sorted(write_queue.pending("record", user_id).items())]
+    for delta in deltas:
+        delta.pop(BASE_GENERATION_KEY, None)
+    return [d for d in deltas if _in_range(d["date"], start, end)]
+
+def queue_record(record_date, record, user_id=None, base_generation=None):
+    """
+    將使用者的單日紀錄排入本機佇列後立即返回，由背景執行緒寫到 GCS（同一天的多次送出只寫最後一次）。
+    base_generation 為表單所依據的 generation（record_generation），與紀錄一起存進佇列，
+    寫出時以它為條件；省略時見 _known_generation。
+    回傳佇列編號，可用 write_queue.status() 查詢是否已寫出；
+    佇列無法使用時改為直接寫入，成功回傳 0（視為已寫出），失敗回傳 None。
+    """
+    try:
+        user_id = resolve_user(user_id)
+    except ValueError as e:
+        print("Error saving record:", e)
+        return None
+    try:
+        if base_generation is None:
+            base_generation = _known_generation(record_date, user_id)
+        payload = _record_to_json({**record, BASE_GENERATION_KEY: base_generation})
+        entry_id = write_queue.enqueue("record", user_id, record_date.isoformat(), payload)
+    except Exception as e:
+        print("Error queueing record:", e)
+        ok, _ = upsert_record(record_date, record, user_id=user_id, base_generation=base_generation)
+        return 0 if ok else None
+    # 尚未寫到 GCS 也立即換上新版快照，其他 session 下次 rerun 就看得到
+    _apply_to_snapshot(user_id, records={record_date: record})
+    return entry_id
+
+def _flush_queued_records(user_id, payloads):
+    """
+    寫出佇列中同一使用者的紀錄 {日期: JSON}：每一天都與 upsert_record 相同，以送出時記下的
+    generation 為條件寫入該日期的異動物件，與他人同一天的寫入合併；彙總表、搜尋索引與合併檢查整批只做一次。
+    回傳 {日期: "merged"}（有與他人合併的日期），由佇列記在項目上供頁面顯示。
+    失敗時拋出例外，由佇列稍後重試。
+    """
+    written = {}
+    generations = {}
+    outcomes = {}
+    for key, payload in sorted(payloads.items()):
+        delta = json.loads(payload)
+        record_date = pd.Timestamp(delta["date"]).date()
+        expected = delta.pop(BASE_GENERATION_KEY, None)
+        if expected is None:  # 舊版排入的項目沒有記下 generation
+            expected = _known_generation(record_date, user_id)
+        name = _journal_blob_name(record_date, user_id)
+        written[record_date], merged, generations[name] = _put_journal(record_date, delta, user_id, expected)
+        if merged:
+            outcomes[key] = "merged"
+    _apply_to_snapshot(user_id, records=written, journal=generations)
+    _update_rollups(list(written), user_id)
+    _update_search_index(user_id, dates=list(written))
+    maybe_compact_records(user_id)
+    return outcomes
+
+def _queued_reflections(user_id, start=None, end=None):
+    """佇列中尚未寫出的反思 {週起始日: 內容}。"""
+    return {datetime.date.fromisoformat(week): text
+            for week, text in write_queue.pending("reflection", user_id).items() if _in_range(week, start, end)}
+
+def queue_reflection(week_start, text, user_id=None):
+    """將使用者某週的反思排入本機佇列後立即返回；回傳值同 queue_record。"""
+    try:
+        user_id = resolve_user(user_id)
+    except ValueError as e:
+        print("Error saving reflection:", e)
+        return None
+    try:
+        entry_id = write_queue.enqueue("reflection", user_id, week_start_of(week_start).isoformat(), text)
+    except Exception as e:
+        print("Error queueing reflection:", e)
+        return 0 if upsert_reflection(week_start, text, user_id=user_id) else None
+    _apply_to_snapshot(user_id, reflections={week_start_of(week_start): text})
+    return entry_id
+
+def _flush_queued_reflections(user_id, payloads):
+    _write_reflections(user_id, {datetime.date.fromisoformat(week): text for week, text in payloads.items()})
+
+write_queue.register("record", _flush_queued_records)
+write_queue.register("reflection", _flush_queued_reflections)
+
+# --------------- 每週／每月彙總表 ------------------
+
+ROLLUP_FILE = "daily_records_rollup.parquet"
+ROLLUP_STATS = ["count", "sum", "min", "max"]
+ROLLUP_PERIODS = ["W", "M"]
+
+def _compute_rollups(df, period):
+    """以 groupby 計算每個週期、每個數值欄位的 count / sum / min / max。"""
+    columns = ["period", "period_start"] + [f"{m}_{stat}" for m in NUMERIC_COLUMNS for stat in ROLLUP_STATS]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    values = df.reindex(columns=NUMERIC_COLUMNS).apply(pd.to_numeric, errors="coerce")
+    keys = pd.to_datetime(df["date"]).dt.to_period(period).dt.start_time.rename("period_start")
+    agg = values.groupby(keys).agg(ROLLUP_STATS)
+    agg.columns = [f"{m}_{stat}" for m, stat in agg.columns]
+    agg = agg.reset_index()
+    agg.insert(0, "period", period)
+    return agg[columns]
+
+def _all_rollups(df):
+    return pd.concat([_compute_rollups(df, p) for p in ROLLUP_PERIODS], ignore_index=True)
+
+def _write_rollups(rollups, user_id, if_generation_match=None):
+    buf = BytesIO()
+    rollups.to_parquet(buf, index=False)
+    get_bucket().blob(_user_path(ROLLUP_FILE, user_id)).upload_from_string(
+        buf.getvalue(), content_type="application/vnd.apache.parquet", if_generation_match=if_generation_match)
+    _update_summary(user_id, rollups)
+
+def rebuild_rollups(user_id=None):
+    """由使用者全部的每日紀錄重建彙總表。成功則返回 True，否則返回 False。"""
+    try:
+        user_id = resolve_user(user_id)
+        invalidate_cache(user_id=user_id)
+        df = pd.DataFrame(load_records(columns=NUMERIC_COLUMNS, user_id=user_id, include_pending=False))
+        _write_rollups(_all_rollups(df), user_id)
+        return True
+    except Exception as e:
+        print("Error rebuilding rollups:", e)
+        return False
+    finally:
+        invalidate_cache(user_id=user_id)
+
+def _in_buckets(rollups, keys):
+    """回傳布林陣列：彙總表的每一列是否屬於 keys 中的 (period, period_start)。"""
+    if rollups.empty:
+        return pd.Series(dtype=bool).to_numpy()
+    index = pd.MultiIndex.from_arrays([rollups["period"], pd.to_datetime(rollups["period_start"])])
+    return index.isin(keys)
+
+def _update_rollups(dates, user_id):
+    """
+    只重算這些日期所在的週與月：讀取涵蓋這些週期的紀錄（最多數週），
+    替換彙總表中對應的列，並以 generation 為條件寫回，衝突時重試。
+    """
+    buckets = {(p, pd.Timestamp(d).to_period(p)) for d in dates for p in ROLLUP_PERIODS}
+    keys = [(p, period.start_time) for p, period in buckets]
+    start = min(period.start_time for _, period in buckets).date()
+    end = max(period.end_time for _, period in buckets).date()
+    try:
+        for attempt in range(UPSERT_RETRIES + 1):
+            blob = get_bucket().get_blob(_user_path(ROLLUP_FILE, user_id))
+            if blob is None:
+                rebuild_rollups(user_id)
+                return
+            invalidate_cache(user_id=user_id)
+            # 只彙總已寫到 GCS 的紀錄：佇列中的項目可能寫出失敗或被較新的送出取代，寫出後會再更新彙總
+            df = pd.DataFrame(load_records(start=start, end=end, columns=NUMERIC_COLUMNS, user_id=user_id,
+                                           include_pending=False))
+            fresh = _all_rollups(df)
+            fresh = fresh[_in_buckets(fresh, keys)]
+            current = _cached_blob(blob, _parse_table)
+            # 刪除最後一筆紀錄後兩者都可能是空的，仍要寫回空表
+            frames = [f for f in (current[~_in_buckets(current, keys)], fresh) if not f.empty]
+            rollups = pd.concat(frames, ignore_index=True) if frames else fresh
+            try:
+                _write_rollups(rollups.sort_values(["period", "period_start"]), user_id,
+                               if_generation_match=blob.generation)
+                return
+            except PreconditionFailed:
+                _conflict_backoff(attempt)
+        print("Error updating rollups: too many concurrent updates")
+    except Exception as e:
+        print("Error updating rollups:", e)
+    finally:
+        invalidate_cache(user_id=user_id)
+
+def load_rollups(period="W", start=None, end=None, user_id=None):
+    """
+    讀取使用者彙總表中指定週期（'W' 或 'M'）的列，依 period_start 排序，
+    並附上各欄位的平均值 <欄位>_mean。彙總表不存在時先重建。
+    """
+    def _load():
+        name = _user_path(ROLLUP_FILE, user_id)
+        blob = get_bucket().get_blob(name)
+        if blob is None:
+            rebuild_rollups(user_id)
+            blob = get_bucket().get_blob(name)
+        return _cached_blob(blob, _parse_table)
+    try:
+        user_id = resolve_user(user_id)
+        df = _cached_result(("rollups", user_id), _load)
+    except Exception as e:
+        print("Error loading rollups:", e)
+        return pd.DataFrame()
+    df = df[df["period"] == period]
+    if start is not None:
+        df = df[df["period_start"] >= _to_timestamp(start)]
+    if end is not None:
+        df = df[df["period_start"] <= _to_timestamp(end)]
+    df = df.sort_values("period_start").reset_index(drop=True)
+    for m in NUMERIC_COLUMNS:
+        df[f"{m}_mean"] = df[f"{m}_sum"] / df[f"{m}_count"].where(df[f"{m}_count"] > 0)
+    return df
+
+def overall_means(user_id=None):
+    """由使用者的每月彙總計算全期平均，回傳 {欄位: 平均}；沒有資料的欄位為 0。"""
+    monthly = load_rollups("M", user_id=user_id)
+    means = {}
+    for m in NUMERIC_COLUMNS:
+        count = monthly[f"{m}_count"].sum() if not monthly.empty else 0
+        means[m] = monthly[f"{m}_sum"].sum() / count if count else 0
+    return means
+
+# --------------- 跨使用者摘要 ------------------
+
+SUMMARY_FILE = "summary.json"  # 每位使用者一個摘要物件：[users/<使用者>/]summary.json，讀取時彙整
+
+def _summary_row(user_id, rollups):
+    """由使用者的每月彙總算出摘要列：各欄位的 count / sum、紀錄月份範圍與更新時間。"""
+    monthly = rollups[rollups["period"] == "M"] if not rollups.empty else rollups
+    row = {"user_id": user_id}
+    for m in NUMERIC_COLUMNS:
+        row[f"{m}_count"] = int(monthly[f"{m}_count"].sum()) if not monthly.empty else 0
+        row[f"{m}_sum"] = float(monthly[f"{m}_sum"].sum()) if not monthly.empty else 0.0
+    row["days"] = max(row[f"{m}_count"] for m in NUMERIC_COLUMNS)
+    starts = pd.to_datetime(monthly["period_start"]) if not monthly.empty else pd.Series(dtype="datetime64[ns]")
+    row["first_month"] = starts.min().strftime("%Y-%m") if not starts.empty else None
+    row["last_month"] = starts.max().strftime("%Y-%m") if not starts.empty else None
+    row["updated_at"] = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    return row
+
+def _update_summary(user_id, rollups):
+    """
+    寫出使用者自己的摘要物件。每位使用者各一個物件，不同使用者的寫入不會競爭同一個物件；
+    跨使用者的檢視在讀取時才彙整（load_user_summary）。
+    """
+    try:
+        get_bucket().blob(_user_path(SUMMARY_FILE, user_id)).upload_from_string(
+            json.dumps(_summary_row(user_id, rollups), default=_json_default), content_type="application/json")
+    except Exception as e:
+        print("Error updating summary:", e)
+
+def _summary_blobs():
+    """列出所有使用者的摘要物件：預設使用者在根目錄，其他使用者以 match_glob 只列出 users/*/summary.json。"""
+    root = get_bucket().get_blob(SUMMARY_FILE)
+    listed = get_bucket().list_blobs(prefix=USER_PREFIX, match_glob=f"{USER_PREFIX}*/{SUMMARY_FILE}")
+    # 不支援 match_glob 的後端（LocalBucket）會列出全部，這裡再過濾一次
+    users = [b for b in listed if b.name.count("/") == 2 and b.name.endswith("/" + SUMMARY_FILE)]
+    return ([root] if root is not None else []) + users
+
+def load_user_summary():
+    """
+    彙整所有使用者的摘要（每位使用者一列），並附上各欄位的平均值 <欄位>_mean。
+    每位使用者一個小物件，列出後只下載 generation 有變動者，不需讀取任何使用者的分割。
+    沒有資料時回傳空 DataFrame。
+    """
+    def _load():
+        rows = [_cached_blob(blob, _parse_json) for blob in _summary_blobs()]
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows).sort_values("user_id").reset_index(drop=True)
+        df["updated_at"] = pd.to_datetime(df["updated_at"])
+        return df
+    try:
+        df = _cached_result(("summary",), _load).copy()
+    except Exception as e:
+        print("Error loading summary:", e)
+        return pd.DataFrame()
+    for m in NUMERIC_COLUMNS:
+        if f"{m}_sum" in df.columns:
+            df[f"{m}_mean"] = df[f"{m}_sum"] / df[f"{m}_count"].where(df[f"{m}_count"] > 0)
+    return df
+
+def list_users():
+    """
+    列出 bucket 中所有使用者代號（第一個為預設使用者）。
+    以 delimiter 只列出 users/ 底下的目錄名稱，不會逐一列出各使用者的物件。
+    """
+    blobs = get_bucket().list_blobs(prefix=USER_PREFIX, delimiter="/")
+    for _ in blobs.pages:
+        pass
+    users = sorted(prefix[len(USER_PREFIX):].rstrip("/") for prefix in blobs.prefixes)
+    return [DEFAULT_USER] + [u for u in users if USER_ID_PATTERN.fullmatch(u)]
+
+# --------------- 三餐描述與反思的全文搜尋索引 ------------------
+
+SEARCH_INDEX_PREFIX = "search_index/"  # 依月份分割：search_index/YYYY-MM.parquet，文件歸入其日期（反思為週起始日）的月份
+LEGACY_SEARCH_INDEX_FILE = "search_index.parquet"  # 舊版的單一索引檔，重建時刪除
+SEARCH_RECORD_FIELDS = [f for f in SEARCH_FIELDS if f != "reflection"]
+SEARCH_LIMIT = 200
+
+def _search_docs(user_id, months=None, include_pending=False):
+    """
+    回傳 {月份: [(doc, 原文)]}：months（None 為全部）中各月份的三餐描述與反思。
+    指定 months 時每個月份都有鍵，沒有文件的月份為空 list。寫入索引時只用已寫到 GCS 的內容；
+    include_pending 為 True 時套用佇列（查詢時確認原文用，送出後立刻看得到自己的內容）。
+    """
+    start = end = None
+    if months is not None:
+        periods = sorted(pd.Period(m, "M") for m in months)
+        start, end = periods[0].start_time, periods[-1].end_time
+    by_month = {m: [] for m in months} if months is not None else {}
+    for rec in load_records(start=start, end=end, columns=SEARCH_RECORD_FIELDS, user_id=user_id,
+                            include_pending=include_pending):
+        month = pd.Timestamp(rec["date"]).strftime("%Y-%m")
+        if months is None or month in months:
+            by_month.setdefault(month, []).extend(
+                (doc_key(rec["date"], field), rec.get(field)) for field in SEARCH_RECORD_FIELDS)
+    # 舊資料的反思日期不一定是週一：多讀前 6 天，再依週起始日歸入月份（同一週以較晚的為準）
+    texts = {}
+    reflection_start = start - pd.Timedelta(days=6) if start is not None else None
+    for rec in load_reflections(start=reflection_start, end=end, columns=["reflection"], user_id=user_id,
+                                include_pending=include_pending):
+        texts[week_start_of(rec["date"])] = rec.get("reflection")
+    for week, text in texts.items():
+        month = pd.Timestamp(week).strftime("%Y-%m")
+        if months is None or month in months:
+            by_month.setdefault(month, []).append((doc_key(week, "reflection"), text))
+    return by_month
+
+def _write_search_shard(prefix, month, table, if_generation_match=None):
+    buf = BytesIO()
+    table.to_parquet(buf, index=False)
+    get_bucket().blob(_partition_blob_name(prefix, month)).upload_from_string(
+        buf.getvalue(), content_type="application/vnd.apache.parquet", if_generation_match=if_generation_match)
+
+def rebuild_search_index(user_id=None):
+    """
+    由使用者全部的三餐描述與反思重建搜尋索引的每個月份分割，並刪除已沒有資料的分割與舊版的單一索引檔。
+    成功則返回 True，否則返回 False。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        invalidate_cache(user_id=user_id)
+        prefix = _user_path(SEARCH_INDEX_PREFIX, user_id)
+        by_month = _search_docs(user_id)
+        with timed("search.rebuild"):
+            tables = {month: index_rows(docs) for month, docs in by_month.items()}
+        for month, table in tables.items():
+            _write_search_shard(prefix, month, table)
+        stale = [b for b in _list_partitions(prefix) if _partition_month(b.name, prefix) not in tables]
+        legacy = get_bucket().get_blob(_user_path(LEGACY_SEARCH_INDEX_FILE, user_id))
+        for blob in stale + ([legacy] if legacy is not None else []):
+            blob.delete()
+        return True
+    except Exception as e:
+        print("Error rebuilding search index:", e)
+        return False
+    finally:
+        invalidate_cache(user_id=user_id)
+
+def _update_search_index(user_id, dates=(), weeks=()):
+    """
+    只重新斷詞這些日期的三餐描述與這些週的反思，替換所在月份分割中對應的文件；
+    每個分割以 generation 為條件寫回（尚未存在時為 0），衝突時重新讀取後重試（同 _update_rollups）。
+    還沒有任何分割（從未建立或仍是舊版的單一索引檔）時改為整個重建。
+    """
+    stale = {}
+    for d in {pd.Timestamp(d).date() for d in dates}:
+        stale.setdefault(d.strftime("%Y-%m"), set()).update(doc_key(d, f) for f in SEARCH_RECORD_FIELDS)
+    for w in {week_start_of(w) for w in weeks}:
+        stale.setdefault(w.strftime("%Y-%m"), set()).add(doc_key(w, "reflection"))
+    if not stale:
+        return
+    try:
+        prefix = _user_path(SEARCH_INDEX_PREFIX, user_id)
+        shards = {_partition_month(b.name, prefix): b for b in _list_partitions(prefix)}
+        if not shards:
+            rebuild_search_index(user_id)
+            return
+        for attempt in range(UPSERT_RETRIES + 1):
+            invalidate_cache(user_id=user_id)
+            by_month = _search_docs(user_id, set(stale))
+            conflicts = {}
+            for month, docs in stale.items():
+                blob = shards.get(month)
+                if blob is None:
+                    # 這個月份還沒有分割：由該月全部的文件建立
+                    table, generation = index_rows(by_month[month]), 0
+                else:
+                    current = _cached_blob(blob, _parse_table)
+                    fresh = index_rows([(doc, text) for doc, text in by_month[month] if doc in docs])
+                    frames = [f for f in (current[~current["doc"].isin(docs)], fresh) if not f.empty]
+                    table = pd.concat(frames, ignore_index=True) if frames else fresh
+                    generation = blob.generation
+                try:
+                    _write_search_shard(prefix, month, table, if_generation_match=generation)
+                except PreconditionFailed:
+                    conflicts[month] = docs
+            if not conflicts:
+                return
+            _conflict_backoff(attempt)
+            stale = conflicts
+            shards = {_partition_month(b.name, prefix): b for b in _list_partitions(prefix, months=set(stale))}
+        print("Error updating search index: too many concurrent updates")
+    except Exception as e:
+        print("Error updating search index:", e)
+    finally:
+        invalidate_cache(user_id=user_id)
+
+def load_search_index(user_id=None):
+    """
+    讀取使用者搜尋索引的各月份分割 [(月份, SearchIndex)]（新到舊），還沒有任何分割時先重建。
+    每個分割依 generation 快取在行程中，寫入只會讓該月份的分割重新下載與建立。
+    """
+    def _load():
+        prefix = _user_path(SEARCH_INDEX_PREFIX, user_id)
+        blobs = _list_partitions(prefix)
+        if not blobs:
+            rebuild_search_index(user_id)
+            blobs = _list_partitions(prefix)
+        return [(_partition_month(b.name, prefix), _cached_blob(b, lambda b: SearchIndex(_parse_table(b)), "index"))
+                for b in reversed(blobs)]
+    user_id = resolve_user(user_id)
+    return _cached_result(("search_index", user_id), _load)
+
+def search_records(query, fields=None, limit=SEARCH_LIMIT, user_id=None):
+    """
+    在使用者的三餐描述與反思中搜尋 query，回傳 [{"date", "field", "text"}]（新到舊）。
+    fields 限定欄位（SEARCH_FIELDS 的子集）。索引只存詞與文件，確認與顯示用的原文
+    只讀取有候選文件的月份（紀錄與反思的分割、日誌及佇列），不載入全部資料。失敗時回傳空列表。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        shards = load_search_index(user_id)
+        with timed("search.query"):
+            return search(shards, query, lambda month: dict(_search_docs(user_id, {month}, include_pending=True)[month]),
+                          fields=fields, limit=limit)
+    except Exception as e:
+        print("Error searching records:", e)
+        return []
+
+# --------------- 頁面的日期區間選擇 ------------------
+
+DEFAULT_WEEKS = 4  # 預設只顯示最近幾週，每按一次「載入更早的紀錄」再多顯示這麼多週
+
+def list_record_months(user_id=None):
+    """
+    列出使用者有每日紀錄的月份（'YYYY-MM'，新到舊）。
+    由快照分割與日誌的物件名稱判斷，不下載內容；尚未遷移時才讀舊版 CSV。
+    """
+    def _list():
+        if user_id == DEFAULT_USER and get_bucket().get_blob(DATA_FILE) is not None:
+            dates = pd.DatetimeIndex([rec["date"] for rec in load_records(columns=[], user_id=user_id)])
+            return sorted(set(dates.strftime("%Y-%m")), reverse=True)
+        prefix = _user_path(RECORDS_PREFIX, user_id)
+        months = {_partition_month(b.name, prefix) for b in _list_partitions(prefix)}
+        months |= {_journal_date(b.name).strftime("%Y-%m") for b in _list_journal(user_id)}
+        return sorted(months, reverse=True)
+    try:
+        user_id = resolve_user(user_id)
+        return list(_cached_result(("months", user_id), _list))
+    except Exception as e:
+        print("Error listing months:", e)
+        return []
+
+def format_value(value, spec, suffix=""):
+    """
+    頁面顯示用：依 spec 格式化數值並加上 suffix（時數以 float32 保存，直接顯示會帶出多餘位數）；
+    缺值（None、NaN、<NA>）顯示「無」。
+    """
+    return "無" if value is None or pd.isna(value) else format(value, spec) + suffix
+
+def _show_more_weeks(weeks_key):
+    st.session_state[weeks_key] += DEFAULT_WEEKS
+
+def select_date_window(key):
+    """
+    在頁面上顯示檢視範圍選擇（最近幾週／指定月份），回傳 (start, end) 日期（含）。
+    頁面只需載入並繪製這個範圍內的紀錄。
+    """
+    mode = st.radio("檢視範圍", ["最近幾週", "指定月份"], horizontal=True, key=f"{key}_mode")
+    if mode == "指定月份":
+        months = list_record_months()
+        if not months:
+            return None, None
+        month = pd.Period(st.selectbox("月份", months, key=f"{key}_month"), "M")
+        return month.start_time.date(), month.end_time.date()
+    weeks_key = f"{key}_weeks"
+    st.session_state.setdefault(weeks_key, DEFAULT_WEEKS)
+    weeks = st.session_state[weeks_key]
+    this_week = pd.Timestamp(datetime.date.today()).to_period("W")
+    start = (this_week - (weeks - 1)).start_time.date()
+    end = this_week.end_time.date()
+    st.caption(f"顯示 {start} ~ {end}（最近 {weeks} 週）")
+    st.button("載入更早的紀錄", key=f"{key}_more", on_click=_show_more_weeks, args=(weeks_key,))
+    return start, end
+
+# --------------- 反思紀錄相關函式 ------------------
+
+REFLECTION_FILE = "reflection_records.csv"  # 舊版 CSV（遷移後移至 legacy/）
+REFLECTION_PREFIX = "reflection_records/"  # Parquet，依月份分割
+
+def load_reflections(start=None, end=None, columns=None, user_id=None, include_pending=True):
+    """
+    從 Google Cloud Storage 讀取使用者的反思紀錄，並返回 list of dicts。
+    start / end（含）限定日期範圍；尚未遷移時讀舊版 reflection_records.csv。
+    include_pending 同 load_records。如果檔案不存在，回傳空列表。
+    """
+    try:
+        user_id = resolve_user(user_id)
+        key = ("reflections", user_id, start, end, columns and tuple(columns))
+        df = _cached_result(key, lambda: _load_reflections_frame(user_id, start, end, columns))
+        queued = _queued_reflections(user_id, start, end) if include_pending else {}
+        if queued:
+            df = _select_columns(_overlay_reflections(df, queued), columns)
+        return df.to_dict(orient="records")
+    except Exception as e:
+        print("Error loading reflections:", e)
         return []
 
-def save_reflections(records):
+def _overlay_reflections(df, texts):
+    """以 {週起始日: 內容} 取代 df 中同一週的反思，回傳依日期排序的新 DataFrame。"""
+    if not df.empty:
+        df = df[~df["date"].dt.to_period("W").dt.start_time.dt.date.isin(texts)]
+    rows = pd.DataFrame({"date": pd.to_datetime(list(texts)), "reflection": list(texts.values())})
+    frames = [f for f in (df, rows) if not f.empty]
+    return pd.concat(frames, ignore_index=True).sort_values("date").reset_index(drop=True)
+
+def _load_reflections_frame(user_id, start=None, end=None, columns=None):
+    legacy = _read_legacy_csv(REFLECTION_FILE, user_id)
+    if legacy is not None:
+        df = _filter_range(legacy, start, end)
+    else:
+        df = _read_partitions(_user_path(REFLECTION_PREFIX, user_id), start, end, columns)
+    return _select_columns(df, columns)
+
+def save_reflections(records, user_id=None):
     """
-    將反思紀錄 list 儲存為 CSV，然後上傳到 Google Cloud Storage。
+    將使用者的反思紀錄 list 依月份存成 Parquet，然後上傳到 Google Cloud Storage。
     成功則返回 True，否則返回 False。
     """
     try:
-        df = pd.DataFrame(records)
-        csv_data = df.to_csv(index=False)
-        blob = bucket.blob(REFLECTION_FILE)
-        blob.upload_from_string(csv_data, content_type="text/csv")
+        user_id = resolve_user(user_id)
+        _write_partitions(_user_path(REFLECTION_PREFIX, user_id), pd.DataFrame(records))
+        if user_id == DEFAULT_USER:
+            _retire_legacy_csv(REFLECTION_FILE)
+        invalidate_cache(user_id=user_id)
+        _drop_snapshot(user_id)
+        rebuild_search_index(user_id)
         return True
     except Exception as e:
         print("Error saving reflections:", e)
         return False
+    finally:
+        invalidate_cache(user_id=user_id)
+
+# --------------- 以週起始日為鍵的反思索引 ------------------
+
+def week_start_of(value):
+    """回傳日期所屬週（週一起算）的起始日 datetime.date。"""
+    return pd.Timestamp(value).to_period("W").start_time.date()
+
+def _build_reflection_index(user_id):
+    df = _load_reflections_frame(user_id)
+    if df.empty or "reflection" not in df.columns:
+        return {}
+    df = df.sort_values("date")
+    weeks = df["date"].dt.to_period("W").dt.start_time.dt.date
+    texts = df["reflection"].where(df["reflection"].notna(), "")
+    return dict(zip(weeks, texts))
+
+def get_reflection(week_start, user_id=None):
+    """
+    取得使用者某週的反思內容，沒有則回傳空字串。
+    {週起始日: 內容} 的索引放在共用快照中，所有 session 共用，每次查詢為 O(1)。
+    """
+    try:
+        return current_snapshot(user_id).get_reflection(week_start_of(week_start))
+    except Exception as e:
+        print("Error loading reflections:", e)
+        return ""
+
+def upsert_reflection(week_start, text, user_id=None):
+    """
+    新增或更新使用者某週的反思，只改寫該週所在月份的分割檔。
+    成功則返回 True，否則返回 False。
+    """
+    try:
+        _write_reflections(resolve_user(user_id), {week_start_of(week_start): text})
+        return True
+    except Exception as e:
+        print("Error saving reflection:", e)
+        return False
+
+def _write_reflections(user_id, texts):
+    """以 {週起始日: 內容} 新增或覆蓋多週的反思，涉及的月份各改寫一次。失敗時拋出例外。"""
+    try:
+        if user_id == DEFAULT_USER and get_bucket().get_blob(REFLECTION_FILE) is not None:
+            # 尚未遷移：整份改寫並順便完成遷移
+            df = _overlay_reflections(_load_reflections_frame(user_id), texts)
+            if not save_reflections(df.to_dict(orient="records"), user_id=user_id):
+                raise RuntimeError("無法寫入反思紀錄")
+            return
+        # 舊資料的日期不一定是週一，因此每週起訖兩個月份都要檢查
+        months = set()
+        for week_start in texts:
+            months |= {pd.Timestamp(week_start).strftime("%Y-%m"),
+                       pd.Timestamp(week_start + datetime.timedelta(days=6)).strftime("%Y-%m")}
+        prefix = _user_path(REFLECTION_PREFIX, user_id)
+        # 以讀取時的 generation 為條件寫回，同時有人改寫同一個月份時重新讀取、套用後再試
+        for attempt in range(UPSERT_RETRIES + 1):
+            df, generations = _read_for_update(prefix, months)
+            try:
+                _write_partitions(prefix, _overlay_reflections(df, texts), months=months, generations=generations)
+                break
+            except PreconditionFailed:
+                _conflict_backoff(attempt)
+        else:
+            raise RuntimeError("反思紀錄同時被多人改寫，請稍後再試")
+        _apply_to_snapshot(user_id, reflections=texts)
+    finally:
+        invalidate_cache(user_id=user_id)
+    _update_search_index(user_id, weeks=texts)
+
+# --------------- CSV → Parquet 一次性遷移 ------------------
+
+def migrate_csv_to_parquet():
+    """
+    將舊版 daily_records.csv（含尚未合併的日誌）與 reflection_records.csv
+    轉成依月份分割的 Parquet，原 CSV 移至 legacy/ 保存。
+    舊版 CSV 是分割前的共用資料，一律遷移到預設使用者（bucket 根目錄）。
+    回傳各資料集遷移的筆數；該資料集無需遷移時為 0，失敗時為 None。
+    """
+    result = {"records": 0, "reflections": 0}
+    try:
+        legacy = _read_legacy_csv(DATA_FILE)
+        if legacy is not None:
+            blobs = _list_journal(DEFAULT_USER)
+            df = _fold_journal(legacy, _load_journal(blobs))
+            _write_partitions(RECORDS_PREFIX, df)
+            _retire_legacy_csv(DATA_FILE)
+            _clear_journal(blobs)
+            _drop_snapshot(DEFAULT_USER)
+            rebuild_rollups(DEFAULT_USER)
+            rebuild_search_index(DEFAULT_USER)
+            result["records"] = len(df)
+    except Exception as e:
+        print("Error migrating records:", e)
+        result["records"] = None
+    try:
+        legacy = _read_legacy_csv(REFLECTION_FILE)
+        if legacy is not None:
+            _write_partitions(REFLECTION_PREFIX, legacy)
+            _retire_legacy_csv(REFLECTION_FILE)
+            _drop_snapshot(DEFAULT_USER)
+            rebuild_search_index(DEFAULT_USER)
+            result["reflections"] = len(legacy)
+    except Exception as e:
+        print("Error migrating reflections:", e)
+        result["reflections"] = None
+    return result
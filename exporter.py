@@ -0,0 +1,118 @@
+"""
+匯出一段日期內的每日紀錄、反思與（選用）證明照片，寫成一個 ZIP 檔。
+
+ZIP 內容：
+    records.csv / records.parquet          每日紀錄
+    reflections.csv / reflections.parquet  每週反思
+    images/<日期>_<欄位><副檔名>            紀錄引用的照片（include_images 時）
+    manifest.json                          匯出範圍、筆數與下載失敗的照片
+
+照片以最多 EXPORT_WORKERS 個執行緒並行下載，同時進行中的下載不超過 MAX_PENDING_IMAGES 張，
+每張下載完成就寫進 ZIP 並釋放，因此記憶體用量與照片總數無關。
+輸出可以是不可 seek 的串流（例如 stdout），zipfile 會改用 data descriptor。
+"""
+import datetime
+import json
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+
+import pandas as pd
+
+from common import (IMAGE_FIELDS, blob_name_from_url, get_bucket, load_records, load_reflections, resolve_user,
+                    timed, week_start_of)
+
+EXPORT_WORKERS = 8
+MAX_PENDING_IMAGES = EXPORT_WORKERS * 2
+TABLE_FORMATS = ("csv", "parquet")
+
+
+def _table_bytes(records, table_format):
+    df = pd.DataFrame(records)
+    if table_format == "parquet":
+        buf = BytesIO()
+        df.to_parquet(buf, index=False)
+        return buf.getvalue()
+    # utf-8-sig：讓 Excel 正確顯示中文
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+def _image_jobs(records):
+    """列出紀錄引用、且位於本 bucket 的照片：[(ZIP 內路徑, blob 名稱)]。"""
+    jobs = []
+    for rec in records:
+        day = pd.Timestamp(rec["date"]).strftime("%Y-%m-%d")
+        for field in IMAGE_FIELDS:
+            blob_name = blob_name_from_url(rec.get(field))
+            if blob_name is not None:
+                jobs.append((f"images/{day}_{field}{os.path.splitext(blob_name)[1]}", blob_name))
+    return jobs
+
+
+def _download(blob_name):
+    return get_bucket().blob(blob_name).download_as_bytes()
+
+
+def _iter_images(jobs, workers=EXPORT_WORKERS, max_pending=MAX_PENDING_IMAGES):
+    """並行下載照片，依完成順序產生 (ZIP 內路徑, blob 名稱, bytes 或 None, 錯誤訊息)。"""
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        while True:
+            # 補滿進行中的下載，但不超過 max_pending，避免下載速度超過寫入速度時堆積在記憶體
+            for arcname, blob_name in jobs:
+                pending[pool.submit(_download, blob_name)] = (arcname, blob_name)
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                arcname, blob_name = pending.pop(future)
+                try:
+                    yield arcname, blob_name, future.result(), None
+                except Exception as e:
+                    print("Error exporting image:", e)
+                    yield arcname, blob_name, None, str(e)
+
+
+def export_bundle(out, start=None, end=None, user_id=None, include_images=False, table_format="csv",
+                  on_progress=None):
+    """
+    將 start~end（含）的紀錄與反思寫成 ZIP 到檔案物件 out。
+    on_progress(已處理照片數, 照片總數) 每處理完一張照片呼叫一次。
+    回傳 manifest dict（含 records、reflections、images 筆數與 missing_images）。
+    """
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"不支援的表格格式：{table_format}")
+    user_id = resolve_user(user_id)
+    records = load_records(start=start, end=end, user_id=user_id)
+    # 反思以週起始日為鍵，起始日所在那一週的反思也一併匯出
+    reflections = load_reflections(start=start and week_start_of(start), end=end, user_id=user_id)
+    jobs = _image_jobs(records) if include_images else []
+    manifest = {
+        "user_id": user_id,
+        "start": start and str(start),
+        "end": end and str(end),
+        "exported_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "records": len(records),
+        "reflections": len(reflections),
+        "images": 0,
+        "missing_images": [],
+    }
+    with timed("export.bundle") as t, zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"records.{table_format}", _table_bytes(records, table_format))
+        zf.writestr(f"reflections.{table_format}", _table_bytes(reflections, table_format))
+        for done, (arcname, blob_name, data, error) in enumerate(_iter_images(jobs), start=1):
+            if data is None:
+                manifest["missing_images"].append({"path": arcname, "blob": blob_name, "error": error})
+            else:
+                # 照片本身已壓縮，直接存放
+                zf.writestr(arcname, data, compress_type=zipfile.ZIP_STORED)
+                manifest["images"] += 1
+                t.bytes += len(data)
+            if on_progress is not None:
+                on_progress(done, len(jobs))
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
@@ -0,0 +1,73 @@
+"""
+圖片處理（Pillow）：上傳前壓縮與產生縮圖。
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+THUMB_FORMAT = "WEBP"
+THUMB_QUALITY = 80
+
+# 上傳前處理的設定：max_dimension 為最長邊上限（不放大）
+PHOTO_PROFILE = {"max_dimension": 1600, "format": "JPEG", "quality": 82}
+# 螢幕使用時間與步數的證明多半是手機截圖：上限高於常見手機截圖的解析度（不縮小），
+# 並以較高品質的 WEBP 編碼，數字與小字才看得清楚
+SCREENSHOT_PROFILE = {"max_dimension": 3000, "format": "WEBP", "quality": 90}
+SCREENSHOT_CATEGORIES = ("screen", "steps")
+FORMAT_TYPES = {"JPEG": (".jpg", "image/jpeg"), "WEBP": (".webp", "image/webp"), "PNG": (".png", "image/png")}
+
+
+def make_thumbnail(data, width, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    """
+    將圖片位元組依 EXIF 轉正後等比例縮到指定寬度（不放大），回傳編碼後的位元組。
+    """
+    with Image.open(BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        if fmt == "JPEG" and img.mode == "RGBA":
+            img = img.convert("RGB")
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, format=fmt, quality=quality)
+        return buf.getvalue()
+
+
+def preprocess_image(data, file_name, category=None):
+    """
+    上傳前處理：解碼、依 EXIF 轉正、等比例縮到最長邊不超過設定值，再以設定的格式與品質重新編碼
+    （不寫入 EXIF，拍攝位置等中繼資料一併去除）。截圖類別使用 SCREENSHOT_PROFILE。
+    回傳 (位元組, 檔名, MIME 類型)。無法解碼時原樣回傳；重新編碼後沒有變小、
+    原檔也沒有 EXIF 且不需縮小時保留原檔。
+    """
+    profile = SCREENSHOT_PROFILE if category in SCREENSHOT_CATEGORIES else PHOTO_PROFILE
+    limit = profile["max_dimension"]
+    try:
+        with Image.open(BytesIO(data)) as img:
+            has_exif = bool(img.getexif())
+            # JPEG 可直接以較低解析度解碼，省下縮小前的記憶體與時間
+            img.draft("RGB", (limit, limit))
+            img = ImageOps.exif_transpose(img)
+            resized = max(img.size) > limit
+            if resized:
+                img.thumbnail((limit, limit), Image.LANCZOS)
+            if profile["format"] == "JPEG" and img.mode != "RGB":
+                # JPEG 沒有透明度：透明部分以白色填滿
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, "white")
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            buf = BytesIO()
+            img.save(buf, format=profile["format"], quality=profile["quality"])
+    except Exception as e:
+        print("Error preprocessing image:", e)
+        return data, file_name, None
+    out = buf.getvalue()
+    if len(out) >= len(data) and not has_exif and not resized:
+        return data, file_name, None
+    ext, content_type = FORMAT_TYPES[profile["format"]]
+    return out, os.path.splitext(file_name)[0] + ext, content_type
@@ -0,0 +1,199 @@
+"""
+批次匯入歷史紀錄（CSV / JSON，例如手機健康 App 匯出的步數、睡眠、螢幕時間）。
+
+檔案以 CHUNK_ROWS 列為單位分批讀取、驗證並轉成每日紀錄的欄位格式，
+同一天的多列以後出現的非空白欄位為準；全部讀完後才以 bulk_upsert_records 一次寫入。
+有問題的列不會匯入，並在錯誤報告中列出（列號為資料列的序號，從 1 起算，不含標題列）。
+"""
+import datetime
+import json
+import os
+
+import pandas as pd
+
+from common import NUMERIC_COLUMNS, bulk_upsert_records, compute_sleep_hours
+
+CHUNK_ROWS = 5000
+MAX_REPORTED_ERRORS = 1000  # 錯誤報告最多保留的筆數（避免整份檔案格式錯誤時占用大量記憶體）
+TEXT_COLUMNS = ["breakfast_desc", "lunch_desc", "dinner_desc", "late_night_desc"]
+HOURS_LIMIT = {"sleep_hours": 24, "screen_time": 24}
+
+# 常見匯出檔的欄名（小寫、空白與連字號換成底線後比對） -> 紀錄欄位
+COLUMN_ALIASES = {
+    "date": "date", "day": "date", "日期": "date", "start_date": "date", "startdate": "date",
+    "sleep_hours": "sleep_hours", "sleep": "sleep_hours", "睡眠時數": "sleep_hours",
+    "sleep_minutes": "sleep_minutes", "asleep_minutes": "sleep_minutes",
+    "bed_time": "bed_time", "bedtime": "bed_time", "上床時間": "bed_time",
+    "wake_time": "wake_time", "waketime": "wake_time", "wake_up_time": "wake_time", "起床時間": "wake_time",
+    "steps": "steps", "step_count": "steps", "stepcount": "steps", "步數": "steps",
+    "sugary_drinks": "sugary_drinks", "含糖飲料": "sugary_drinks",
+    "screen_time": "screen_time", "screen_time_hours": "screen_time", "螢幕使用時間": "screen_time",
+    "screen_minutes": "screen_minutes", "screen_time_minutes": "screen_minutes",
+    **{c: c for c in TEXT_COLUMNS},
+}
+
+
+def _normalize_name(name):
+    return str(name).strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def detect_format(file_name, head):
+    """由副檔名判斷格式；無法判斷時看內容的第一個字元。回傳 "csv"、"json" 或 "jsonl"。"""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    first = head.lstrip()[:1]
+    if ext == ".json" or first in (b"[", b"{"):
+        return "json" if first == b"[" else "jsonl"
+    return "csv"
+
+
+def read_chunks(file_obj, fmt, chunk_rows=CHUNK_ROWS):
+    """逐批讀取原始資料，產生 DataFrame（欄位皆為字串）。JSON 陣列無法串流，會先整份解析再分批。"""
+    if fmt == "csv":
+        # utf-8-sig：Excel 匯出的 CSV 常帶 BOM
+        yield from pd.read_csv(file_obj, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                               skipinitialspace=True, encoding="utf-8-sig")
+    elif fmt == "jsonl":
+        reader = pd.read_json(file_obj, lines=True, chunksize=chunk_rows, dtype=False, convert_dates=False,
+                              encoding="utf-8")
+        for chunk in reader:
+            yield chunk.astype(str).where(chunk.notna(), "")
+    else:
+        rows = json.loads(file_obj.read().decode("utf-8-sig"))
+        if not isinstance(rows, list):
+            raise ValueError("JSON 檔案必須是物件陣列")
+        for start in range(0, len(rows), chunk_rows):
+            chunk = pd.DataFrame(rows[start:start + chunk_rows])
+            yield chunk.astype(str).where(chunk.notna(), "")
+
+
+def _parse_time(value):
+    """'HH:MM'、'HH:MM:SS' 或含日期的時間字串 -> datetime.time；空白回傳 None，無法解析時拋出 ValueError。"""
+    value = value.strip()
+    if not value:
+        return None
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, fmt).time()
+        except ValueError:
+            pass
+    return pd.Timestamp(value).time()
+
+
+def normalize_chunk(raw, first_row):
+    """
+    將一批原始資料轉成紀錄欄位。回傳 (有效紀錄 DataFrame, 錯誤 list)。
+    錯誤格式為 {"row": 列號, "field": 欄位, "value": 原始值, "error": 說明}。
+    """
+    raw = raw.reset_index(drop=True)
+    columns = {}
+    for name in raw.columns:
+        field = COLUMN_ALIASES.get(_normalize_name(name))
+        if field is not None and field not in columns:
+            columns[field] = raw[name].astype(str).str.strip()
+    if "date" not in columns:
+        raise ValueError("找不到日期欄位（date / 日期）")
+    errors = []
+    bad = pd.Series(False, index=raw.index)
+
+    def reject(mask, field, values, message):
+        nonlocal bad
+        for i in mask[mask].index:
+            errors.append({"row": first_row + int(i), "field": field, "value": values[i], "error": message})
+        bad |= mask
+
+    out = pd.DataFrame(index=raw.index)
+    dates = pd.to_datetime(columns["date"], errors="coerce", format="mixed")
+    if getattr(dates.dt, "tz", None) is not None:
+        dates = dates.dt.tz_localize(None)
+    reject(dates.isna(), "date", columns["date"], "無法解析的日期")
+    out["date"] = dates.dt.normalize()
+
+    for field in NUMERIC_COLUMNS + ["sleep_minutes", "screen_minutes"]:
+        if field not in columns:
+            continue
+        text = columns[field]
+        values = pd.to_numeric(text, errors="coerce")
+        reject(values.isna() & (text != ""), field, text, "不是數字")
+        reject(values < 0, field, text, "不可為負數")
+        if field in HOURS_LIMIT:
+            reject(values > HOURS_LIMIT[field], field, text, f"不可超過 {HOURS_LIMIT[field]} 小時")
+        if field == "sleep_minutes":
+            if "sleep_hours" not in columns:
+                out["sleep_hours"] = values.div(60).round(1)
+        elif field == "screen_minutes":
+            if "screen_time" not in columns:
+                out["screen_time"] = values.div(60).round(1)
+        else:
+            out[field] = values.round() if field in ("steps", "sugary_drinks") else values
+
+    # 有上床與起床時間時，與上傳表單相同的方式計算睡眠時數
+    if "bed_time" in columns and "wake_time" in columns:
+        computed = {}
+        unparsed = pd.Series(False, index=raw.index)
+        for i in raw.index:
+            try:
+                bed, wake = _parse_time(columns["bed_time"][i]), _parse_time(columns["wake_time"][i])
+            except (ValueError, TypeError, OverflowError):
+                unparsed[i] = True
+                continue
+            if bed is not None and wake is not None and pd.notna(out.at[i, "date"]):
+                computed[i] = compute_sleep_hours(out.at[i, "date"].date(), bed, wake)
+        reject(unparsed, "bed_time/wake_time", columns["bed_time"] + " / " + columns["wake_time"], "無法解析的時間")
+        if computed:
+            sleep = pd.Series(computed, dtype=float)
+            out["sleep_hours"] = sleep.combine_first(out["sleep_hours"]) if "sleep_hours" in out else sleep
+
+    for field in TEXT_COLUMNS:
+        if field in columns:
+            out[field] = columns[field].where(columns[field] != "")
+
+    values = out.drop(columns="date")
+    reject(values.isna().all(axis=1) & ~bad, "", pd.Series("", index=raw.index), "沒有可匯入的欄位")
+    return out[~bad].reindex(columns=["date"] + [c for c in out.columns if c != "date"]), errors
+
+
+def import_file(file_obj, file_name=None, user_id=None, dry_run=False, on_chunk=None, chunk_rows=CHUNK_ROWS):
+    """
+    串流讀取整份檔案並一次寫入。file_obj 須為二進位檔案物件。
+    每處理完一批會呼叫 on_chunk(已讀列數, 有效列數, 錯誤數)。
+    回傳 {"rows", "valid", "dates", "added", "updated", "errors", "saved"}；
+    saved 為 None 表示 dry_run 未寫入，False 表示寫入失敗。
+    """
+    head = file_obj.read(1024)
+    file_obj.seek(0)
+    fmt = detect_format(file_name, head)
+    result = {"rows": 0, "valid": 0, "dates": 0, "added": 0, "updated": 0, "errors": [], "saved": None}
+    valid = []
+    error_count = 0
+    for raw in read_chunks(file_obj, fmt, chunk_rows):
+        chunk, errors = normalize_chunk(raw, result["rows"] + 1)
+        result["rows"] += len(raw)
+        result["valid"] += len(chunk)
+        error_count += len(errors)
+        room = MAX_REPORTED_ERRORS - len(result["errors"])
+        result["errors"].extend(errors[:max(room, 0)])
+        if not chunk.empty:
+            valid.append(chunk)
+        if on_chunk is not None:
+            on_chunk(result["rows"], result["valid"], error_count)
+    result["error_count"] = error_count
+    if not valid:
+        return result
+    records = pd.concat(valid, ignore_index=True)
+    # 同一天出現多列時，每個欄位取最後一個非空白的值
+    records = records.groupby("date").last().reset_index()
+    result["dates"] = len(records)
+    if dry_run:
+        return result
+    counts = bulk_upsert_records(records.to_dict(orient="records"), user_id=user_id)
+    result["saved"] = counts is not None
+    if counts is not None:
+        result.update(counts)
+    return result
+
+
+def errors_to_csv(errors):
+    """將錯誤報告轉成 CSV 字串（供下載或寫檔）。"""
+    return pd.DataFrame(errors, columns=["row", "field", "value", "error"]).to_csv(index=False)
@@ -0,0 +1,224 @@
+"""
+本機的 bucket 替身：模擬 google.cloud.storage 的 Bucket / Blob 介面中 common.py 用到的部分
+（blob、get_blob、list_blobs、exists、下載、上傳、刪除、generation 條件），
+讓整個儲存層可以離線執行與量測。
+
+root 為 None 時資料只存在記憶體；否則以 root 目錄下的檔案保存，物件名稱即相對路徑。
+generation 條件只在同一個行程內保證原子性。
+"""
+import datetime
+import os
+import threading
+import time
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+_TMP_SUFFIX = ".__tmp__"
+
+
+class LocalBlob:
+    def __init__(self, bucket, name, generation=None, size=None, content_type=None):
+        self.bucket = bucket
+        self.name = name
+        # 與 GCS 相同：bucket.blob() 建立的物件沒有 metadata，需由 get_blob / list_blobs / 上傳取得
+        self.generation = generation
+        self.size = size
+        self.content_type = content_type
+
+    @property
+    def updated(self):
+        # generation 即寫入時間（奈秒）
+        if self.generation is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.generation / 1e9, tz=datetime.timezone.utc)
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def exists(self, **kwargs):
+        return self.bucket._stat(self.name) is not None
+
+    def reload(self, **kwargs):
+        meta = self.bucket._stat(self.name)
+        if meta is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        self.generation, self.size = meta
+
+    def download_as_bytes(self, **kwargs):
+        return self.bucket._read(self.name)
+
+    def download_as_text(self, encoding="utf-8", **kwargs):
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.generation = self.bucket._write(self.name, data, if_generation_match)
+        self.size = len(data)
+        self.content_type = content_type
+
+    def upload_from_file(self, file_obj, content_type=None, if_generation_match=None, **kwargs):
+        self.upload_from_string(file_obj.read(), content_type=content_type, if_generation_match=if_generation_match)
+
+    def delete(self, if_generation_match=None, **kwargs):
+        self.bucket._delete(self.name, if_generation_match)
+
+
+class BlobList:
+    """list_blobs 的回傳值：可迭代，並與 GCS 的 iterator 一樣提供 pages 與 prefixes。"""
+
+    def __init__(self, blobs, prefixes):
+        self._blobs = blobs
+        self.prefixes = prefixes
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    @property
+    def pages(self):
+        return iter([self._blobs])
+
+
+class LocalBucket:
+    def __init__(self, name, root=None):
+        self.name = name
+        self.root = root
+        self._lock = threading.Lock()
+        self._objects = {}  # 記憶體模式：物件名稱 -> (內容, generation)
+        self._last_generation = 0
+        self.stats = {}
+        self.reset_stats()
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    # ---------------- 統計（基準測試用） ----------------
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "bytes_downloaded": 0, "bytes_uploaded": 0}
+
+    def _count(self, downloaded=0, uploaded=0):
+        self.stats["requests"] += 1
+        self.stats["bytes_downloaded"] += downloaded
+        self.stats["bytes_uploaded"] += uploaded
+
+    # ---------------- Bucket 介面 ----------------
+
+    def blob(self, name, **kwargs):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        meta = self._stat(name)
+        if meta is None:
+            return None
+        return LocalBlob(self, name, generation=meta[0], size=meta[1])
+
+    def list_blobs(self, prefix="", delimiter=None, **kwargs):
+        with self._lock:
+            self._count()
+            names = sorted(self._names(prefix))
+            blobs, prefixes = [], set()
+            for name in names:
+                rest = name[len(prefix):]
+                if delimiter and delimiter in rest:
+                    prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                    continue
+                generation, size = self._stat_locked(name)
+                blobs.append(LocalBlob(self, name, generation=generation, size=size))
+        return BlobList(blobs, prefixes)
+
+    # ---------------- 儲存實作 ----------------
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def _names(self, prefix):
+        if self.root is None:
+            return [n for n in self._objects if n.startswith(prefix)]
+        names = []
+        for dirpath, _, files in os.walk(self.root):
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            for file_name in files:
+                if file_name.endswith(_TMP_SUFFIX):
+                    continue
+                name = file_name if rel == "." else f"{rel}/{file_name}"
+                if name.startswith(prefix):
+                    names.append(name)
+        return names
+
+    def _stat_locked(self, name):
+        if self.root is None:
+            obj = self._objects.get(name)
+            return None if obj is None else (obj[1], len(obj[0]))
+        try:
+            st = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _stat(self, name):
+        with self._lock:
+            self._count()
+            return self._stat_locked(name)
+
+    def _next_generation(self, current):
+        # 單調遞增；檔案模式下同時作為檔案的 mtime，重新開啟時仍可還原
+        self._last_generation = max(time.time_ns(), self._last_generation + 1, (current or 0) + 1)
+        return self._last_generation
+
+    def _check(self, name, if_generation_match):
+        meta = self._stat_locked(name)
+        current = meta[0] if meta is not None else 0
+        if if_generation_match is not None and current != if_generation_match:
+            raise PreconditionFailed(f"Precondition failed for {self._object_path(name)}")
+        return current
+
+    def _object_path(self, name):
+        return f"{self.name}/{name}"
+
+    def _read(self, name):
+        with self._lock:
+            if self.root is None:
+                obj = self._objects.get(name)
+                data = None if obj is None else obj[0]
+            else:
+                try:
+                    with open(self._path(name), "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    data = None
+            if data is None:
+                self._count()
+                raise NotFound(f"No such object: {self._object_path(name)}")
+            self._count(downloaded=len(data))
+            return data
+
+    def _write(self, name, data, if_generation_match):
+        with self._lock:
+            self._count(uploaded=len(data))
+            current = self._check(name, if_generation_match)
+            generation = self._next_generation(current)
+            if self.root is None:
+                self._objects[name] = (bytes(data), generation)
+                return generation
+            path = self._path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + _TMP_SUFFIX
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            os.utime(path, ns=(generation, generation))
+            # 檔案系統的時間精度可能較低，以實際寫入的 mtime 為準
+            return os.stat(path).st_mtime_ns
+
+    def _delete(self, name, if_generation_match):
+        with self._lock:
+            self._count()
+            if self._stat_locked(name) is None:
+                raise NotFound(f"No such object: {self._object_path(name)}")
+            self._check(name, if_generation_match)
+            if self.root is None:
+                del self._objects[name]
+            else:
+                os.remove(self._path(name))
@@ -0,0 +1,266 @@
+"""
+維護用命令列工具。
+
+用法：
+    python manage.py compact [--user ID | --all-users]          # 將日誌異動合併回 Parquet 快照
+    python manage.py migrate-parquet  # 將舊版 CSV 轉成依月份分割的 Parquet
+    python manage.py backfill-thumbnails [--dry-run] [--user ID | --all-users]  # 為既有照片補產生縮圖
+    python manage.py rebuild-rollups [--user ID | --all-users]  # 重建每週／每月彙總表與跨使用者摘要
+    python manage.py rebuild-search-index [--user ID | --all-users]  # 重建三餐描述與反思的搜尋索引
+    python manage.py startup-timing [--runs N] [--page PAGE] [--gcs]  # 量測 import common 與第一次繪製頁面的時間
+    python manage.py import-records FILE [--user ID] [--dry-run] [--errors OUT.csv]  # 批次匯入 CSV / JSON 紀錄
+    python manage.py export -o OUT.zip [--start DATE] [--end DATE] [--user ID] [--images] [--format csv|parquet]  # 匯出紀錄、反思與照片
+    python manage.py flush-queue      # 立即寫出本機佇列中尚未寫到 GCS 的紀錄與反思
+    python manage.py gc-evidence [--delete] [--min-age-hours H] [--user ID | --all-users]  # 列出／刪除不再被引用的照片
+
+未指定 --user 時處理預設使用者（bucket 根目錄下的共用資料）。
+"""
+import argparse
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+
+import common
+import exporter
+import importer
+import write_queue
+
+
+def _target_users(args):
+    if args.all_users:
+        return common.list_users()
+    return [args.user or common.DEFAULT_USER]
+
+
+def cmd_compact(args):
+    failed = 0
+    for user_id in _target_users(args):
+        if common.compact_records(user_id=user_id):
+            print(f"{user_id}: 日誌已合併至快照。")
+        else:
+            print(f"{user_id}: 合併失敗。")
+            failed += 1
+    return 1 if failed else 0
+
+
+def cmd_migrate_parquet(args):
+    result = common.migrate_csv_to_parquet()
+    for name, count in result.items():
+        print(f"{name}: {'失敗' if count is None else f'{count} 筆'}")
+    return 1 if None in result.values() else 0
+
+
+def cmd_backfill_thumbnails(args):
+    failed = 0
+    for user_id in _target_users(args):
+        count = common.backfill_thumbnails(dry_run=args.dry_run, user_id=user_id)
+        if count is None:
+            print(f"{user_id}: 縮圖網址寫回紀錄失敗。")
+            failed += 1
+        else:
+            print(f"{user_id}: {'需要補產生' if args.dry_run else '已補產生'} {count} 張照片的縮圖。")
+    return 1 if failed else 0
+
+
+def cmd_rebuild_rollups(args):
+    failed = 0
+    for user_id in _target_users(args):
+        if common.rebuild_rollups(user_id=user_id):
+            print(f"{user_id}: 彙總表已重建。")
+        else:
+            print(f"{user_id}: 重建失敗。")
+            failed += 1
+    return 1 if failed else 0
+
+
+def cmd_rebuild_search_index(args):
+    failed = 0
+    for user_id in _target_users(args):
+        if common.rebuild_search_index(user_id=user_id):
+            print(f"{user_id}: 搜尋索引已重建。")
+        else:
+            print(f"{user_id}: 重建失敗。")
+            failed += 1
+    return 1 if failed else 0
+
+
+# 每次量測都在新的行程中執行，才能反映冷啟動
+IMPORT_TIMING = "import time; start = time.perf_counter(); import common; print(time.perf_counter() - start)"
+RENDER_TIMING = """import sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+app.secrets["UPLOAD_PASSWORD"] = ""
+start = time.perf_counter()
+app.run()
+print(time.perf_counter() - start)
+"""
+
+
+def _time_in_subprocess(code, args, env):
+    repo = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", code, *args], cwd=repo, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def cmd_startup_timing(args):
+    env = dict(os.environ)
+    if not args.gcs:
+        env[common.LOCAL_BUCKET_ENV] = "memory"
+    try:
+        imports = [_time_in_subprocess(IMPORT_TIMING, [], env) for _ in range(args.runs)]
+        renders = [_time_in_subprocess(RENDER_TIMING, [args.page], env) for _ in range(args.runs)]
+    except subprocess.CalledProcessError as e:
+        print("量測失敗：", e.stderr)
+        return 1
+    for name, samples in [("import common", imports), (f"第一次繪製 {args.page}", renders)]:
+        print(f"{name}: 中位數 {statistics.median(samples) * 1000:.0f} ms，最快 {min(samples) * 1000:.0f} ms")
+    return 0
+
+
+def cmd_import_records(args):
+    def report_progress(rows, valid, errors):
+        print(f"已讀取 {rows} 列（有效 {valid}，錯誤 {errors}）", file=sys.stderr)
+
+    try:
+        with open(args.file, "rb") as f:
+            result = importer.import_file(f, args.file, user_id=args.user, dry_run=args.dry_run,
+                                          on_chunk=report_progress)
+    except (OSError, ValueError) as e:
+        print("無法讀取檔案：", e)
+        return 1
+    print(f"讀取 {result['rows']} 列，有效 {result['valid']} 列（{result['dates']} 天），錯誤 {result['error_count']} 列。")
+    if result["errors"]:
+        if args.errors:
+            with open(args.errors, "w", encoding="utf-8", newline="") as f:
+                f.write(importer.errors_to_csv(result["errors"]))
+            print(f"錯誤報告已寫入 {args.errors}")
+        else:
+            for error in result["errors"][:20]:
+                print(f"  第 {error['row']} 列 {error['field']}={error['value']!r}：{error['error']}")
+    if result["saved"] is False:
+        print("寫入失敗。")
+        return 1
+    if result["saved"]:
+        print(f"新增 {result['added']} 天，更新 {result['updated']} 天。")
+    return 0
+
+
+def cmd_export(args):
+    def report_progress(done, total):
+        print(f"照片 {done}/{total}", file=sys.stderr)
+
+    # "-" 代表寫到 stdout，可直接接到其他指令
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        with out:
+            manifest = exporter.export_bundle(out, args.start, args.end, user_id=args.user,
+                                              include_images=args.images, table_format=args.format,
+                                              on_progress=report_progress)
+    except (OSError, ValueError) as e:
+        print("匯出失敗：", e, file=sys.stderr)
+        return 1
+    print(f"已匯出 {manifest['records']} 筆紀錄、{manifest['reflections']} 筆反思、{manifest['images']} 張照片。",
+          file=sys.stderr)
+    if manifest["missing_images"]:
+        print(f"{len(manifest['missing_images'])} 張照片下載失敗，見 manifest.json。", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_flush_queue(args):
+    written, failed = write_queue.flush()
+    remaining = write_queue.counts()
+    print(f"已寫出 {written} 筆，失敗 {failed} 筆；佇列中剩下 {remaining['queued']} 筆待寫出、"
+          f"{remaining['retrying']} 筆等待重試。")
+    return 1 if failed else 0
+
+
+def cmd_gc_evidence(args):
+    failed = 0
+    min_age = datetime.timedelta(hours=args.min_age_hours)
+    for user_id in _target_users(args):
+        result = common.collect_unreferenced_evidence(user_id=user_id, delete=args.delete, min_age=min_age)
+        if result is None:
+            print(f"{user_id}: 讀取紀錄失敗，未處理。")
+            failed += 1
+            continue
+        for name in result["objects"]:
+            print(f"  {name}")
+        action = f"已刪除 {result['deleted']} 個" if args.delete else "可刪除"
+        print(f"{user_id}: {len(result['objects'])} 個物件不再被引用（{result['bytes'] / 1e6:.1f} MB），{action}。")
+        if args.delete and result["deleted"] < len(result["objects"]):
+            failed += 1
+    return 1 if failed else 0
+
+
+def add_user_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--user", help="只處理指定的使用者代號")
+    group.add_argument("--all-users", action="store_true", help="處理 bucket 中的所有使用者")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="internet_health 維護工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_compact = sub.add_parser("compact", help="合併日誌異動至快照")
+    add_user_arguments(p_compact)
+    p_compact.set_defaults(func=cmd_compact)
+
+    p_migrate = sub.add_parser("migrate-parquet", help="將舊版 CSV 遷移為 Parquet")
+    p_migrate.set_defaults(func=cmd_migrate_parquet)
+
+    p_thumbs = sub.add_parser("backfill-thumbnails", help="為既有照片補產生縮圖")
+    p_thumbs.add_argument("--dry-run", action="store_true", help="只列出數量，不實際產生")
+    add_user_arguments(p_thumbs)
+    p_thumbs.set_defaults(func=cmd_backfill_thumbnails)
+
+    p_rollups = sub.add_parser("rebuild-rollups", help="重建每週／每月彙總表與跨使用者摘要")
+    add_user_arguments(p_rollups)
+    p_rollups.set_defaults(func=cmd_rebuild_rollups)
+
+    p_search = sub.add_parser("rebuild-search-index", help="重建三餐描述與反思的搜尋索引")
+    add_user_arguments(p_search)
+    p_search.set_defaults(func=cmd_rebuild_search_index)
+
+    p_startup = sub.add_parser("startup-timing", help="量測 import 與第一次繪製頁面的時間")
+    p_startup.add_argument("--runs", type=int, default=5, help="重複次數（每次都是新的行程）")
+    p_startup.add_argument("--page", default="pages/3_數據紀錄.py", help="要繪製的頁面")
+    p_startup.add_argument("--gcs", action="store_true", help="連線真正的 GCS（預設使用記憶體中的 LocalBucket）")
+    p_startup.set_defaults(func=cmd_startup_timing)
+
+    p_import = sub.add_parser("import-records", help="由 CSV / JSON 匯出檔批次匯入紀錄")
+    p_import.add_argument("file", help="CSV、JSON 陣列或 JSON Lines 檔案")
+    p_import.add_argument("--user", help="匯入到指定的使用者代號")
+    p_import.add_argument("--dry-run", action="store_true", help="只檢查，不寫入")
+    p_import.add_argument("--errors", help="將錯誤報告寫成 CSV 檔")
+    p_import.set_defaults(func=cmd_import_records)
+
+    p_export = sub.add_parser("export", help="將紀錄、反思與照片匯出成 ZIP")
+    p_export.add_argument("-o", "--output", required=True, help="輸出的 ZIP 檔（- 表示 stdout）")
+    p_export.add_argument("--start", type=datetime.date.fromisoformat, help="起始日期 YYYY-MM-DD（含）")
+    p_export.add_argument("--end", type=datetime.date.fromisoformat, help="結束日期 YYYY-MM-DD（含）")
+    p_export.add_argument("--user", help="匯出指定的使用者代號")
+    p_export.add_argument("--images", action="store_true", help="一併下載紀錄引用的證明照片")
+    p_export.add_argument("--format", choices=exporter.TABLE_FORMATS, default="csv", help="紀錄與反思的表格格式")
+    p_export.set_defaults(func=cmd_export)
+
+    p_flush = sub.add_parser("flush-queue", help="立即寫出本機佇列中的紀錄與反思")
+    p_flush.set_defaults(func=cmd_flush_queue)
+
+    p_gc = sub.add_parser("gc-evidence", help="列出或刪除不再被任何紀錄引用的照片與縮圖")
+    p_gc.add_argument("--delete", action="store_true", help="實際刪除（預設只列出）")
+    p_gc.add_argument("--min-age-hours", type=float, default=common.GC_MIN_AGE.total_seconds() / 3600,
+                      help="只處理上傳超過此時數的物件")
+    add_user_arguments(p_gc)
+    p_gc.set_defaults(func=cmd_gc_evidence)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+輕量的計時與計數：每個操作保留最近 HISTOGRAM_WINDOW 次的耗時（滾動百分位數），
+並累計次數、總耗時與位元組數。可匯出成 Prometheus 文字格式的本機檔案，
+供 node_exporter 的 textfile collector 等工具收集。
+
+用法：
+    with timed("page3.rows") as t:
+        ...
+        t.bytes += len(data)  # 選用：記錄傳輸量
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+HISTOGRAM_WINDOW = 1024  # 每個操作計算百分位數時使用的最近樣本數
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_FILE = os.environ.get("INTERNET_HEALTH_METRICS_FILE", "/tmp/internet_health_metrics.prom")
+EXPORT_INTERVAL_SECONDS = 15  # 自動寫出 Prometheus 檔案的最短間隔
+
+_lock = threading.Lock()
+_series = {}  # 操作名稱 -> {"samples": deque, "count", "seconds", "bytes", "errors"}
+_last_export = 0.0
+
+
+class _Timing:
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+
+def record(name, seconds, nbytes=0, error=False):
+    """記錄一次操作的耗時（秒）與位元組數。"""
+    global _last_export
+    with _lock:
+        series = _series.get(name)
+        if series is None:
+            series = _series[name] = {
+                "samples": deque(maxlen=HISTOGRAM_WINDOW), "count": 0, "seconds": 0.0, "bytes": 0, "errors": 0,
+            }
+        series["samples"].append(seconds)
+        series["count"] += 1
+        series["seconds"] += seconds
+        series["bytes"] += nbytes
+        series["errors"] += int(error)
+        due = time.monotonic() - _last_export >= EXPORT_INTERVAL_SECONDS
+        if due:
+            _last_export = time.monotonic()
+    if due:
+        try:
+            write_prometheus()
+        except OSError as e:
+            print("Error writing metrics:", e)
+
+
+@contextmanager
+def timed(name):
+    """量測 with 區塊的耗時；區塊內可設定 t.bytes。發生例外時計入 errors 並照常拋出。"""
+    timing = _Timing()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield timing
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(name, time.perf_counter() - start, timing.bytes, error)
+
+
+def snapshot():
+    """回傳各操作的統計 list of dicts（依名稱排序），耗時單位為毫秒。"""
+    with _lock:
+        items = [(name, dict(s, samples=np.fromiter(s["samples"], dtype=float))) for name, s in _series.items()]
+    rows = []
+    for name, s in sorted(items):
+        samples = s["samples"] * 1000
+        row = {"operation": name, "count": s["count"], "errors": s["errors"]}
+        for q in QUANTILES:
+            row[f"p{round(q * 100)}_ms"] = round(float(np.quantile(samples, q)), 2) if samples.size else None
+        row["max_ms"] = round(float(samples.max()), 2) if samples.size else None
+        row["total_s"] = round(s["seconds"], 3)
+        row["bytes"] = s["bytes"]
+        rows.append(row)
+    return rows
+
+
+def reset():
+    with _lock:
+        _series.clear()
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """以 Prometheus 文字格式輸出：每個操作一組 summary（分位數、_sum、_count）與位元組、錯誤計數。"""
+    with _lock:
+        items = [(name, dict(s, samples=np.fromiter(s["samples"], dtype=float))) for name, s in _series.items()]
+    lines = [
+        "# HELP internet_health_operation_seconds 操作耗時（最近樣本的分位數）",
+        "# TYPE internet_health_operation_seconds summary",
+    ]
+    for name, s in sorted(items):
+        label = f'operation="{_label(name)}"'
+        for q in QUANTILES:
+            if s["samples"].size:
+                lines.append(f'internet_health_operation_seconds{{{label},quantile="{q}"}} '
+                             f'{float(np.quantile(s["samples"], q)):.6f}')
+        lines.append(f"internet_health_operation_seconds_sum{{{label}}} {s['seconds']:.6f}")
+        lines.append(f"internet_health_operation_seconds_count{{{label}}} {s['count']}")
+    lines += [
+        "# HELP internet_health_operation_bytes_total 操作傳輸的位元組數",
+        "# TYPE internet_health_operation_bytes_total counter",
+    ]
+    lines += [f'internet_health_operation_bytes_total{{operation="{_label(n)}"}} {s["bytes"]}' for n, s in sorted(items)]
+    lines += [
+        "# HELP internet_health_operation_errors_total 發生例外的次數",
+        "# TYPE internet_health_operation_errors_total counter",
+    ]
+    lines += [f'internet_health_operation_errors_total{{operation="{_label(n)}"}} {s["errors"]}' for n, s in sorted(items)]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=None):
+    """將目前的統計寫成 Prometheus 文字檔（先寫暫存檔再取代，讀取端不會看到半份檔案）。回傳路徑。"""
+    path = path or METRICS_FILE
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path
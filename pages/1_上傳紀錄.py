@@ -1,41 +1,18 @@
 import datetime
 import streamlit as st
-import requests
-import base64
-from common import upload_file_to_gcs, load_records, save_records, remove_record_by_date
+from assets import apply_background
+from common import (stage_upload, upload_staged_files, current_snapshot, get_record, queue_record, record_generation,
+                    select_user, compute_sleep_hours, NUMERIC_COLUMNS)
+import write_queue
 import os
 
 st.set_page_config(page_title="上傳紀錄", layout="wide")
 
-# 背景圖片設定
-def get_base64_from_url(url):
-    response = requests.get(url)   
-    if response.status_code == 200:
-        return base64.b64encode(response.content).decode()
-    else:
-        return None
-
-bg_url = "https://storage.googleapis.com/internet_health/upload_bg3.jpg"
-bg_image_base64 = get_base64_from_url(bg_url)
-if bg_image_base64:
-    st.markdown(
-        f"""
-        <style>
-        .stApp {{
-            background: url("data:image/jpg;base64,{bg_image_base64}") no-repeat center center fixed;
-            background-size: cover;
-        }}
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-else:
-    st.error("背景圖片載入失敗。")
+# 背景圖片設定（每個行程只下載一次）
+apply_background()
 
 st.title("上傳紀錄")
-
-# 初始化 daily_records
-st.session_state.setdefault("daily_records", load_records())
+user_id = select_user()
 
 
 # 若沒有 pending_record（也就是第一次提交表單），則顯示資料輸入表單
@@ -61,11 +38,7 @@ with st.form("daily_form", clear_on_submit=True):
     
     record_datetime = datetime.datetime.combine(record_date, datetime.time(0, 0))
     
-    bed_datetime = datetime.datetime.combine(record_date, bed_time)
-    wake_datetime = datetime.datetime.combine(record_date, wake_time)
-    if wake_datetime <= bed_datetime:
-        wake_datetime += datetime.timedelta(days=1)
-    sleep_hours = round((wake_datetime - bed_datetime).total_seconds() / 3600.0, 1)
+    sleep_hours = compute_sleep_hours(record_date, bed_time, wake_time)
     st.write(f"計算得的睡眠時數：{sleep_hours:.1f} 小時")
     
     sleep_evidence = st.file_uploader("上傳睡眠證明照片", type=["png", "jpg", "jpeg"], key="sleep_evidence")
@@ -90,34 +63,90 @@ with st.form("daily_form", clear_on_submit=True):
     
     submit_daily = st.form_submit_button("確認輸入完畢")
 
+# 各證明照片欄位對應的 GCS 檔名類別與顯示名稱
+UPLOAD_FIELDS = {
+    "sleep_evidence": ("sleep", "睡眠證明"),
+    "breakfast": ("breakfast", "早餐"),
+    "lunch": ("lunch", "午餐"),
+    "dinner": ("dinner", "晚餐"),
+    "late_night": ("late_night", "宵夜"),
+    "steps_evidence": ("steps", "步數證明"),
+    "screen_evidence": ("screen", "螢幕使用證明"),
+}
+
 if submit_daily:
     new_record = {
         "date": record_datetime,
         "sleep_hours": sleep_hours,
-        "sleep_evidence": upload_file_to_gcs(sleep_evidence, record_date, "sleep"),
-        "breakfast": upload_file_to_gcs(breakfast_img, record_date, "breakfast"),
+        "sleep_evidence": "",
+        "breakfast": "",
         "breakfast_desc": breakfast_desc,
-        "lunch": upload_file_to_gcs(lunch_img, record_date, "lunch"),
+        "lunch": "",
         "lunch_desc": lunch_desc,
-        "dinner": upload_file_to_gcs(dinner_img, record_date, "dinner"),
+        "dinner": "",
         "dinner_desc": dinner_desc,
-        "late_night": upload_file_to_gcs(late_night_img, record_date, "late_night"),
+        "late_night": "",
         "late_night_desc": late_night_desc,
         "sugary_drinks": sugary_drinks,
         "steps": steps,
-        "steps_evidence": upload_file_to_gcs(steps_evidence, record_date, "steps"),
+        "steps_evidence": "",
         "screen_time": screen_time,
-        "screen_evidence": upload_file_to_gcs(screen_evidence, record_date, "screen"),
+        "screen_evidence": "",
+    }
+    # 照片先暫存在 session 中，密碼確認後才上傳
+    uploaded_files = {
+        "sleep_evidence": sleep_evidence,
+        "breakfast": breakfast_img,
+        "lunch": lunch_img,
+        "dinner": dinner_img,
+        "late_night": late_night_img,
+        "steps_evidence": steps_evidence,
+        "screen_evidence": screen_evidence,
+    }
+    st.session_state.pending_uploads = {
+        field: (UPLOAD_FIELDS[field][0], stage_upload(f))
+        for field, f in uploaded_files.items() if f is not None
     }
     st.session_state.pending_record = new_record
+    # 記下提交時的使用者，確認前切換代號也不會寫到別人的分割
+    st.session_state.pending_user = user_id
+    # 記下預覽所依據的版本：確認前若有其他人改了同一天，寫入時會偵測到並合併，而不是直接覆蓋
+    st.session_state.pending_generation = record_generation(record_date, user_id=user_id)
     st.info("請輸入上傳密碼以確認上傳資料。")
 
 
+# 上一次送出的紀錄是否已寫到 GCS
+if "queued_entry" in st.session_state:
+    entry_status = write_queue.status(st.session_state.queued_entry)
+    if entry_status["state"] == "persisted":
+        st.caption("上一筆紀錄已寫入雲端。")
+        if entry_status["outcome"] == "merged":
+            st.info("其他人剛更新了同一天的紀錄，已合併雙方內容（空白欄位保留對方的資料）。")
+        del st.session_state.queued_entry
+    elif entry_status["state"] == "superseded":
+        st.caption("上一筆紀錄已由之後同一天的送出取代。")
+        del st.session_state.queued_entry
+    else:
+        col_status, col_refresh = st.columns([4, 1])
+        if entry_status["state"] == "retrying":
+            col_status.warning(f"上一筆紀錄暫存在伺服器，寫入雲端失敗 {entry_status['attempts']} 次，"
+                               f"將自動重試（{entry_status['last_error']}）。")
+        else:
+            col_status.info("上一筆紀錄已暫存，正在寫入雲端...")
+        col_refresh.button("更新狀態")
+
 # 從環境變數中取得密碼
 UPLOAD_PASSWORD = st.secrets["UPLOAD_PASSWORD"]
 
 # 如果 pending_record 已存在，則顯示密碼表單
 if "pending_record" in st.session_state:
+    # 暫存的紀錄只疊在共用快照上（寫入時複製），其他 session 看不到，也不複製整份資料
+    pending_date = st.session_state.pending_record["date"]
+    staged = current_snapshot(st.session_state.get("pending_user", user_id)).with_changes(
+        records={pending_date: st.session_state.pending_record})
+    st.caption("確認上傳後的近七天紀錄：")
+    st.dataframe(staged.view(pending_date - datetime.timedelta(days=6), pending_date, NUMERIC_COLUMNS),
+                 hide_index=True, use_container_width=True)
     with st.form("password_form"):
         password_input = st.text_input("請輸入上傳密碼", type="password", key="upload_password")
         password_submit = st.form_submit_button("確認上傳")
@@ -125,31 +154,49 @@ if "pending_record" in st.session_state:
         if password_input == UPLOAD_PASSWORD:
             st.success("密碼正確")  # 除錯用
             record_date = st.session_state.pending_record["date"].date()
-            duplicate_index = None
-            for i, rec in enumerate(st.session_state.daily_records):
-                if rec["date"].date() == record_date:
-                    duplicate_index = i
-                    break
-            if duplicate_index is not None:
-                st.warning("該日期已有紀錄。將覆蓋舊紀錄。")
-                updated_records = remove_record_by_date(record_date, st.session_state.daily_records)
-                if updated_records is not None:
-                    st.session_state.daily_records = updated_records
-                    st.session_state.daily_records.append(st.session_state.pending_record)
-                    if save_records(st.session_state.daily_records):
-                        st.success("現有紀錄已被覆蓋！")
+            pending_user = st.session_state.get("pending_user", user_id)
+            pending_uploads = st.session_state.get("pending_uploads", {})
+            if pending_uploads:
+                progress = st.progress(0.0, text="正在上傳照片...")
+
+                def report_progress(field, done, total, error):
+                    label = UPLOAD_FIELDS[field][1]
+                    progress.progress(done / total, text=f"照片上傳中（{done}/{total}）")
+                    if error:
+                        st.error(f"{label} 上傳失敗：{error}")
                     else:
-                        st.error("儲存資料失敗。")
-                else:
-                    st.error("移除舊紀錄失敗。")
+                        st.write(f"{label} 已上傳")
+
+                urls, errors, sizes = upload_staged_files(pending_uploads, on_progress=report_progress,
+                                                           user_id=pending_user)
+                if sizes["original"]:
+                    saved = sizes["original"] - sizes["uploaded"]
+                    st.caption(f"照片壓縮：{sizes['original'] / 1e6:.1f} MB → {sizes['uploaded'] / 1e6:.1f} MB"
+                               f"（節省 {saved / 1e6:.1f} MB，{saved / sizes['original']:.0%}）")
+                st.session_state.pending_record.update(urls)
+                # 已成功的照片不再重傳；失敗的保留，重新輸入密碼即可重試
+                st.session_state.pending_uploads = {f: item for f, item in pending_uploads.items() if f in errors}
+                if errors:
+                    st.warning("部分照片上傳失敗，請重新輸入密碼重試。")
+                    st.stop()
+            if get_record(record_date, user_id=pending_user) is not None:
+                st.warning("該日期已有紀錄。將覆蓋舊紀錄。")
+                success_msg = "現有紀錄已被覆蓋！"
+            else:
+                success_msg = "每日紀錄已提交，且圖片已上傳至 GCS！"
+            # 紀錄先存入本機佇列即返回，由背景寫到 GCS；寫入失敗會自動重試，不會遺失
+            entry_id = queue_record(record_date, st.session_state.pending_record, user_id=pending_user,
+                                    base_generation=st.session_state.get("pending_generation"))
+            if entry_id is not None:
+                st.session_state.queued_entry = entry_id
+                st.success(success_msg)
             else:
-                st.session_state.daily_records.append(st.session_state.pending_record)
-                if save_records(st.session_state.daily_records):
-                    st.success("每日紀錄已提交，且圖片已上傳至 GCS！")
-                else:
-                    st.error("儲存資料失敗。")
+                st.error("儲存資料失敗。")
             # 清除 pending_record 以便未來重新提交
             del st.session_state.pending_record
+            st.session_state.pop("pending_uploads", None)
+            st.session_state.pop("pending_user", None)
+            st.session_state.pop("pending_generation", None)
         else:
             st.error("密碼錯誤，請重試。")
     st.stop()  # 當密碼表單呈現時，停止其他代碼執行
\ No newline at end of file
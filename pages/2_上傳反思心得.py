@@ -1,22 +1,19 @@
 import datetime
 import streamlit as st
-import pandas as pd
-from common import load_reflections, save_reflections
+from common import get_reflection, queue_reflection, select_user, week_start_of
+import write_queue
 
 
 st.set_page_config(page_title="上傳反思心得紀錄", layout="wide")
 st.title("上傳反思心得紀錄")
-
-
-# 初始化 reflection_records
-st.session_state.setdefault("reflection_records", load_reflections())
+user_id = select_user()
 
 # ---------------- 反思輸入表單 ----------------
 with st.form("reflection_form", clear_on_submit=True):
     # 讓使用者指定反思日期
     refl_date = st.date_input("請選擇反思日期", datetime.date.today())
     # 根據使用者選擇的日期，計算該週的起始與結束日期（以週一為起點）
-    week_start = pd.to_datetime(refl_date).to_period("W").start_time.date()
+    week_start = week_start_of(refl_date)
     week_end = week_start + datetime.timedelta(days=6)
 
     refl_text = st.text_area("請輸入反思內容", help="每週僅有一筆反思紀錄，若已存在將被更新")
@@ -31,14 +28,41 @@ if refl_submit:
     }
     # 將反思資料暫存，這裡以週的起始日期作為該筆紀錄的日期
     st.session_state.pending_reflection = new_record
+    # 記下暫存時的使用者：確認前切換了代號就捨棄，不會存到別人的帳號
+    st.session_state.pending_reflection_user = user_id
     st.info("請輸入密碼以確認上傳反思紀錄。")
 
 
+# ---------------- 寫入狀態 ----------------
+
+if "queued_reflection" in st.session_state:
+    entry_status = write_queue.status(st.session_state.queued_reflection)
+    if entry_status["state"] == "persisted":
+        st.caption("上一筆反思已寫入雲端。")
+        del st.session_state.queued_reflection
+    elif entry_status["state"] == "superseded":
+        st.caption("上一筆反思已由之後同一週的送出取代。")
+        del st.session_state.queued_reflection
+    else:
+        col_status, col_refresh = st.columns([4, 1])
+        if entry_status["state"] == "retrying":
+            col_status.warning(f"上一筆反思暫存在伺服器，寫入雲端失敗 {entry_status['attempts']} 次，"
+                               f"將自動重試（{entry_status['last_error']}）。")
+        else:
+            col_status.info("上一筆反思已暫存，正在寫入雲端...")
+        col_refresh.button("更新狀態")
+
 # ---------------- 密碼確認 ----------------
 
 # 從環境變數中取得密碼
 UPLOAD_PASSWORD = st.secrets["UPLOAD_PASSWORD"]
 
+# 暫存後切換了使用者代號：捨棄暫存的反思，請使用者重新輸入
+if "pending_reflection" in st.session_state and st.session_state.get("pending_reflection_user") != user_id:
+    del st.session_state.pending_reflection
+    st.session_state.pop("pending_reflection_user", None)
+    st.warning("使用者代號已變更，先前暫存的反思已捨棄，請重新輸入。")
+
 # 如果 pending_record 已存在，則顯示密碼表單
 if "pending_reflection" in st.session_state:
     with st.form("password_form"):
@@ -47,28 +71,21 @@ if "pending_reflection" in st.session_state:
     if password_submit:
         if password_input == UPLOAD_PASSWORD:
             st.success("密碼正確，正在更新反思紀錄...")
-            records = load_reflections()
-            st.write(f"old: {records}")
             pending_date = st.session_state.pending_reflection["date"]
             # 以 pending_date 計算該週的起始日期
-            pending_week_start = pd.to_datetime(pending_date).to_period("W").start_time.date()
-            updated = False
-            # 檢查是否已有本週反思紀錄
-            for rec in records:
-                rec_week_start = pd.to_datetime(rec["date"]).to_period("W").start_time.date()
-                if rec_week_start == pending_week_start:
-                    rec["reflection"] = st.session_state.pending_reflection["reflection"]
-                    updated = True
-                    break
-            if not updated:
-                records.append(st.session_state.pending_reflection)
-            if save_reflections(records):
-                records = load_reflections()
-                st.write(f"new: {records}")
+            pending_week_start = week_start_of(pending_date)
+            st.write(f"old: {get_reflection(pending_week_start, user_id=user_id)}")
+            # 先存入本機佇列即返回，由背景寫到 GCS
+            entry_id = queue_reflection(pending_week_start, st.session_state.pending_reflection["reflection"],
+                                        user_id=user_id)
+            if entry_id is not None:
+                st.session_state.queued_reflection = entry_id
+                st.write(f"new: {get_reflection(pending_week_start, user_id=user_id)}")
                 st.success("反思紀錄已更新！")
             else:
                 st.error("更新反思紀錄失敗。")
             del st.session_state.pending_reflection
+            st.session_state.pop("pending_reflection_user", None)
         else:
             st.error("密碼錯誤，請重試。")
     st.stop()
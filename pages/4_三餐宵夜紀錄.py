@@ -1,32 +1,49 @@
 import streamlit as st 
-import pandas as pd
 from datetime import datetime, timedelta
-from common import load_records
+from analytics import week_start
+from common import current_snapshot, refresh_snapshot, select_date_window, select_user, timed, MEAL_COLUMNS
 
 st.set_page_config(page_title="三餐宵夜照片紀錄", layout="wide")
 st.title("三餐宵夜照片紀錄")
+select_user()
 
-# 刷新按鈕：更新 session state 中的 daily_records
+# 刷新按鈕：清除快取，下次讀取時重新檢查 GCS
 if st.button("刷新資料"):
-    st.session_state.daily_records = load_records()
+    refresh_snapshot()
     st.success("資料已刷新！")
 
-# 從 session_state 或 CSV 取得最新資料
-if 'daily_records' in st.session_state:
-    records = st.session_state.daily_records
-else:
-    records = load_records()
+# 只載入選定區間內的紀錄，區間外的資料不會建立任何元件
+start, end = select_date_window("meals_window")
+with timed("page4.load"):
+    # 所有 session 共用同一份快照；view 與快照共用底層陣列
+    snapshot = current_snapshot()
+    df = snapshot.view(start, end, MEAL_COLUMNS) if start is not None else None
+
+MEALS = ["breakfast", "lunch", "dinner", "late_night"]
+
+def show_meal(col, row, meal):
+    image_url = row.get(meal)
+    thumb_url = row.get(f"{meal}_thumb")
+    desc = row.get(f"{meal}_desc")
+    if isinstance(image_url, str) and image_url.strip():
+        # 尚未產生縮圖的舊照片退回原圖
+        if isinstance(thumb_url, str) and thumb_url.strip():
+            col.image(thumb_url, use_container_width=True)
+        else:
+            col.image(image_url, use_container_width=True)
+        col.markdown(f"[查看原圖]({image_url})")
+    elif isinstance(desc, str) and desc.strip():
+        col.write(desc)
+    else:
+        col.write("無")
 
-if not records:
-    st.info("尚未有紀錄。")
+if df is None or df.empty:
+    st.info("此區間尚未有紀錄。")
 else:
-    df = pd.DataFrame(records)
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.sort_values("date")
-    
-    # 以週為單位計算週起始日期
-    df["week_start"] = df["date"].dt.to_period("W").apply(lambda r: r.start_time)
-    grouped = df.groupby("week_start")
+    with timed("page4.group"):
+        # 以週為單位計算週起始日期
+        df["week_start"] = week_start(df["date"])
+        grouped = df.groupby("week_start")
 
     for week, group in grouped:
         week_end = week + timedelta(days=6)
@@ -39,47 +56,12 @@ else:
         header_cols[3].markdown("**晚餐**")
         header_cols[4].markdown("**宵夜**")
         
-        for _, row in group.sort_values("date").iterrows():
-            row_cols = st.columns([1, 3, 3, 3, 3])
-            # 日期
-            row_cols[0].write(row["date"].strftime("%Y-%m-%d"))
-            
-            # 早餐：圖片優先，否則描述
-            breakfast_val = row.get("breakfast")
-            breakfast_desc = row.get("breakfast_desc")
-            if isinstance(breakfast_val, str) and breakfast_val.strip():
-                row_cols[1].image(breakfast_val, use_container_width=True)
-            elif isinstance(breakfast_desc, str) and breakfast_desc.strip():
-                row_cols[1].write(breakfast_desc)
-            else:
-                row_cols[1].write("無")
-            
-            # 午餐
-            lunch_val = row.get("lunch")
-            lunch_desc = row.get("lunch_desc")
-            if isinstance(lunch_val, str) and lunch_val.strip():
-                row_cols[2].image(lunch_val, use_container_width=True)
-            elif isinstance(lunch_desc, str) and lunch_desc.strip():
-                row_cols[2].write(lunch_desc)
-            else:
-                row_cols[2].write("無")
-            
-            # 晚餐
-            dinner_val = row.get("dinner")
-            dinner_desc = row.get("dinner_desc")
-            if isinstance(dinner_val, str) and dinner_val.strip():
-                row_cols[3].image(dinner_val, use_container_width=True)
-            elif isinstance(dinner_desc, str) and dinner_desc.strip():
-                row_cols[3].write(dinner_desc)
-            else:
-                row_cols[3].write("無")
+        with timed("page4.rows"):
+            for _, row in group.sort_values("date").iterrows():
+                row_cols = st.columns([1, 3, 3, 3, 3])
+                # 日期
+                row_cols[0].write(row["date"].strftime("%Y-%m-%d"))
             
-            # 宵夜
-            late_night_val = row.get("late_night")
-            late_night_desc = row.get("late_night_desc")
-            if isinstance(late_night_val, str) and late_night_val.strip():
-                row_cols[4].image(late_night_val, use_container_width=True)
-            elif isinstance(late_night_desc, str) and late_night_desc.strip():
-                row_cols[4].write(late_night_desc)
-            else:
-                row_cols[4].write("無")
+                # 圖片優先（顯示縮圖，原圖需點擊才載入），否則描述
+                for col, meal in zip(row_cols[1:], MEALS):
+                    show_meal(col, row, meal)
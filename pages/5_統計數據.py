@@ -2,81 +2,101 @@ import pandas as pd
 import streamlit as st
 from st_aggrid import AgGrid
 from streamlit_echarts import st_echarts
-from common import load_records
+from analytics import correlation, rolling_means, streaks, DEFAULT_STEP_GOAL, ROLLING_WINDOWS
+from chart_data import RESOLUTION_LABELS, build_chart_data, chart_height, overlay_chart_option, stacked_chart_option
+from common import current_snapshot, format_value, load_user_summary, overall_means, select_user, NUMERIC_COLUMNS
 
 st.set_page_config(page_title="統計數據", layout="wide")
 st.title("統計數據")
+select_user()
 
-daily_records = load_records()
+# 只讀取數值欄位，不下載照片網址與餐點描述
+# 所有 session 共用同一份快照，只取數值欄位的 view（依日期排序、型別固定）
+df_show = current_snapshot().view(columns=NUMERIC_COLUMNS)
 
-if daily_records:
-    df_show = pd.DataFrame(daily_records)
-    df_show["date"] = pd.to_datetime(df_show["date"])
-    df_show = df_show.sort_values("date")
-    
+if not df_show.empty:
     df_show["date_display"] = df_show["date"].dt.strftime("%Y-%m-%d")
     
-    # 計算平均數值
-    avg_sleep = df_show["sleep_hours"].mean()
-    avg_steps = df_show["steps"].mean()
-    avg_sugary = df_show["sugary_drinks"].mean()
-    avg_screen = df_show["screen_time"].mean() if "screen_time" in df_show.columns else 0
+    # 平均數值來自每月彙總表，不需重新掃描每日紀錄
+    means = overall_means()
+    avg_sleep = means["sleep_hours"]
+    avg_steps = means["steps"]
+    avg_sugary = means["sugary_drinks"]
+    avg_screen = means["screen_time"]
     
     st.markdown("### 總平均數據")
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("平均睡眠時數", f"{avg_sleep:.1f} 小時")
-    col2.metric("平均每日步數", f"{avg_steps:.0f} 步")
-    col3.metric("平均每日含糖飲料", f"{avg_sugary:.1f} 杯")
-    col4.metric("平均螢幕使用時間", f"{avg_screen:.1f} 小時")
+    col1.metric("平均睡眠時數", format_value(avg_sleep, ".1f", " 小時"))
+    col2.metric("平均每日步數", format_value(avg_steps, ".0f", " 步"))
+    col3.metric("平均每日含糖飲料", format_value(avg_sugary, ".1f", " 杯"))
+    col4.metric("平均螢幕使用時間", format_value(avg_screen, ".1f", " 小時"))
     
+    # ---------------- 顯示區間（縮放） ----------------
+    # 只有選取區間內的資料會送到瀏覽器；區間越短，解析度越高
+    min_date = df_show["date"].min().date()
+    max_date = df_show["date"].max().date()
+    if min_date < max_date:
+        zoom_start, zoom_end = st.slider("顯示區間", min_value=min_date, max_value=max_date, value=(min_date, max_date))
+    else:
+        zoom_start, zoom_end = min_date, max_date
+    in_window = (df_show["date"].dt.date >= zoom_start) & (df_show["date"].dt.date <= zoom_end)
+
+    # ---------------- 趨勢分析 ----------------
+    st.markdown("### 趨勢分析")
+    metric_labels = {"sleep_hours": "睡眠時數", "steps": "步數", "sugary_drinks": "含糖飲料數量", "screen_time": "螢幕使用時間"}
+    rolling_metric = st.selectbox("移動平均指標", list(metric_labels), format_func=metric_labels.get)
+    # 移動平均以全部資料計算，再取顯示區間
+    rolling = rolling_means(df_show, rolling_metric)
+    rolling_specs = [(rolling_metric, "每日", "line")] + [
+        (f"{rolling_metric}_{w}d", f"{w} 日平均", "line") for w in ROLLING_WINDOWS
+    ]
+    rolling_data = build_chart_data(rolling, [c for c, _, _ in rolling_specs], zoom_start, zoom_end)
+    st.caption(f"解析度：{RESOLUTION_LABELS[rolling_data['resolution']]}")
+    st_echarts(options=overlay_chart_option(rolling_data, rolling_specs), height="400px")
+
+    col_corr, col_goal, col_current, col_longest = st.columns(4)
+    corr = correlation(df_show[in_window], "sleep_hours", "screen_time")
+    col_corr.metric("睡眠與螢幕時間相關係數", "資料不足" if pd.isna(corr) else f"{corr:.2f}")
+    step_goal = col_goal.number_input("步數目標", min_value=0, step=500, value=DEFAULT_STEP_GOAL)
+    streak = streaks(df_show, "steps", step_goal)
+    col_current.metric("目前連續達標天數", f"{streak['current']} 天")
+    col_longest.metric("最長連續達標天數", f"{streak['longest']} 天")
+    if streak["longest"]:
+        col_longest.caption(f"{streak['longest_start']} ~ {streak['longest_end']}")
+
     st.subheader("每日紀錄概覽")
-    AgGrid(df_show[["date_display", "sleep_hours", "steps", "sugary_drinks", "screen_time"]])
-    daily_dates = df_show["date"].dt.strftime("%Y-%m-%d").tolist()
-    
-    # 每日睡眠時數趨勢圖
-    sleep_data = df_show["sleep_hours"].tolist()
-    option_sleep = {
-        "tooltip": {"trigger": "axis"},
-        "xAxis": {"type": "category", "data": daily_dates},
-        "yAxis": {"type": "value"},
-        "series": [{"data": sleep_data, "type": "line", "name": "睡眠時數"}]
-    }
-    st.subheader("每日睡眠時數趨勢")
-    st_echarts(options=option_sleep, height="400px")
-    
-    # 每日步數圖
-    steps_data = df_show["steps"].tolist()
-    option_steps = {
-        "tooltip": {"trigger": "axis"},
-        "xAxis": {"type": "category", "data": daily_dates},
-        "yAxis": {"type": "value"},
-        "series": [{"data": steps_data, "type": "bar", "name": "步數"}]
-    }
-    st.subheader("每日步數")
-    st_echarts(options=option_steps, height="400px")
-    
-    # 每日含糖飲料數量圖
-    sugary_data = df_show["sugary_drinks"].tolist()
-    option_sugary = {
-        "tooltip": {"trigger": "axis"},
-        "xAxis": {"type": "category", "data": daily_dates},
-        "yAxis": {"type": "value"},
-        "series": [{"data": sugary_data, "type": "line", "name": "含糖飲料數量"}]
-    }
-    st.subheader("每日含糖飲料數量趨勢")
-    st_echarts(options=option_sugary, height="400px")
-    
-    # 每日螢幕使用時間趨勢圖（若有資料）
-    if "screen_time" in df_show.columns:
-        screen_data = df_show["screen_time"].tolist()
-        option_screen = {
-            "tooltip": {"trigger": "axis"},
-            "xAxis": {"type": "category", "data": daily_dates},
-            "yAxis": {"type": "value"},
-            "series": [{"data": screen_data, "type": "line", "name": "螢幕使用時間"}]
-        }
-        st.subheader("每日螢幕使用時間趨勢")
-        st_echarts(options=option_screen, height="400px")
+    # 時數在 RecordTable 中為 float32，AgGrid 以 to_json 傳送會變成 7.0999999046：先轉成 float64 並取到小數一位
+    grid = df_show.loc[in_window, ["date_display", "sleep_hours", "steps", "sugary_drinks", "screen_time"]]
+    AgGrid(grid.astype({"sleep_hours": "float64", "screen_time": "float64"}).round({"sleep_hours": 1, "screen_time": 1}))
+
+    # 四個指標共用一份 dataset 與 x 軸，點數超過預算時自動降採樣
+    trend_specs = [
+        ("sleep_hours", "睡眠時數", "line"),
+        ("steps", "步數", "bar"),
+        ("sugary_drinks", "含糖飲料數量", "line"),
+        ("screen_time", "螢幕使用時間", "line"),
+    ]
+    trend_data = build_chart_data(df_show, [c for c, _, _ in trend_specs], zoom_start, zoom_end)
+    st.subheader(f"{RESOLUTION_LABELS[trend_data['resolution']]}趨勢")
+    st_echarts(options=stacked_chart_option(trend_data, trend_specs), height=chart_height(trend_specs))
     
 else:
     st.info("尚未有每日紀錄數據。")
+
+# ---------------- 全體使用者概況 ----------------
+# 只讀取預先計算的摘要檔（每位使用者一列），不讀取任何人的每日紀錄
+summary = load_user_summary()
+if not summary.empty:
+    st.markdown("### 全體使用者概況")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("使用者人數", f"{len(summary)} 人")
+    class_means = {
+        m: summary[f"{m}_sum"].sum() / summary[f"{m}_count"].sum() if summary[f"{m}_count"].sum() else 0
+        for m in NUMERIC_COLUMNS
+    }
+    col2.metric("全體平均睡眠時數", format_value(class_means["sleep_hours"], ".1f", " 小時"))
+    col3.metric("全體平均每日步數", format_value(class_means["steps"], ".0f", " 步"))
+    col4.metric("全體平均含糖飲料", format_value(class_means["sugary_drinks"], ".1f", " 杯"))
+    col5.metric("全體平均螢幕時間", format_value(class_means["screen_time"], ".1f", " 小時"))
+    summary_view = summary[["user_id", "days", "first_month", "last_month"] + [f"{m}_mean" for m in NUMERIC_COLUMNS]]
+    AgGrid(summary_view.round(2))
@@ -0,0 +1,57 @@
+import pandas as pd
+import streamlit as st
+import metrics
+
+st.set_page_config(page_title="效能監控", layout="wide")
+st.title("效能監控")
+
+# 管理頁面：未另設 ADMIN_PASSWORD 時沿用上傳密碼
+ADMIN_PASSWORD = st.secrets.get("ADMIN_PASSWORD", st.secrets["UPLOAD_PASSWORD"])
+
+if not st.session_state.get("admin_ok"):
+    with st.form("admin_form"):
+        password_input = st.text_input("請輸入管理密碼", type="password")
+        if st.form_submit_button("確認"):
+            if password_input == ADMIN_PASSWORD:
+                st.session_state.admin_ok = True
+                st.rerun()
+            else:
+                st.error("密碼錯誤，請重試。")
+    st.stop()
+
+st.caption(f"統計為整個伺服器行程（所有使用者）共用；百分位數取每個操作最近 {metrics.HISTOGRAM_WINDOW} 次。")
+
+col_refresh, col_export, col_reset = st.columns(3)
+col_refresh.button("重新整理")
+if col_export.button("寫出 Prometheus 檔案"):
+    try:
+        st.success(f"已寫出至 {metrics.write_prometheus()}")
+    except OSError as e:
+        st.error(f"寫出失敗：{e}")
+if col_reset.button("重設統計"):
+    metrics.reset()
+    st.success("統計已重設。")
+
+rows = metrics.snapshot()
+if not rows:
+    st.info("尚未有任何紀錄，請先瀏覽其他頁面。")
+    st.stop()
+
+df = pd.DataFrame(rows)
+# 操作名稱的前綴代表類別：gcs（儲存請求）、parse（解析）、build（DataFrame 處理）、serialize、page3/page4（頁面繪製）
+df.insert(0, "category", df["operation"].str.split(".").str[0])
+categories = sorted(df["category"].unique())
+selected = st.multiselect("類別", categories, default=categories)
+df = df[df["category"].isin(selected)]
+
+st.subheader("各操作耗時")
+st.dataframe(df, use_container_width=True, hide_index=True)
+
+st.subheader("p50 / p95 耗時（毫秒）")
+st.bar_chart(df.set_index("operation")[["p50_ms", "p95_ms"]])
+
+st.subheader("總耗時占比（秒）")
+st.bar_chart(df.groupby("category")["total_s"].sum())
+
+with st.expander("Prometheus 文字格式"):
+    st.code(metrics.prometheus_text(), language="text")
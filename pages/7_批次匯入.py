@@ -0,0 +1,72 @@
+import pandas as pd
+import streamlit as st
+from common import select_user
+from importer import MAX_REPORTED_ERRORS, errors_to_csv, import_file
+
+st.set_page_config(page_title="批次匯入", layout="wide")
+st.title("批次匯入")
+user_id = select_user()
+
+st.markdown(
+    "上傳手機健康 App 或其他工具匯出的 CSV / JSON / JSON Lines 檔案，一次匯入多天的紀錄。\n\n"
+    "- 必須有日期欄（`date` 或 `日期`），其他可用欄位：`sleep_hours`、`bed_time` + `wake_time`、"
+    "`sleep_minutes`、`steps`、`sugary_drinks`、`screen_time`、`screen_minutes` 與各餐的 `*_desc`。\n"
+    "- 有上床與起床時間時，睡眠時數的算法與上傳表單相同。\n"
+    "- 同一天已有紀錄時，只覆蓋檔案中有值的欄位；有問題的列不會匯入，可下載錯誤報告。"
+)
+
+UPLOAD_PASSWORD = st.secrets["UPLOAD_PASSWORD"]
+
+with st.form("import_form"):
+    uploaded = st.file_uploader("匯出檔案", type=["csv", "json", "jsonl", "ndjson"])
+    dry_run = st.checkbox("只檢查，不寫入", value=True)
+    password_input = st.text_input("請輸入上傳密碼", type="password")
+    submit = st.form_submit_button("開始匯入")
+
+if submit:
+    if uploaded is None:
+        st.warning("請先選擇檔案。")
+    elif password_input != UPLOAD_PASSWORD:
+        st.error("密碼錯誤，請重試。")
+    else:
+        progress = st.progress(0.0, text="讀取中...")
+        total = max(uploaded.size, 1)
+
+        def report_progress(rows, valid, errors):
+            # 以已讀取的位元組估計進度；JSON 陣列會一次讀完
+            progress.progress(min(uploaded.tell() / total, 1.0),
+                              text=f"已讀取 {rows} 列（有效 {valid}，錯誤 {errors}）")
+
+        try:
+            result = import_file(uploaded, uploaded.name, user_id=user_id, dry_run=dry_run,
+                                 on_chunk=report_progress)
+        except ValueError as e:
+            progress.empty()
+            st.error(f"無法讀取檔案：{e}")
+            st.stop()
+        progress.progress(1.0, text=f"已讀取 {result['rows']} 列")
+        st.session_state.import_result = (uploaded.name, dry_run, result)
+
+if "import_result" in st.session_state:
+    file_name, was_dry_run, result = st.session_state.import_result
+    cols = st.columns(4)
+    cols[0].metric("讀取列數", result["rows"])
+    cols[1].metric("有效列數", result["valid"])
+    cols[2].metric("涉及天數", result["dates"])
+    cols[3].metric("錯誤列", result["error_count"])
+    if was_dry_run:
+        st.info(f"檢查完成，未寫入任何資料。取消勾選「只檢查，不寫入」即可匯入 {result['dates']} 天的紀錄。")
+    elif result["saved"]:
+        st.success(f"已匯入 {file_name}：新增 {result['added']} 天，更新 {result['updated']} 天。")
+    elif result["saved"] is False:
+        st.error("寫入失敗，請稍後再試。")
+    else:
+        st.warning("檔案中沒有可匯入的紀錄。")
+
+    if result["errors"]:
+        st.subheader("錯誤報告")
+        if result["error_count"] > len(result["errors"]):
+            st.caption(f"共 {result['error_count']} 個錯誤，只列出前 {MAX_REPORTED_ERRORS} 個。")
+        st.dataframe(pd.DataFrame(result["errors"]), use_container_width=True, hide_index=True)
+        st.download_button("下載錯誤報告（CSV）", errors_to_csv(result["errors"]),
+                           file_name=f"{file_name}.errors.csv", mime="text/csv")
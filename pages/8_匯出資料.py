@@ -0,0 +1,61 @@
+import datetime
+import os
+import tempfile
+import streamlit as st
+from common import list_record_months, select_user
+from exporter import export_bundle
+
+st.set_page_config(page_title="匯出資料", layout="wide")
+st.title("匯出資料")
+user_id = select_user()
+
+months = list_record_months()
+today = datetime.date.today()
+default_start = datetime.date.fromisoformat(f"{months[-1]}-01") if months else today - datetime.timedelta(days=30)
+
+with st.form("export_form"):
+    date_range = st.date_input("匯出日期範圍", (default_start, today))
+    include_images = st.checkbox("包含證明照片", value=False, help="照片會逐張下載後放進 ZIP，檔案可能很大")
+    table_format = st.radio("表格格式", ["csv", "parquet"], horizontal=True,
+                            format_func=lambda f: {"csv": "CSV（Excel 可開啟）", "parquet": "Parquet"}[f])
+    submit = st.form_submit_button("產生匯出檔")
+
+if submit:
+    if len(date_range) != 2:
+        st.warning("請選擇起訖日期。")
+        st.stop()
+    start, end = date_range
+    progress = st.progress(0.0, text="匯出紀錄中...")
+
+    def report_progress(done, total):
+        progress.progress(done / total, text=f"照片 {done}/{total}")
+
+    # 先寫到暫存檔：照片下載後直接寫入磁碟，不會在記憶體中累積整份 ZIP
+    tmp = tempfile.NamedTemporaryFile(prefix="internet_health_export_", suffix=".zip", delete=False)
+    try:
+        with tmp:
+            manifest = export_bundle(tmp, start, end, user_id=user_id, include_images=include_images,
+                                     table_format=table_format, on_progress=report_progress)
+    except Exception as e:
+        os.remove(tmp.name)
+        progress.empty()
+        st.error(f"匯出失敗：{e}")
+        st.stop()
+    progress.progress(1.0, text="匯出完成")
+    previous = st.session_state.pop("export_file", None)
+    if previous and os.path.exists(previous[0]):
+        os.remove(previous[0])
+    st.session_state.export_file = (tmp.name, f"internet_health_{user_id}_{start}_{end}.zip", manifest)
+
+if "export_file" in st.session_state:
+    path, file_name, manifest = st.session_state.export_file
+    cols = st.columns(4)
+    cols[0].metric("每日紀錄", manifest["records"])
+    cols[1].metric("反思", manifest["reflections"])
+    cols[2].metric("照片", manifest["images"])
+    cols[3].metric("檔案大小（MB）", f"{os.path.getsize(path) / 1e6:.1f}" if os.path.exists(path) else "-")
+    if manifest["missing_images"]:
+        st.warning(f"{len(manifest['missing_images'])} 張照片下載失敗，清單記錄在 ZIP 的 manifest.json 中。")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            st.download_button("下載 ZIP", f, file_name=file_name, mime="application/zip")
@@ -0,0 +1,30 @@
+import time
+import pandas as pd
+import streamlit as st
+from common import SEARCH_FIELDS, SEARCH_LIMIT, search_records, select_user
+from search import FIELD_LABELS
+
+st.set_page_config(page_title="搜尋", layout="wide")
+st.title("搜尋三餐與反思")
+user_id = select_user()
+
+with st.form("search_form"):
+    query = st.text_input("關鍵字", placeholder="例如：珍奶、睡眠；以空白分隔多個關鍵字")
+    fields = st.multiselect("搜尋欄位", SEARCH_FIELDS, default=SEARCH_FIELDS, format_func=FIELD_LABELS.get)
+    st.form_submit_button("搜尋")
+
+# 表單內的值在 rerun 之間保留：只要有關鍵字就搜尋，切換使用者或其他 rerun 時結果仍會顯示
+
+if query.strip():
+    start = time.perf_counter()
+    results = search_records(query, fields=fields or None, user_id=user_id)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not results:
+        st.info(f"找不到「{query}」。")
+        st.stop()
+    note = f"（只顯示最新的 {SEARCH_LIMIT} 筆）" if len(results) >= SEARCH_LIMIT else ""
+    st.caption(f"找到 {len(results)} 筆{note}，耗時 {elapsed_ms:.1f} ms")
+    df = pd.DataFrame(results)
+    df["field"] = df["field"].map(FIELD_LABELS)
+    st.dataframe(df.rename(columns={"date": "日期", "field": "欄位", "text": "內容"}),
+                 hide_index=True, use_container_width=True)
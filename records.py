@@ -0,0 +1,94 @@
+"""
+每日紀錄的欄位式容器 RecordTable：取代 load_records 回傳的 list of dicts。
+
+- 每個欄位一個有型別的陣列：date 為 datetime64、時數為 float32、步數與飲料杯數為 Int32
+  （可為空的 int32），照片網址與描述等文字欄位為 Arrow 字串（連續的緩衝區，不是一個個 Python 物件）。
+- 依日期排序，get(日期) 以二分搜尋取得單日紀錄。
+- view() 回傳共用底層陣列的 DataFrame（不複製資料），頁面可以直接 groupby、畫圖；
+  view 視為唯讀，新增欄位不會影響原表，但不應就地修改既有欄位的值。
+"""
+import numpy as np
+import pandas as pd
+
+FLOAT_COLUMNS = ["sleep_hours", "screen_time"]
+INT_COLUMNS = ["steps", "sugary_drinks"]
+STRING_DTYPE = "string[pyarrow]"
+RECORD_DTYPES = {"date": "datetime64[ns]", **{c: "float32" for c in FLOAT_COLUMNS},
+                 **{c: "Int32" for c in INT_COLUMNS}}
+
+
+def _coerce(df):
+    """轉成固定型別：已知數值欄位依 RECORD_DTYPES，其餘文字欄位轉成 Arrow 字串。"""
+    columns = {}
+    for name, values in df.items():
+        dtype = RECORD_DTYPES.get(name)
+        if name == "date":
+            values = pd.to_datetime(values)
+        elif dtype is not None:
+            values = pd.to_numeric(values, errors="coerce")
+            if dtype == "Int32":
+                values = values.round()
+        elif values.dtype == object:
+            dtype = STRING_DTYPE
+        columns[name] = values.astype(dtype) if dtype is not None else values
+    return pd.DataFrame(columns, copy=False)
+
+
+def _scalar(value):
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class RecordTable:
+    """依日期排序、欄位型別固定的每日紀錄（建立後不再修改）。"""
+
+    def __init__(self, df):
+        if df.empty or "date" not in df.columns:
+            df = pd.DataFrame({"date": pd.Series(dtype="datetime64[ns]")})
+        df = _coerce(df.sort_values("date", kind="stable").reset_index(drop=True))
+        self._df = df
+        self._dates = df["date"].dt.normalize().to_numpy()
+
+    def __len__(self):
+        return len(self._df)
+
+    def __bool__(self):
+        return len(self._df) > 0
+
+    @property
+    def columns(self):
+        return list(self._df.columns)
+
+    @property
+    def nbytes(self):
+        """所有欄位（含 Arrow 字串緩衝區）實際佔用的位元組數。"""
+        return int(self._df.memory_usage(index=False, deep=True).sum())
+
+    def _row_range(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(start).normalize()), "left")
+        hi = len(self._dates) if end is None else np.searchsorted(
+            self._dates, np.datetime64(pd.Timestamp(end).normalize()), "right")
+        return lo, hi
+
+    def view(self, start=None, end=None, columns=None):
+        """
+        回傳 start~end（含）、限定 columns（date 一定包含）的 DataFrame，與本表共用底層陣列。
+        """
+        lo, hi = self._row_range(start, end)
+        rows = self._df.iloc[lo:hi]
+        if columns is None:
+            wanted = list(rows.columns)
+        else:
+            wanted = ["date"] + [c for c in columns if c != "date" and c in rows.columns]
+        # 以各欄位的 Series 組成新的 DataFrame（copy=False）：以欄位清單選取會複製資料，
+        # 直接回傳 self._df 則頁面新增欄位時會改到共用的表
+        return pd.DataFrame({c: rows[c] for c in wanted}, copy=False)
+
+    def get(self, date):
+        """取得某日的紀錄 dict（缺值為 None），沒有則回傳 None。"""
+        lo, hi = self._row_range(date, date)
+        if lo == hi:
+            return None
+        row = self._df.iloc[hi - 1]  # 同一天有多筆時以最後一筆為準
+        return {k: _scalar(v) for k, v in row.items()}
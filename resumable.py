@@ -0,0 +1,91 @@
+"""
+大型證明照片的可續傳上傳（GCS resumable upload，使用 google-resumable-media）。
+
+一次送出整個檔案的 upload_from_file 在傳到一半斷線時必須整份重傳；這裡先建立上傳 session，
+再以 UPLOAD_CHUNK_SIZE 分段送出。某一段失敗時以指數退避等待，向伺服器查詢已收到的位元組數
+（ResumableUpload.recover），再從該處繼續，而不是從頭開始。
+
+本模組只處理 HTTP 層、不依賴 common.py；upload_check.py 以本機的替身伺服器注入中斷來驗證續傳。
+"""
+import time
+from urllib.parse import quote
+
+RESUMABLE_THRESHOLD = 1024 * 1024  # 壓縮後超過此大小改用可續傳上傳
+UPLOAD_CHUNK_SIZE = 512 * 1024     # 每段大小，須為 256 KiB 的倍數；連線越不穩定越應設小
+MAX_RETRIES = 8                    # 連續失敗（期間沒有任何進度）幾次後放棄
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MAX_DELAY = 16.0
+
+
+def upload_url(api_endpoint, bucket_name, if_generation_match=None):
+    """建立上傳 session 的 JSON API 網址。"""
+    url = f"{api_endpoint}/upload/storage/v1/b/{quote(bucket_name, safe='')}/o?uploadType=resumable"
+    if if_generation_match is not None:
+        url += f"&ifGenerationMatch={if_generation_match}"
+    return url
+
+
+def _retryable(error):
+    from google.resumable_media import common as media_common
+    from google.resumable_media.requests._request_helpers import _CONNECTION_ERROR_CLASSES
+    if isinstance(error, media_common.InvalidResponse):
+        return error.response.status_code in media_common.RETRYABLE
+    return isinstance(error, _CONNECTION_ERROR_CLASSES)
+
+
+def upload(transport, url, stream, name, content_type, chunk_size=UPLOAD_CHUNK_SIZE, max_retries=MAX_RETRIES,
+           timeout=(5, 60), sleep=time.sleep):
+    """
+    以可續傳 session 將 stream（須位於開頭）上傳為物件 name，回傳伺服器傳回的物件 metadata（dict）。
+    transport 為已授權的 requests.Session。暫時性錯誤（連線中斷、逾時、429、5xx）時等待後
+    從伺服器已收到的位置續傳；其他錯誤或連續失敗超過 max_retries 次時拋出例外
+    （resumable_media.InvalidResponse 帶有原始回應，例如 412 表示 generation 條件不成立）。
+    """
+    # google-resumable-media 載入較慢，只在真正需要分段上傳時才 import（同 common._make_gcs_bucket）
+    from google import resumable_media
+    from google.resumable_media.requests import ResumableUpload
+
+    session = ResumableUpload(url, chunk_size, checksum="crc32c")
+    # 重試由下面的迴圈負責：每次重送前先向伺服器確認進度，不使用套件內建的「原段重送」
+    session._retry_strategy = resumable_media.RetryStrategy(max_retries=0)
+    failures = 0
+    committed = 0
+    recovering = False
+    while True:
+        try:
+            if session.resumable_url is None:
+                session.initiate(transport, stream, {"name": name}, content_type, timeout=timeout)
+            elif recovering:
+                metadata = _recover(session, transport)
+                if metadata is not None:
+                    return metadata
+                recovering = False
+            if session.bytes_uploaded > committed:
+                # 伺服器有新收到的資料：連續失敗次數重新計算
+                committed = session.bytes_uploaded
+                failures = 0
+            response = session.transmit_next_chunk(transport, timeout=timeout)
+            if session.finished:
+                return response.json()
+        except Exception as e:
+            if not _retryable(e):
+                raise
+            failures += 1
+            if failures > max_retries:
+                raise
+            recovering = session.resumable_url is not None
+            sleep(min(RETRY_INITIAL_DELAY * 2 ** (failures - 1), RETRY_MAX_DELAY))
+
+def _recover(session, transport):
+    """
+    向伺服器查詢已收到的位元組數，並將 stream 移到該處。
+    最後一段其實已送達、只是回應在途中遺失時，伺服器直接回傳物件 metadata，此時回傳該 dict。
+    """
+    from google import resumable_media
+    try:
+        session.recover(transport)
+    except resumable_media.InvalidResponse as e:
+        if e.response.status_code in (200, 201):
+            return e.response.json()
+        raise
+    return None
@@ -0,0 +1,130 @@
+"""
+三餐描述與每週反思的全文搜尋：斷詞與倒排索引（不依賴儲存層）。
+
+斷詞：先做 NFKC 正規化與轉小寫；連續的中日韓文字切成單字與相鄰兩字（bigram），
+英數字以整個字為一個詞。查詢時中文取 bigram（只有一個字時取單字），所有詞都要出現，
+最後再以原文確認整段查詢字串確實出現，排除 bigram 分散在不同位置的誤判。
+
+索引以長表格保存，每列為 (token, doc)：doc 以日期與欄位編碼成一個整數。索引不保存原文，
+確認與顯示時由呼叫端提供的 load_texts(分割) 取得（common 只讀取該月份的紀錄與反思）。
+儲存層依月份分割索引，search() 依新到舊逐一查詢各分割，取滿筆數即停止；沒有候選文件的分割不讀原文。
+"""
+import datetime
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+SEARCH_FIELDS = ["breakfast_desc", "lunch_desc", "dinner_desc", "late_night_desc", "reflection"]
+FIELD_LABELS = {"breakfast_desc": "早餐", "lunch_desc": "午餐", "dinner_desc": "晚餐", "late_night_desc": "宵夜",
+                "reflection": "反思"}
+_FIELD_SLOTS = 8  # doc = 日期序數 * _FIELD_SLOTS + 欄位序號
+
+_CJK = r"぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+_RUN = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _is_cjk(run):
+    return re.match(rf"[{_CJK}]", run) is not None
+
+
+def tokenize(text):
+    """索引用的詞集合：中文為單字加 bigram，英數字為整個字。"""
+    tokens = set()
+    for run in _RUN.findall(_normalize(text)):
+        if _is_cjk(run):
+            tokens.update(run)
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+def query_tokens(query):
+    """查詢用的詞：中文只取 bigram（單一個字時取單字），數量較少、交集較快。"""
+    tokens = set()
+    for run in _RUN.findall(_normalize(query)):
+        if _is_cjk(run) and len(run) > 1:
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+def doc_key(date, field):
+    return pd.Timestamp(date).date().toordinal() * _FIELD_SLOTS + SEARCH_FIELDS.index(field)
+
+
+def decode_doc(doc):
+    return datetime.date.fromordinal(int(doc) // _FIELD_SLOTS), SEARCH_FIELDS[int(doc) % _FIELD_SLOTS]
+
+
+def index_rows(docs):
+    """docs 為 [(doc, 原文)]，回傳索引表格的列（DataFrame: token, doc），依 token 排序以利壓縮。"""
+    tokens, keys = [], []
+    for doc, text in docs:
+        if not isinstance(text, str) or not text.strip():
+            continue
+        for token in tokenize(text):
+            tokens.append(token)
+            keys.append(doc)
+    table = pd.DataFrame({"token": pd.Series(tokens, dtype="string"), "doc": pd.Series(keys, dtype="int64")})
+    return table.sort_values(["token", "doc"], ignore_index=True)
+
+
+class SearchIndex:
+    """由索引表格（一個分割）建立的記憶體內結構：{詞: 排序過的 doc 陣列}。"""
+
+    def __init__(self, table):
+        self.postings = {token: np.sort(docs.to_numpy()) for token, docs in table.groupby("token")["doc"]}
+        self.size = table["doc"].nunique()
+
+    def __len__(self):
+        return self.size
+
+    def candidates(self, tokens):
+        """同時含有所有 tokens 的 doc（遞增排序）。"""
+        # 從最短的 posting list 開始交集
+        lists = sorted((self.postings.get(t, np.empty(0, dtype="int64")) for t in tokens), key=len)
+        docs = lists[0]
+        for other in lists[1:]:
+            if docs.size == 0:
+                break
+            docs = np.intersect1d(docs, other, assume_unique=True)
+        return docs
+
+
+def search(indexes, query, load_texts, fields=None, limit=None):
+    """
+    回傳符合查詢的文件 [{"date", "field", "text"}]，依日期新到舊排序。
+    indexes 為依新到舊排列的 [(分割, SearchIndex)]；load_texts(分割) 回傳該分割各文件目前的原文 {doc: 原文}，
+    只在該分割有候選文件時呼叫。fields 限定欄位；limit 限定筆數。
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    # 以原文確認每個關鍵字（以空白分隔）都確實出現，同時排除索引尚未更新到的舊內容
+    terms = _normalize(query).split()
+    results = []
+    for shard, index in indexes:
+        docs = [(doc, *decode_doc(doc)) for doc in index.candidates(tokens)[::-1]]
+        docs = [d for d in docs if fields is None or d[2] in fields]
+        if not docs:
+            continue
+        texts = load_texts(shard)
+        for doc, date, field in docs:
+            text = texts.get(int(doc))
+            if not isinstance(text, str):
+                continue
+            normalized = _normalize(text)
+            if not all(term in normalized for term in terms):
+                continue
+            results.append({"date": date, "field": field, "text": text})
+            if limit is not None and len(results) >= limit:
+                return results
+    return results
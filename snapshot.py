@@ -0,0 +1,76 @@
+"""
+跨 session 共用的資料快照 Snapshot：某位使用者的每日紀錄（RecordTable）與每週反思，建立後不再修改。
+
+- 行程內每位使用者只有一份「目前的快照」（common.current_snapshot），所有瀏覽器 session
+  參照同一個物件，不再各自在 session_state 放一份紀錄。
+- with_changes() 以寫入時複製產生新版本：只記下變動的日期與週，底層的 RecordTable
+  與其餘的反思跟原快照共用。session 暫存尚未確認的編輯時用它得到只有自己看得到的版本；
+  存檔成功後 common 以同樣方式產生新版本並整個替換，其他 session 下次 rerun 就會看到。
+"""
+from types import MappingProxyType
+
+import pandas as pd
+
+from records import RecordTable
+
+
+def _day(value):
+    return pd.Timestamp(value).normalize()
+
+
+class Snapshot:
+    """
+    records 為 RecordTable，reflections 為 {週起始日 datetime.date: 反思內容}。
+    overlay 為 {日期: 紀錄 dict 或 None（已刪除）}，優先於 records。
+    """
+
+    def __init__(self, records, reflections, version=0, overlay=None):
+        self.records = records
+        self.reflections = MappingProxyType(dict(reflections))
+        self.version = version
+        self._overlay = MappingProxyType(dict(overlay or {}))
+
+    def with_changes(self, records=None, reflections=None, version=None):
+        """
+        回傳套用變動後的新快照，本快照不受影響。records 為 {日期: 紀錄 dict 或 None（刪除）}，
+        reflections 為 {週起始日: 內容}；version 省略時沿用本快照的版本。
+        """
+        overlay = dict(self._overlay)
+        for date, record in (records or {}).items():
+            if record is None or record.get("_deleted"):
+                overlay[_day(date)] = None
+            else:
+                overlay[_day(date)] = {**record, "date": pd.Timestamp(record.get("date", date))}
+        texts = {**self.reflections, **reflections} if reflections else self.reflections
+        return Snapshot(self.records, texts, self.version if version is None else version, overlay)
+
+    def get_record(self, date):
+        """取得某日的紀錄 dict（呼叫端可自由修改），沒有則回傳 None。"""
+        day = _day(date)
+        if day in self._overlay:
+            record = self._overlay[day]
+            return dict(record) if record is not None else None
+        return self.records.get(day)
+
+    def get_reflection(self, week_start):
+        """week_start 須為週起始日（datetime.date），沒有則回傳空字串。"""
+        return self.reflections.get(week_start, "")
+
+    def view(self, start=None, end=None, columns=None):
+        """
+        start~end（含）、限定 columns 的 DataFrame，依日期排序。沒有變動落在範圍內時
+        直接回傳 RecordTable.view()（與快照共用底層陣列，視為唯讀）；否則只複製這個範圍。
+        """
+        df = self.records.view(start, end, columns)
+        lo = _day(start) if start is not None else None
+        hi = _day(end) if end is not None else None
+        changed = {day: record for day, record in self._overlay.items()
+                   if (lo is None or day >= lo) and (hi is None or day <= hi)}
+        if not changed:
+            return df
+        df = df[~df["date"].dt.normalize().isin(list(changed))]
+        rows = pd.DataFrame([record for record in changed.values() if record is not None])
+        if not rows.empty and columns is not None:
+            rows = rows[["date"] + [c for c in columns if c != "date" and c in rows.columns]]
+        frames = [f for f in (df, rows) if not f.empty]
+        return RecordTable(pd.concat(frames, ignore_index=True) if frames else df).view()
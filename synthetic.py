@@ -0,0 +1,80 @@
+"""
+合成資料產生器：產生任意筆數（1k ~ 1M）的每日紀錄與每週反思，
+供基準測試與離線開發使用。欄位與型別與上傳頁面寫入的紀錄相同。
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import common
+
+DAYS_PER_USER = 3650  # 每位合成使用者最多十年的紀錄，總筆數超過時分給多位使用者
+MEAL_WORDS = ["蛋餅", "飯糰", "便當", "牛肉麵", "沙拉", "水餃", "炒飯", "鍋燒意麵", "三明治", "滷肉飯", ""]
+PHOTO_RATE = 0.3  # 有附照片的比例
+
+
+def generate_records(days, end=None, seed=0, user_id=common.DEFAULT_USER):
+    """
+    產生一位使用者連續 days 天（到 end 為止，預設今天）的每日紀錄，回傳 DataFrame。
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime.date.today())
+    dates = pd.date_range(end=end, periods=days, freq="D")
+    df = pd.DataFrame({
+        "date": dates,
+        "sleep_hours": np.round(np.clip(rng.normal(7, 1.2, days), 0, 24) * 2) / 2,
+        "sugary_drinks": rng.poisson(1.2, days),
+        "steps": np.round(np.clip(rng.normal(7000, 2500, days), 0, None), -2).astype(int),
+        "screen_time": np.round(np.clip(rng.normal(5, 2, days), 0, 24) * 2) / 2,
+    })
+    day_keys = dates.strftime("%Y%m%d")
+    host = f"https://storage.googleapis.com/{common.BUCKET_NAME}/"
+    user_prefix = common._user_path("", user_id)
+    thumb_prefix = f"{common.THUMB_PREFIX}{common.THUMB_GALLERY_WIDTH}/"
+    for field in common.IMAGE_FIELDS:
+        has_photo = rng.random(days) < PHOTO_RATE
+        names = user_prefix + day_keys + f"_{field}"
+        df[field] = np.where(has_photo, host + names + ".jpg", "")
+        df[common.thumb_field(field)] = np.where(has_photo, host + thumb_prefix + names + ".webp", "")
+    for meal in ["breakfast", "lunch", "dinner", "late_night"]:
+        df[f"{meal}_desc"] = np.asarray(MEAL_WORDS, dtype=object)[rng.integers(0, len(MEAL_WORDS), days)]
+    return df
+
+
+def generate_reflections(records, seed=0):
+    """為紀錄涵蓋的每一週產生一則反思（日期為該週週一）。"""
+    rng = np.random.default_rng(seed)
+    weeks = pd.DatetimeIndex(records["date"]).to_period("W").start_time.unique()
+    lengths = rng.integers(20, 200, len(weeks))
+    return pd.DataFrame({
+        "date": weeks,
+        "reflection": ["這週的上網與作息反思。" * (n // 10 + 1) for n in lengths],
+    })
+
+
+def synthetic_users(total, days_per_user=DAYS_PER_USER):
+    """將總筆數分給多位使用者，回傳 [(使用者代號, 天數)]；第一位一定有最多的天數。"""
+    users = []
+    remaining = total
+    while remaining > 0:
+        days = min(remaining, days_per_user)
+        users.append((f"bench{len(users):04d}", days))
+        remaining -= days
+    return users
+
+
+def seed_bucket(total, days_per_user=DAYS_PER_USER, seed=0):
+    """
+    在目前的儲存後端（通常是 LocalBucket）寫入 total 筆合成紀錄與對應的反思，
+    回傳 [(使用者代號, 天數)]。
+    """
+    users = synthetic_users(total, days_per_user)
+    for i, (user_id, days) in enumerate(users):
+        records = generate_records(days, seed=seed + i, user_id=user_id)
+        if not common.save_records(records.to_dict(orient="records"), user_id=user_id):
+            raise RuntimeError(f"failed to seed records for {user_id}")
+        reflections = generate_reflections(records, seed=seed + i)
+        if not common.save_reflections(reflections.to_dict(orient="records"), user_id=user_id):
+            raise RuntimeError(f"failed to seed reflections for {user_id}")
+    return users
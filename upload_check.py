@@ -0,0 +1,246 @@
+"""
+可續傳上傳的故障注入檢查：在本機啟動一個模擬 GCS resumable upload 協定的替身伺服器，
+於上傳途中切斷連線、回傳 503、弄丟最後一段的回應，確認 resumable.upload 會從伺服器
+已收到的位置續傳（不重新開始、不建立新的 session），且最後存下的內容與原檔完全相同。
+
+用法：
+    python upload_check.py                 # 預設 3 MiB 的檔案，每段 512 KiB
+    python upload_check.py --size-mb 20    # 指定檔案大小
+全部情境通過時回傳 0，否則回傳 1。
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import google_crc32c
+import requests
+
+import common
+import resumable
+
+BUCKET = common.BUCKET_NAME
+OBJECT_NAME = "evidence/check.bin"
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    只實作 resumable upload 用到的部分：建立 session（POST）、上傳一段或查詢進度（PUT），
+    以及 ifGenerationMatch=0 的條件。faults 中的動作依序在資料請求上觸發：
+        ("drop", n)      只收下前 n 個位元組就切斷連線（不回應）
+        ("status", code) 不收下任何資料，回傳該狀態碼
+        ("lose_reply",)  收下整段，但切斷連線、不回應
+        ("query", code)  下一次查詢進度時回傳該狀態碼
+        ("pass",)        放行一段資料請求（讓後面的故障落在指定的段）
+    """
+    daemon_threads = True
+
+    def __init__(self, faults=()):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.faults = list(faults)
+        self.objects = {}   # 物件名稱 -> bytes
+        self.sessions = {}  # session 編號 -> {"name", "data", "total"}
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def next_fault(self, kinds):
+        with self.lock:
+            if self.faults and self.faults[0][0] in kinds:
+                fault = self.faults.pop(0)
+                return None if fault[0] == "pass" else fault
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=None, headers=()):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _drop(self):
+        self.close_connection = True
+        self.connection.close()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        metadata = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        name = metadata["name"]
+        if query.get("ifGenerationMatch") == ["0"] and name in self.server.objects:
+            return self._reply(412, {"error": {"code": 412, "message": "conditionNotMet"}})
+        total = self.headers.get("X-Upload-Content-Length")
+        with self.server.lock:
+            session_id = str(len(self.server.sessions))
+            self.server.sessions[session_id] = {"name": name, "data": bytearray(),
+                                                "total": int(total) if total else None}
+        self._reply(200, headers=[("Location", f"{self.server.endpoint}/session/{session_id}")])
+
+    def _metadata(self, session):
+        data = bytes(session["data"])
+        crc = base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+        return {"bucket": BUCKET, "name": session["name"], "size": str(len(data)), "crc32c": crc,
+                "generation": "1"}
+
+    def _progress(self, session):
+        if session["total"] is not None and len(session["data"]) == session["total"]:
+            self.server.objects[session["name"]] = bytes(session["data"])
+            return self._reply(200, self._metadata(session))
+        headers = [("Range", f"bytes=0-{len(session['data']) - 1}")] if session["data"] else []
+        return self._reply(308, headers=headers)
+
+    def do_PUT(self):
+        session = self.server.sessions.get(self.path.rsplit("/", 1)[-1])
+        if session is None:
+            return self._reply(404)
+        length = int(self.headers.get("Content-Length", 0))
+        spec = self.headers["Content-Range"].split(" ", 1)[1]
+        span, total = spec.split("/")
+        if total != "*":
+            session["total"] = int(total)
+        if span == "*":
+            fault = self.server.next_fault({"query"})
+            if fault is not None:
+                return self._reply(fault[1])
+            return self._progress(session)
+        start = int(span.split("-")[0])
+        fault = self.server.next_fault({"pass", "drop", "status", "lose_reply"})
+        if fault is not None and fault[0] == "drop":
+            body = self._read(min(fault[1], length))
+            self._append(session, start, body)
+            return self._drop()
+        body = self._read(length)
+        if fault is not None and fault[0] == "status":
+            return self._reply(fault[1])
+        if start > len(session["data"]):
+            return self._reply(400, {"error": {"code": 400, "message": "non-contiguous range"}})
+        self._append(session, start, body)
+        if fault is not None:  # lose_reply
+            if session["total"] is not None and len(session["data"]) == session["total"]:
+                self.server.objects[session["name"]] = bytes(session["data"])
+            return self._drop()
+        return self._progress(session)
+
+    def _read(self, length):
+        body = self.rfile.read(length)
+        with self.server.lock:
+            self.server.bytes_received += len(body)
+        return body
+
+    def _append(self, session, start, body):
+        with self.server.lock:
+            # 與 GCS 相同：重送已收到的位元組時只保留新的部分
+            skip = len(session["data"]) - start
+            if 0 <= skip < len(body):
+                session["data"] += body[skip:]
+
+
+class _Stream:
+    """記錄讀取量的 BytesIO：用來確認續傳時沒有從頭重讀整個檔案。"""
+
+    def __init__(self, data):
+        self._buf = BytesIO(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._buf.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def __getattr__(self, name):
+        return getattr(self._buf, name)
+
+
+def _start(faults=(), objects=None):
+    server = StandInServer(faults)
+    server.objects.update(objects or {})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _check_scenario(name, data, faults):
+    """以 resumable.upload 上傳 data，回傳是否通過。"""
+    server = _start(faults)
+    stream = _Stream(data)
+    delays = []
+    try:
+        resumable.upload(requests.Session(), resumable.upload_url(server.endpoint, BUCKET), stream, OBJECT_NAME,
+                         "application/octet-stream", sleep=delays.append)
+        error = None
+    except Exception as e:
+        error = e
+    finally:
+        server.shutdown()
+    chunk = resumable.UPLOAD_CHUNK_SIZE
+    # 續傳只會重送失敗的那幾段：每次故障最多多送一段
+    limit = len(data) + len(faults) * chunk
+    ok = (error is None and server.objects.get(OBJECT_NAME) == data and len(server.sessions) == 1
+          and server.bytes_received <= limit and stream.bytes_read <= limit)
+    print(f"{'OK  ' if ok else 'FAIL'} {name}：伺服器收到 {server.bytes_received / len(data):.2f} 倍資料、"
+          f"{len(server.sessions)} 個 session、退避 {delays}" + (f"、錯誤 {error!r}" if error else ""))
+    return ok
+
+
+def _check_precondition(data):
+    """物件已存在且要求 ifGenerationMatch=0：不重試，common 中轉成 PreconditionFailed。"""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+
+    server = _start(objects={OBJECT_NAME: b"old"})
+    try:
+        client = storage.Client(project="upload-check", credentials=AnonymousCredentials(),
+                                client_options={"api_endpoint": server.endpoint})
+        blob = common._InstrumentedBlob(client.bucket(BUCKET).blob(OBJECT_NAME), {})
+        try:
+            blob.upload_resumable(data, if_generation_match=0)
+            rejected = False
+        except common.PreconditionFailed:
+            rejected = True
+        blob = common._InstrumentedBlob(client.bucket(BUCKET).blob("evidence/new.bin"), {})
+        blob.upload_resumable(data, if_generation_match=0)
+        stored = server.objects.get("evidence/new.bin")
+    finally:
+        server.shutdown()
+    ok = rejected and stored == data and server.objects[OBJECT_NAME] == b"old"
+    print(f"{'OK  ' if ok else 'FAIL'} 經由 common 上傳：物件已存在時得到 PreconditionFailed，新物件正常寫入")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="可續傳上傳的故障注入檢查")
+    parser.add_argument("--size-mb", type=float, default=3)
+    args = parser.parse_args(argv)
+    data = os.urandom(int(args.size_mb * 1024 * 1024))
+    chunk = resumable.UPLOAD_CHUNK_SIZE
+    chunks = -(-len(data) // chunk)
+    scenarios = [
+        ("無故障", []),
+        ("第 2 段傳到一半斷線", [("pass",), ("drop", chunk // 2)]),
+        ("連續 503 後恢復", [("status", 503)] * 3),
+        ("斷線後查詢進度也失敗", [("drop", 1000), ("query", 503), ("drop", chunk - 1)]),
+        ("最後一段的回應遺失", [("pass",)] * (chunks - 1) + [("lose_reply",)]),
+    ]
+    results = [_check_scenario(name, data, faults) for name, faults in scenarios]
+    results.append(_check_precondition(data))
+    failed = results.count(False)
+    print("全部通過" if not failed else f"{failed} 個情境失敗")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
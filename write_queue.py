@@ -0,0 +1,264 @@
+"""
+本機的延後寫入佇列（write-behind）：頁面送出的紀錄先寫進 SQLite 檔案就立即返回，
+由背景執行緒批次寫到儲存空間。
+
+- 佇列存在磁碟上，伺服器重新啟動後未寫出的項目仍會繼續寫出。
+- 同一使用者、同一種類的項目一次寫出；同一個 key（例如同一天）的多次寫入只保留最後一次：
+  排入新項目時，同一個 key 較舊的項目（包括正在退避重試的）標記為已被取代，之後不會再寫出，
+  也不會再疊在讀取結果上。
+- 寫出失敗時以指數退避重試，項目不會被丟棄。
+- 每個項目寫出前先「認領」一段時間，多個行程共用同一個佇列檔時不會重複寫出。
+
+寫出的方式由使用端以 register(kind, handler) 註冊：handler(user_id, {key: payload}) 失敗時應拋出例外；
+可回傳 {key: 結果}（例如 "merged"），記在該 key 的項目上，寫出後仍可由 status() 查詢。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import timed
+
+QUEUE_DB = os.environ.get("INTERNET_HEALTH_QUEUE_DB",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "write_queue.sqlite3"))
+BATCH_DELAY_SECONDS = 1.0    # 收到新項目後稍等，讓短時間內的多次寫入合併成一次
+POLL_SECONDS = 30            # 沒有新項目時，多久檢查一次待重試的項目
+CLAIM_SECONDS = 120          # 認領後未完成（例如行程中止）多久可由其他行程接手
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+RESULT_KEEP_SECONDS = 24 * 3600  # 已寫出項目的結果保留多久
+SUPERSEDED = "superseded"  # results 中已被取代、未寫出的項目
+
+_lock = threading.Lock()
+_conn = None
+_handlers = {}
+_wake = threading.Event()
+_worker = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    superseded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_by_user ON entries (kind, user_id);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    outcome TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+"""
+
+
+def register(kind, handler):
+    """註冊某種項目的寫出函式 handler(user_id, {key: payload})，可回傳 {key: 結果}。"""
+    _handlers[kind] = handler
+
+
+def _connect(create):
+    """回傳共用的連線；create 為 False 且佇列檔不存在時回傳 None（唯讀情境不建立檔案）。"""
+    global _conn
+    if _conn is None:
+        if not create and not os.path.exists(QUEUE_DB):
+            return None
+        conn = sqlite3.connect(QUEUE_DB, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+        if "superseded" not in columns:  # 舊版建立的佇列檔
+            conn.execute("ALTER TABLE entries ADD COLUMN superseded INTEGER NOT NULL DEFAULT 0")
+        _conn = conn
+    return _conn
+
+
+def enqueue(kind, user_id, key, payload):
+    """
+    將項目寫入佇列（寫入磁碟後才返回），回傳項目編號。同一個 key 較舊的項目在同一個交易中
+    標記為已被取代並設為立即到期，下次寫出時直接完成、不會寫出，避免退避後的舊內容蓋掉新的。
+    """
+    with _lock:
+        conn = _connect(create=True)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE entries SET superseded = 1, next_attempt_at = 0 "
+                         "WHERE kind = ? AND user_id = ? AND key = ? AND superseded = 0", (kind, user_id, key))
+            cur = conn.execute(
+                "INSERT INTO entries (kind, user_id, key, payload, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, user_id, key, payload, time.time()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        entry_id = cur.lastrowid
+    start_worker()
+    _wake.set()
+    return entry_id
+
+
+def pending(kind, user_id):
+    """尚未寫出的項目 {key: payload}；同一個 key 只有最新的項目，已被取代的不列入。"""
+    with _lock:
+        conn = _connect(create=False)
+        if conn is None:
+            return {}
+        rows = conn.execute("SELECT key, payload FROM entries WHERE kind = ? AND user_id = ? AND superseded = 0 "
+                            "ORDER BY id", (kind, user_id)).fetchall()
+    if rows:
+        start_worker()
+    return dict(rows)
+
+
+def status(entry_id):
+    """
+    回傳項目狀態 {"state", "attempts", "last_error", "outcome"}；state 為 "queued"（等待寫出）、
+    "retrying"（寫出失敗，等待重試）、"persisted"（已寫出，項目已不在佇列中）
+    或 "superseded"（同一個 key 之後又排入了較新的項目，本項目不會寫出）。
+    outcome 為寫出時 handler 回報的結果（例如 "merged"），沒有則為 None。
+    """
+    with _lock:
+        conn = _connect(create=False)
+        row = conn and conn.execute("SELECT attempts, last_error, superseded FROM entries WHERE id = ?",
+                                    (entry_id,)).fetchone()
+        result = None
+        if conn and row is None:
+            result = conn.execute("SELECT outcome FROM results WHERE id = ?", (entry_id,)).fetchone()
+    if row is None:
+        outcome = result and result[0]
+        state = "superseded" if outcome == SUPERSEDED else "persisted"
+        return {"state": state, "attempts": 0, "last_error": None, "outcome": None if outcome == SUPERSEDED else outcome}
+    attempts, last_error, superseded = row
+    if superseded:
+        return {"state": "superseded", "attempts": attempts, "last_error": last_error, "outcome": None}
+    return {"state": "retrying" if attempts else "queued", "attempts": attempts, "last_error": last_error,
+            "outcome": None}
+
+
+def counts(user_id=None):
+    """佇列中的項目數 {"queued", "retrying"}；user_id 為 None 時統計所有使用者。"""
+    sql = "SELECT SUM(attempts = 0), SUM(attempts > 0) FROM entries WHERE superseded = 0"
+    params = ()
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params = (user_id,)
+    with _lock:
+        conn = _connect(create=False)
+        row = conn.execute(sql, params).fetchone() if conn is not None else None
+    queued, retrying = row or (0, 0)
+    return {"queued": queued or 0, "retrying": retrying or 0}
+
+
+def _claim_due(now):
+    """認領所有到期的項目，回傳 [(id, kind, user_id, key, payload, superseded)]。"""
+    with _lock:
+        conn = _connect(create=False)
+        if conn is None:
+            return []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, user_id, key, payload, superseded FROM entries WHERE next_attempt_at <= ? ORDER BY id",
+                (now,)).fetchall()
+            if rows:
+                conn.executemany("UPDATE entries SET next_attempt_at = ? WHERE id = ?",
+                                 [(now + CLAIM_SECONDS, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return rows
+
+
+def _finish(ids, outcomes=()):
+    """刪除已寫出的項目；outcomes 為 [(id, 結果)]，保留 RESULT_KEEP_SECONDS 供 status() 查詢。"""
+    now = time.time()
+    with _lock:
+        _conn.executemany("DELETE FROM entries WHERE id = ?", [(i,) for i in ids])
+        _conn.executemany("INSERT OR REPLACE INTO results (id, outcome, finished_at) VALUES (?, ?, ?)",
+                          [(i, outcome, now) for i, outcome in outcomes])
+        _conn.execute("DELETE FROM results WHERE finished_at < ?", (now - RESULT_KEEP_SECONDS,))
+
+
+def _fail(ids, error):
+    now = time.time()
+    with _lock:
+        for entry_id in ids:
+            attempts = _conn.execute("SELECT attempts FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            if attempts is None:
+                continue
+            delay = min(RETRY_BASE_SECONDS * 2 ** attempts[0], RETRY_MAX_SECONDS)
+            _conn.execute("UPDATE entries SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                          (now + delay, error, entry_id))
+
+
+def flush():
+    """
+    立即寫出所有到期的項目。同一使用者、同一種類合併成一次 handler 呼叫；
+    已被取代的項目直接完成，不交給 handler。回傳 (寫出的項目數, 失敗的項目數)。
+    """
+    groups = {}
+    superseded = []
+    for entry_id, kind, user_id, key, payload, replaced in _claim_due(time.time()):
+        if replaced:
+            superseded.append(entry_id)
+            continue
+        ids, payloads = groups.setdefault((kind, user_id), ({}, {}))
+        ids[entry_id] = key
+        payloads[key] = payload  # 依編號順序，後寫入的覆蓋先前的
+    if superseded:
+        _finish(superseded, [(i, SUPERSEDED) for i in superseded])
+    written = failed = 0
+    for (kind, user_id), (ids, payloads) in groups.items():
+        try:
+            handler = _handlers[kind]
+            with timed(f"queue.flush.{kind}"):
+                outcomes = handler(user_id, payloads) or {}
+        except Exception as e:
+            print("Error flushing queue:", e)
+            _fail(ids, str(e) or type(e).__name__)
+            failed += len(ids)
+        else:
+            # 同一個 key 合併寫出的項目共用同一個結果
+            _finish(ids, [(i, outcomes[key]) for i, key in ids.items() if key in outcomes])
+            written += len(ids)
+    return written, failed
+
+
+def _seconds_until_due():
+    """距離下一個待重試項目到期的秒數（最多 POLL_SECONDS）。"""
+    with _lock:
+        conn = _connect(create=False)
+        row = conn.execute("SELECT MIN(next_attempt_at) FROM entries").fetchone() if conn is not None else None
+    if row is None or row[0] is None:
+        return POLL_SECONDS
+    return min(max(row[0] - time.time(), 1), POLL_SECONDS)
+
+
+def _run():
+    while True:
+        _wake.wait(_seconds_until_due())
+        if _wake.is_set():
+            time.sleep(BATCH_DELAY_SECONDS)
+            _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            print("Error flushing queue:", e)
+
+
+def start_worker():
+    """啟動背景寫出執行緒（每個行程一個）。"""
+    global _worker
+    if _worker is not None:
+        return
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name="write-queue", daemon=True)
+            _worker.start()
+            _wake.set()  # 啟動時先寫出上一個行程留下的項目